@@ -1,26 +1,65 @@
 # -*- coding: utf-8 -*-
 import argparse
 from ast import literal_eval
+import sys
 
+from crud import bulk, indexes, stats
+from crud.batch import Batch, get_batch_size
 from crud.controllers import controller_mapping
-from crud.views import view_mapping
+from crud.layouts import convert_relations, layout_mapping, migrate
+from crud.models import model_registry
+from crud.views import Filter, scan_count, view_mapping
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument(
         "operation",
-        choices=["get", "create", "update", "filter", "deactivate"]
+        choices=["get", "create", "update", "filter", "deactivate", "migrate", "convert", "reindex", "import", "export", "batch"]
     )
     parser.add_argument(
         "type",
-        choices=["sport", "event", "selection"]
+        nargs="?",
+        choices=["sport", "event", "selection"],
+        help="required by every operation but batch"
     )
     parser.add_argument(
         "pattern",
         nargs="*"
     )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="filter: print results as they are found instead of all at once"
+    )
+    parser.add_argument("--limit", type=int, default=None, help="filter: maximum number of results")
+    parser.add_argument("--offset", type=int, default=0, help="filter: number of results to skip")
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=None,
+        help=(
+            f"import, export: models written or read per round trip (default {bulk.batch_size}); "
+            f"batch: consecutive gets read per round trip (default {get_batch_size})"
+        )
+    )
+    parser.add_argument(
+        "--trusted",
+        action="store_true",
+        help="import: skip validation and foreign key checks, e.g. for an export of another database"
+    )
+    parser.add_argument("--input", default=None, help="batch: read operations from this file instead of stdin")
+    parser.add_argument("--output", default=None, help="export: write to this file instead of stdout")
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help="print the commands sent and the round trips' latency, per operation"
+    )
     args = parser.parse_args()
+    if args.type is None and args.operation != "batch":
+        parser.error("the following arguments are required: type")
+    if args.stats:
+        stats.enable()
 
     if args.operation == "get":
        view = view_mapping[args.type]
@@ -50,8 +89,58 @@ if __name__ == "__main__":
         result = deactivate_func(model_id)
         print(result)
     elif args.operation == "filter":
-        view = view_mapping[args.type]
-        filter_func = getattr(view, f"get_{args.type}_filtered")
         filter_pattern = ' '.join(args.pattern)
-        result = filter_func(filter_pattern)
-        print(result)
+        filter = Filter(args.type, filter_pattern)
+        if args.stream or args.limit is not None or args.offset > 0:
+            for result in filter.stream(args.limit, args.offset):
+                print(result)
+        else:
+            result = filter.filter()
+            print(result)
+    elif args.operation == "migrate":
+        model = model_registry[args.type]
+        target = layout_mapping[args.pattern[0]]
+        source = next(layout for layout in layout_mapping.values() if layout is not target)
+        result = migrate(model, source, target, scan_count)
+        print(f"Migrated {result} {args.type} objects to the {target.name} layout.")
+    elif args.operation == "convert":
+        model = model_registry[args.type]
+        result = convert_relations(model, scan_count)
+        print(f"Converted {result} {args.type} relations to sets.")
+    elif args.operation == "reindex":
+        model = model_registry[args.type]
+        result = indexes.rebuild(model, scan_count)
+        print(f"Indexed {result} {args.type} objects.")
+    elif args.operation == "import":
+        # JSONL, or CSV if the file name ends in .csv; "-" or no file name reads stdin.
+        path = args.pattern[0] if len(args.pattern) > 0 else "-"
+        with (sys.stdin if path == "-" else open(path, newline="")) as f:
+            if path.endswith(".csv"):
+                records = bulk.read_csv(f, args.type)
+            else:
+                records = bulk.read_jsonl(f, args.type)
+            result = bulk.import_records(records, args.batch_size or bulk.batch_size, args.trusted)
+        counts = ", ".join(f"{count} {model_name}" for model_name, count in result.items())
+        print(f"Imported {counts or 'no'} objects.")
+    elif args.operation == "export":
+        # Every object of each type given, e.g. "export sport event selection", as JSONL.
+        model_names = (args.type, *args.pattern)
+        unknown = [model_name for model_name in model_names if model_name not in model_registry]
+        if len(unknown) > 0:
+            parser.error(f"unknown types: {', '.join(unknown)}")
+        records = bulk.export_records(model_names, args.batch_size or bulk.batch_size)
+        if args.output is None:
+            result = bulk.write_jsonl(records, sys.stdout)
+        else:
+            with open(args.output, "w") as f:
+                result = bulk.write_jsonl(records, f)
+        print(f"Exported {result} objects.", file=sys.stderr)
+    elif args.operation == "batch":
+        # One operation per line, answered with a line of JSON each; see crud/batch.py.
+        with (sys.stdin if args.input in (None, "-") else open(args.input)) as f:
+            failed = Batch(sys.stdout, args.batch_size or get_batch_size).run(f)
+        if failed > 0:
+            print(f"{failed} operations failed.", file=sys.stderr)
+
+    if args.stats:
+        print(stats.recorder.export(stats.summary))
@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+# Async counterparts of the models' reads and writes, the views and the controllers.
+# Commands are built by the models themselves, so keys, converters and validation
+# are shared with the synchronous API; only sending them differs.
+# The client cache is read as by the synchronous API, on its own tracked connection.
+from datetime import datetime
+
+from redis.exceptions import NoScriptError
+
+from . import database, query, scripts, stats
+from .cache import object_cache, uncached
+from .database import async_connection, async_transaction, reads_replica
+from .layouts import flatten
+from .models import Event, Selection, Sport, model_registry, write_on_init
+from .utils import IDs, log
+from .views import compile_filter
+
+
+async def _exec(command: str, *values):
+    with stats.timed([(command, *values)]):
+        return await database.async_reader().execute_command(command, *values)
+
+
+async def _exec_pipeline(commands: list) -> list:
+    # Every command is sent in a single round trip.
+    async with database.async_reader().pipeline(transaction=False) as pipeline:
+        for command in commands:
+            pipeline.execute_command(*command)
+        with stats.timed(commands, "PIPELINE"):
+            return await pipeline.execute()
+
+
+async def _run(reads):
+    # Sends a generator of reads asynchronously, as query.run does synchronously.
+    try:
+        commands = next(reads)
+        while True:
+            if len(commands) == 1:
+                results = [await _exec(*commands[0])]
+            else:
+                results = await _exec_pipeline(commands) if len(commands) > 0 else []
+            commands = reads.send(results)
+    except StopIteration as stop:
+        return stop.value
+
+
+async def _load_scripts(commands: list):
+    # See scripts.load_missing.
+    shas = scripts.called(commands)
+    if len(shas) == 0:
+        return
+    with stats.timed([("SCRIPT", "EXISTS", *shas)]):
+        exists = await async_connection.execute_command("SCRIPT", "EXISTS", *shas)
+    for sha, loaded in zip(shas, exists):
+        if not loaded:
+            await async_connection.execute_command("SCRIPT", "LOAD", scripts.scripts_by_sha[sha].source)
+
+
+async def _exec_transaction(commands: list):
+    await _load_scripts(commands)
+    async with async_transaction() as pipeline:
+        for command in commands:
+            pipeline.execute_command(*command)
+    if database.client_cache is not None:
+        database.client_cache.invalidate_commands(commands)
+
+
+async def _exec_script(script, *args):
+    try:
+        with stats.timed([("EVALSHA", script.sha, 0, *args)], model=args[0]):
+            result = await async_connection.execute_command("EVALSHA", script.sha, 0, *args)
+    except NoScriptError:
+        with stats.timed([("EVAL", script.source, 0, *args)], model=args[0]):
+            result = await async_connection.execute_command("EVAL", script.source, 0, *args)
+    database.wrote()
+    return result
+
+
+async def _resolve_foreign_keys(model, references: dict):
+    commands, referenced = model._foreign_key_reads(references)
+    if len(commands) == 0:
+        return
+    try:
+        model._check_foreign_keys(referenced, flatten(await _exec_pipeline(commands)))
+    except:
+        log.exception(f"Something went wrong while attempting to resolve foreign keys.")
+        raise
+
+
+async def _write_commands(model, id: int, values: dict, stored_before: bool = True) -> list:
+    await _resolve_foreign_keys(model, model._references(values))
+    return model._writes(id, values, stored_before)
+
+
+async def _read_values(model, ids: list) -> dict:
+    key_names, reads = model._values_reads(ids)
+    results = await _exec_pipeline([c for commands in reads for c in commands])
+    return model._parse_values(ids, key_names, reads, results)
+
+
+async def get(model, id: int, key_name: str):
+    if model._client_cached(key_name):
+        return model._convert(key_name, database.client_cache.get(model._generate_key(id, key_name)))
+    command = model._layout.read_command(model, id, key_name)
+    return model._convert(key_name, await _exec(*command))
+
+
+async def put(model, id: int, key_name: str, value):
+    await _exec_transaction(await _write_commands(model, id, {key_name: value}))
+    object_cache.invalidate(model._name(), id)
+
+
+async def put_model(inst):
+    model = type(inst)
+    values, commands = inst._changes()
+    if len(values) > 0:
+        inst._commands.extend(await _write_commands(model, inst.id, values, inst._stored_before()))
+    inst._commands.extend(commands)
+    if len(inst._commands) > 0:
+        pending, inst._commands = inst._commands, []
+        await _exec_transaction(pending)
+        object_cache.invalidate(model._name(), inst.id)
+    inst._clean()
+
+
+async def load_many(model, ids: list) -> list:
+    ids = [int(id) for id in ids]
+    generation = object_cache.generation()
+    values = model._cached_values(ids)
+    unread = [id for id in dict.fromkeys(ids) if id not in values]
+    read = await _read_values(model, unread) if len(unread) > 0 else {}
+    return model._loaded(ids, values, read, generation)
+
+
+async def load(model, id: int):
+    return (await load_many(model, [id]))[0]
+
+
+async def new(model, *args, **kwargs):
+    # Validated on instantiation as by Model.new, then written here instead.
+    token = write_on_init.set(False)
+    try:
+        inst = model(*args, id=IDs.generate_id(), **kwargs)
+    finally:
+        write_on_init.reset(token)
+    await put_model(inst)
+    return inst
+
+
+async def activate(inst):
+    inst.active = True
+    await put_model(inst)
+
+
+async def deactivate(inst):
+    inst.active = False
+    await put_model(inst)
+
+
+async def deactivate_cascade(model, id: int, parent: str, children: str = None) -> bool:
+    result = await _exec_script(scripts.deactivate_cascade, *model._cascade_args(id, parent, children))
+    return model._cascaded(id, parent, children, result)
+
+
+async def filtered(model_type: str, filter_string: str) -> list:
+    model = model_registry[model_type]
+    predicate = compile_filter(model_type, filter_string)
+    ids = await _run(query.plan(predicate, model))
+    return await load_many(model, ids)
+
+
+@stats.operations
+class AsyncSportView:
+    @staticmethod
+    @reads_replica
+    async def get_sport(sport_id: int):
+        return await load(Sport, sport_id)
+
+    @staticmethod
+    @reads_replica
+    async def get_sports(sport_ids: list):
+        return await load_many(Sport, sport_ids)
+
+    @staticmethod
+    @reads_replica
+    async def get_sport_filtered(filter_string: str):
+        return await filtered("sport", filter_string)
+
+
+@stats.operations
+class AsyncEventView:
+    @staticmethod
+    @reads_replica
+    async def get_event(event_id: int):
+        return await load(Event, event_id)
+
+    @staticmethod
+    @reads_replica
+    async def get_events(event_ids: list):
+        return await load_many(Event, event_ids)
+
+    @staticmethod
+    @reads_replica
+    async def get_events_filtered(filter_string: str):
+        return await filtered("event", filter_string)
+
+
+@stats.operations
+class AsyncSelectionView:
+    @staticmethod
+    @reads_replica
+    async def get_selection(selection_id: int):
+        return await load(Selection, selection_id)
+
+    @staticmethod
+    @reads_replica
+    async def get_selections(selection_ids: list):
+        return await load_many(Selection, selection_ids)
+
+    @staticmethod
+    @reads_replica
+    async def get_selections_filtered(filter_string: str):
+        return await filtered("selection", filter_string)
+
+
+@stats.operations
+class AsyncSportController:
+    @staticmethod
+    async def create_sport(name: str, active: bool = False):
+        return await new(Sport, name=name, active=active)
+
+    @staticmethod
+    @uncached
+    async def update_sport(sport_id: int, **kwargs):
+        sport = await load(Sport, sport_id)
+        sport.update(**kwargs)
+        await put_model(sport)
+        return sport
+
+    @staticmethod
+    @uncached
+    async def update_sport_events(sport_id: int, event_ids: list):
+        sport = await load(Sport, sport_id)
+        sport.events = event_ids
+        await put_model(sport)
+        return sport
+
+    @staticmethod
+    @uncached
+    async def deactivate_sport(sport_id: int):
+        sport = await load(Sport, sport_id)
+        await deactivate(sport)
+        return sport
+
+
+@stats.operations
+class AsyncEventController:
+    @staticmethod
+    async def create_event(name: str, type: int, sport: int, status: int, scheduled_start: float):
+        return await new(
+            Event, name=name, type=type, sport=sport, status=status,
+            scheduled_start=datetime.fromtimestamp(scheduled_start)
+        )
+
+    @staticmethod
+    @uncached
+    async def update_event(event_id: int, **kwargs):
+        event = await load(Event, event_id)
+        event.update(**kwargs)
+        await put_model(event)
+        return event
+
+    @staticmethod
+    @uncached
+    async def update_event_selections(event_id: int, selection_ids: list):
+        event = await load(Event, event_id)
+        event.selections = selection_ids
+        await put_model(event)
+        return event
+
+    @staticmethod
+    @uncached
+    async def deactivate_event(event_id: int):
+        await deactivate_cascade(Event, event_id, parent="sport", children="selections")
+        return await load(Event, event_id)
+
+
+@stats.operations
+class AsyncSelectionController:
+    @staticmethod
+    async def create_selection(name: str, event: int, price: float, outcome: int):
+        return await new(Selection, name=name, event=event, price=price, outcome=outcome)
+
+    @staticmethod
+    @uncached
+    async def update_selection(selection_id: int, **kwargs):
+        selection = await load(Selection, selection_id)
+        selection.update(**kwargs)
+        await put_model(selection)
+        return selection
+
+    @staticmethod
+    @uncached
+    async def deactivate_selection(selection_id: int):
+        await deactivate_cascade(Selection, selection_id, parent="event")
+        return await load(Selection, selection_id)
+
+
+async_view_mapping = {
+    "sport": AsyncSportView,
+    "event": AsyncEventView,
+    "selection": AsyncSelectionView
+}
+
+async_controller_mapping = {
+    "sport": AsyncSportController,
+    "event": AsyncEventController,
+    "selection": AsyncSelectionController
+}
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+# Runs many operations in one process, over its one connection pool, for scripts which
+# would otherwise start cmdline.py once per operation. Each line is an operation, either
+# as it is given to cmdline.py or as a JSON object:
+#
+#   get sport 1
+#   update sport 1 "{'name': 'Darts'}"
+#   {"op": "update", "type": "sport", "id": 1, "fields": {"name": "Darts"}}
+#   {"op": "filter", "type": "event", "filter": "status==1", "limit": 10}
+#
+# and produces a line of JSON, in the same order: {"line": 1, "result": ...} or
+# {"line": 1, "error": "..."}. Consecutive gets of one type are read in one pipeline.
+from ast import literal_eval
+import json
+import shlex
+
+from . import database
+from .bulk import json_default
+from .controllers import controller_mapping
+from .errors import MissingResultException
+from .models import model_registry
+from .views import EventView, SelectionView, SportView, view_mapping
+
+# The fields each operation takes, besides its type.
+operations = {
+    "get": ("id",),
+    "create": ("fields",),
+    "update": ("id", "fields"),
+    "deactivate": ("id",),
+    "filter": ("filter",)
+}
+
+# The most gets read in one pipeline. Results of gets are written once a line which is not
+# another get of the same type is read, so scripts which wait for each result should use 1.
+get_batch_size = 100
+
+filtered_mapping = {
+    "sport": (SportView.get_sport_filtered, SportView.stream_sport_filtered),
+    "event": (EventView.get_events_filtered, EventView.stream_events_filtered),
+    "selection": (SelectionView.get_selections_filtered, SelectionView.stream_selections_filtered)
+}
+
+
+def parse(line: str) -> dict:
+    if line.lstrip().startswith("{"):
+        op = json.loads(line)
+    else:
+        words = shlex.split(line)
+        op = {"op": words[0], "type": words[1] if len(words) > 1 else None}
+        pattern = words[2:]
+        if op["op"] in ("get", "deactivate"):
+            op["id"] = pattern[0]
+        elif op["op"] == "create":
+            op["fields"] = literal_eval(pattern[0])
+        elif op["op"] == "update":
+            op["id"], op["fields"] = pattern[0], literal_eval(pattern[1])
+        elif op["op"] == "filter":
+            op["filter"] = " ".join(pattern)
+
+    if op.get("op") not in operations:
+        raise ValueError(f"Unknown operation. op={op.get('op')}")
+    if op.get("type") not in model_registry:
+        raise ValueError(f"Unknown type. type={op.get('type')}")
+    missing = [name for name in operations[op["op"]] if name not in op]
+    if len(missing) > 0:
+        raise ValueError(f"Missing fields. fields={missing}")
+    return op
+
+
+def record(inst) -> dict:
+    # The same fields as an exported object.
+    result = {"model": inst._name(), "id": inst.id}
+    for f in inst._stored_fields():
+        result[f.name] = getattr(inst, f.name)
+    return result
+
+
+class Batch:
+    def __init__(self, out, get_batch_size: int = get_batch_size):
+        self.out = out
+        self.get_batch_size = get_batch_size
+        # (line number, op) of gets not yet read.
+        self.gets = []
+        self.failed = 0
+
+    def _write(self, number: int, result=None, error: Exception = None):
+        if error is not None:
+            self.failed += 1
+            line = {"line": number, "error": f"{type(error).__name__}: {error}"}
+        else:
+            line = {"line": number, "result": result}
+        self.out.write(json.dumps(line, default=json_default) + "\n")
+
+    def _read_gets(self):
+        if len(self.gets) == 0:
+            return
+        gets, self.gets = self.gets, []
+        model_type = gets[0][1]["type"]
+        view = view_mapping[model_type]
+        try:
+            ids = [int(op["id"]) for _, op in gets]
+            models = getattr(view, f"get_{model_type}s")(ids)
+        except (MissingResultException, ValueError):
+            # Read one at a time, to find which failed.
+            for number, op in gets:
+                try:
+                    self._write(number, record(getattr(view, f"get_{model_type}")(int(op["id"]))))
+                except Exception as e:
+                    self._write(number, error=e)
+        else:
+            for (number, _), model in zip(gets, models):
+                self._write(number, record(model))
+        self.out.flush()
+
+    def _execute(self, op: dict):
+        model_type = op["type"]
+        controller = controller_mapping[model_type]
+        if op["op"] == "create":
+            return record(getattr(controller, f"create_{model_type}")(**op["fields"]))
+        if op["op"] == "update":
+            return record(getattr(controller, f"update_{model_type}")(int(op["id"]), **op["fields"]))
+        if op["op"] == "deactivate":
+            return record(getattr(controller, f"deactivate_{model_type}")(int(op["id"])))
+
+        get_filtered, stream_filtered = filtered_mapping[model_type]
+        limit, offset = op.get("limit"), op.get("offset") or 0
+        if limit is not None or offset > 0:
+            results = stream_filtered(op["filter"], limit, offset)
+        else:
+            results = get_filtered(op["filter"])
+        return [record(model) for model in results]
+
+    def run(self, lines) -> int:
+        # Returns the number of operations which failed. Blank lines and lines starting
+        # with # are skipped. Reads see the writes of the lines before them.
+        with database.session():
+            for number, line in enumerate(lines, 1):
+                if line.strip() == "" or line.lstrip().startswith("#"):
+                    continue
+                try:
+                    op = parse(line)
+                except (ValueError, SyntaxError, IndexError) as e:
+                    self._read_gets()
+                    self._write(number, error=e)
+                    continue
+
+                if op["op"] == "get":
+                    if len(self.gets) > 0 and self.gets[0][1]["type"] != op["type"]:
+                        self._read_gets()
+                    self.gets.append((number, op))
+                    if len(self.gets) >= self.get_batch_size:
+                        self._read_gets()
+                    continue
+
+                self._read_gets()
+                try:
+                    self._write(number, self._execute(op))
+                except Exception as e:
+                    self._write(number, error=e)
+                self.out.flush()
+            self._read_gets()
+        return self.failed
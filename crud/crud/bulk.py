@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+# Imports sports, events and selections from JSONL, CSV or any iterable of records,
+# a batch at a time. Each batch is validated, its foreign keys are checked in one
+# pipeline and it is written in another, instead of a transaction per model.
+# Exports walk the id index and read a batch of models per pipeline.
+#
+#   with open("events.jsonl") as f:
+#       bulk.import_records(bulk.read_jsonl(f), batch_size=5000)
+#
+#   with open("graph.jsonl", "w") as f:
+#       bulk.write_jsonl(bulk.export_records(), f)
+#
+# A record is a dict of a model's fields and the name of its model, e.g.
+#   {"model": "selection", "name": "Draw", "event": 1, "price": 3.5, "outcome": 0}
+# Parents must come before the children which refer to them.
+import csv
+from collections import Counter
+from datetime import datetime
+from itertools import islice
+import json
+
+from . import database, indexes, scripts, stats
+from .cache import object_cache
+from .errors import ValidationException
+from .layouts import flatten
+from .models import model_registry, validate_on_init, write_on_init
+from .utils import IDs
+
+batch_size = 1000
+
+
+def read_jsonl(lines, model: str = None):
+    # Records without a "model" are of the given one.
+    for line in lines:
+        if line.strip() == "":
+            continue
+        record = json.loads(line)
+        if model is not None:
+            record.setdefault("model", model)
+        yield record
+
+
+def read_csv(lines, model: str):
+    # One model per file, with a header row of field names.
+    for row in csv.DictReader(lines):
+        yield {"model": model, **row}
+
+
+def _model(record: dict):
+    record = dict(record)
+    model_name = record.pop("model", None)
+    try:
+        return model_registry[model_name], record
+    except KeyError:
+        raise ValidationException(f"Unknown model. model={model_name}")
+
+
+def _coerce(f, value):
+    # Values read from CSV are strings, and datetimes in JSON are ISO 8601 strings
+    # or UTC timestamps.
+    if value is None or (value == "" and f.type is not str):
+        return None
+    if f.type == datetime:
+        if isinstance(value, datetime):
+            return value
+        if isinstance(value, (int, float)):
+            return datetime.utcfromtimestamp(value)
+        return datetime.fromisoformat(value)
+    if f.type == list:
+        if isinstance(value, str):
+            value = json.loads(value)
+        return [int(id) for id in value]
+    if f.type == bool:
+        if isinstance(value, str):
+            return value.strip().lower() in ("1", "true", "yes")
+        return bool(value)
+    if f.type in (int, float):
+        return f.type(value)
+    return value
+
+
+def _instance(model, record: dict):
+    stored = {f.name: f for f in model._stored_fields()}
+    unknown = set(record) - set(stored) - {"id", "slug"}
+    if len(unknown) > 0:
+        raise ValidationException(f"Unknown fields. fields={sorted(unknown)}")
+
+    values = {
+        key_name: _coerce(stored[key_name], value)
+        for key_name, value in record.items() if key_name in stored
+    }
+    id = int(record["id"]) if record.get("id") not in (None, "") else IDs.generate_id()
+    # Stored fields which are not set on initialisation, e.g. an event's actual_start.
+    post = {
+        key_name: values.pop(key_name)
+        for key_name in list(values) if not stored[key_name].init
+    }
+    values = {key_name: value for key_name, value in values.items() if value is not None}
+    inst = model(id=id, **values)
+    for key_name, value in post.items():
+        if value is not None:
+            setattr(inst, key_name, value)
+    return inst
+
+
+def _unchecked(model, references: dict, created: set) -> dict:
+    # Drops the references to models created earlier in the same batch.
+    unchecked = {}
+    for key_name, value in references.items():
+        referenced = model._foreign_keys[key_name]
+        if isinstance(value, list):
+            value = [id for id in value if (referenced, id) not in created]
+            if len(value) > 0:
+                unchecked[key_name] = value
+        elif (referenced, value) not in created:
+            unchecked[key_name] = value
+    return unchecked
+
+
+def _exec_pipeline(commands: list) -> list:
+    # Imports read and write the primary only.
+    scripts.load_missing(database.connection.execute_command, commands)
+    pipeline = database.connection.pipeline(transaction=False)
+    for command in commands:
+        pipeline.execute_command(*command)
+    with stats.timed(commands, "PIPELINE"):
+        return pipeline.execute()
+
+
+def _parent_reads(instances: list, given_ids: set) -> list:
+    # (model, parent field, read command) of the parent each model with a given id may
+    # have been stored under before.
+    return [
+        (inst, key_name, type(inst)._layout.read_command(type(inst), inst.id, key_name))
+        for inst in instances if (inst._name(), inst.id) in given_ids
+        for key_name in inst._active_parents
+    ]
+
+
+def _move_commands(parent_reads: list, results: list) -> tuple:
+    # Removes models imported under a new parent from the relation and the active
+    # children of the parent they were stored under. Returns the commands and the
+    # (model name, id) of the parents they change.
+    commands = []
+    moved_from = set()
+    for (inst, key_name, _), stored in zip(parent_reads, results):
+        if stored is None or int(stored) == getattr(inst, key_name):
+            continue
+        parent = type(inst)._referenced(key_name)
+        relation = inst._active_parents[key_name]
+        commands.append(("SREM", parent._generate_key(int(stored), relation), inst.id))
+        commands.append(("SREM", indexes.active_key(parent, int(stored), relation), inst.id))
+        moved_from.add((parent._name(), int(stored)))
+    return commands, moved_from
+
+
+def _batch_commands(instances: list, given_ids: set, trusted: bool) -> tuple:
+    # Returns the commands writing the batch, and the parents of models moved away from them.
+    # Models with given ids may have been stored before, and so have a name to replace
+    # and, if their parent changed, a parent to leave.
+    changes = [
+        (inst, *inst._changes(), (inst._name(), inst.id) in given_ids) for inst in instances
+    ]
+    parent_reads = _parent_reads(instances, given_ids)
+    if trusted:
+        results = _exec_pipeline([command for _, _, command in parent_reads]) if len(parent_reads) > 0 else []
+        moves, moved_from = _move_commands(parent_reads, results)
+        return [
+            command for inst, values, commands, stored_before in changes
+            for command in type(inst)._writes(inst.id, values, stored_before) + commands
+        ] + moves, moved_from
+
+    # Every foreign key check and stored parent is read in one round trip.
+    created = {(inst._name(), inst.id) for inst in instances}
+    reads = [
+        type(inst)._foreign_key_reads(_unchecked(type(inst), type(inst)._references(values), created))
+        for inst, values, _, _ in changes
+    ]
+    all_commands = [command for commands, _ in reads for command in commands]
+    all_commands.extend(command for _, _, command in parent_reads)
+    all_results = _exec_pipeline(all_commands) if len(all_commands) > 0 else []
+    writes = []
+    offset = 0
+    for (inst, values, commands, stored_before), (checks, referenced) in zip(changes, reads):
+        model = type(inst)
+        model._check_foreign_keys(referenced, flatten(all_results[offset:offset + len(checks)]))
+        offset += len(checks)
+        writes.extend(model._writes(inst.id, values, stored_before))
+        writes.extend(commands)
+    moves, moved_from = _move_commands(parent_reads, all_results[offset:])
+    return writes + moves, moved_from
+
+
+def _batches(records, size: int):
+    records = iter(records)
+    while True:
+        batch = list(islice(records, size))
+        if len(batch) == 0:
+            return
+        yield batch
+
+
+def import_records(records, batch_size: int = batch_size, trusted: bool = False) -> dict:
+    # Returns the number of models imported, by type. Batches before a failing record
+    # have been written, and that record's batch has not.
+    # Trusted records, e.g. those exported from another database, are neither
+    # validated nor have their foreign keys checked, so only the parents of records
+    # with given ids are read.
+    imported = Counter()
+    number = 0
+    for batch in _batches(records, batch_size):
+        instances = []
+        given_ids = set()
+        write_token = write_on_init.set(False)
+        validate_token = validate_on_init.set(not trusted)
+        try:
+            for record in batch:
+                number += 1
+                try:
+                    model, record = _model(record)
+                    inst = _instance(model, record)
+                except (ValueError, TypeError, ValidationException) as e:
+                    raise ValidationException(f"Could not import record {number}. {e}") from e
+                if record.get("id") not in (None, ""):
+                    given_ids.add((model._name(), inst.id))
+                instances.append(inst)
+        finally:
+            validate_on_init.reset(validate_token)
+            write_on_init.reset(write_token)
+
+        commands, moved_from = _batch_commands(instances, given_ids, trusted)
+        _exec_pipeline(commands)
+        database.wrote()
+        if database.client_cache is not None:
+            database.client_cache.invalidate_commands(commands)
+        for model_name, id in given_ids | moved_from:
+            object_cache.invalidate(model_name, id)
+        imported.update(inst._name() for inst in instances)
+    return dict(imported)
+
+
+def export_records(model_names: tuple = ("sport", "event", "selection"), batch_size: int = batch_size):
+    # Yields a record of every stored model, holding at most a batch in memory.
+    # Parents are exported before their children, but their relations refer to
+    # children exported later, so re-import them as trusted.
+    # SSCAN may return an id twice if the id index is resized while it is walked.
+    for model_name in model_names:
+        model = model_registry[model_name]
+        key_names = [f.name for f in model._stored_fields()]
+        for ids in indexes.scan_ids(model, batch_size):
+            values = model._read_values(list(dict.fromkeys(ids)))
+            for id, raw in values.items():
+                # Removed since its id was read.
+                if raw.get("name") is None:
+                    continue
+                record = {"model": model_name, "id": id}
+                for key_name in key_names:
+                    record[key_name] = model._convert(key_name, raw[key_name])
+                yield record
+
+
+def json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Cannot write {type(value).__name__} values as JSON.")
+
+
+def write_jsonl(records, f) -> int:
+    # Returns the number of records written.
+    written = 0
+    for record in records:
+        f.write(json.dumps(record, default=json_default) + "\n")
+        written += 1
+    return written
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+import asyncio
+from collections import OrderedDict
+from contextvars import ContextVar
+from functools import wraps
+from threading import Lock
+import time
+
+from .database import connection
+from .utils import log
+
+
+class ObjectCache:
+    # Raw stored values of recently loaded models, keyed by (model name, id).
+    # A new instance is built from them on every load, so cached values are never
+    # shared between callers. A size of 0 disables the cache.
+    def __init__(self, size: int = 0, ttl: float = None):
+        self.size = size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        # Every invalidation is numbered. A read takes the current number before it is
+        # sent, and its values are not cached if their key was invalidated since.
+        self._generation = 0
+        self._invalidated = OrderedDict()
+        # Reads older than this are never cached, once _invalidated has been trimmed.
+        self._oldest = 0
+        self._lock = Lock()
+        self._listener = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.size > 0
+
+    def get(self, model_name: str, id: int):
+        key = (model_name, id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            raw, expires = entry
+            if expires is not None and expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return raw
+
+    def generation(self) -> int:
+        # Taken before a read whose values are passed to set.
+        with self._lock:
+            return self._generation
+
+    def set(self, model_name: str, id: int, raw: dict, generation: int = None):
+        if not self.enabled:
+            return
+        key = (model_name, id)
+        expires = None if self.ttl is None else time.monotonic() + self.ttl
+        with self._lock:
+            if generation is not None and (
+                generation < self._oldest or self._invalidated.get(key, -1) > generation
+            ):
+                # Invalidated while it was read, so the values may be stale.
+                return
+            self._entries[key] = (raw, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, model_name: str, id: int):
+        key = (model_name, id)
+        with self._lock:
+            self._entries.pop(key, None)
+            self._generation += 1
+            self._invalidated[key] = self._generation
+            self._invalidated.move_to_end(key)
+            while len(self._invalidated) > max(self.size, 1):
+                _, self._oldest = self._invalidated.popitem(last=False)
+
+    def invalidate_model(self, model_name: str):
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == model_name]:
+                del self._entries[key]
+            self._invalidate_reads()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._invalidate_reads()
+
+    def _invalidate_reads(self):
+        # No read in flight is cached.
+        self._generation += 1
+        self._oldest = self._generation
+        self._invalidated.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _on_keyspace_event(self, message: dict):
+        # Channels look like __keyspace@0__:{model}:{id} or __keyspace@0__:{model}:{id}:{attribute}
+        parts = message["channel"].split(b":")
+        if len(parts) >= 3 and parts[2].isdigit():
+            self.invalidate(parts[1].decode("utf-8"), int(parts[2]))
+
+    def listen(self):
+        # Invalidates entries written by other clients, using keyspace notifications.
+        db = connection.connection_pool.connection_kwargs.get("db", 0)
+        connection.config_set("notify-keyspace-events", "KA")
+        pubsub = connection.pubsub(ignore_subscribe_messages=True)
+        pubsub.psubscribe(**{f"__keyspace@{db}__:*": self._on_keyspace_event})
+        self._listener = pubsub.run_in_thread(sleep_time=0.1, daemon=True)
+        log.debug(f"Listening for keyspace notifications. db={db}")
+        return self._listener
+
+    def stop(self):
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener = None
+
+
+object_cache = ObjectCache()
+
+# Cleared while a controller reads the models it is about to change, see uncached.
+cached_reads = ContextVar("cached_reads", default=True)
+
+
+def uncached(func):
+    # Runs a controller method with its loads read from the server, not the cache. A
+    # cached copy may have missed another process's write, which put_model would then
+    # overwrite, or leave out of the relation diffs it writes.
+    if asyncio.iscoroutinefunction(func):
+        @wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            token = cached_reads.set(False)
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                cached_reads.reset(token)
+        return async_wrapper
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        token = cached_reads.set(False)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            cached_reads.reset(token)
+    return wrapper
+
+
+def configure(size: int, ttl: float = None, notifications: bool = False):
+    # Enables the cache in front of Model.load. Entries expire after ttl seconds if given.
+    object_cache.stop()
+    object_cache.clear()
+    object_cache.size = size
+    object_cache.ttl = ttl
+    if notifications:
+        object_cache.listen()
@@ -1,10 +1,14 @@
 # -*- coding: utf-8 -*-
 from datetime import datetime
 
+from . import stats
+from .cache import uncached
 from .models import Event, Selection, Sport
-from .views import EventView, SelectionView, SportView
 
 
+# Controllers read what they are about to change from the primary, never a replica,
+# and never from the object cache.
+@stats.operations
 class SportController:
     @staticmethod
     def create_sport(name: str, active: bool = False):
@@ -12,6 +16,7 @@ class SportController:
         return new_sport
 
     @staticmethod
+    @uncached
     def update_sport(sport_id: int, **kwargs):
         sport = Sport.new(id=sport_id)
         sport.update(**kwargs)
@@ -19,6 +24,7 @@ class SportController:
         return sport
 
     @staticmethod
+    @uncached
     def update_sport_events(sport_id: int, event_ids: list):
         sport = Sport.new(id=sport_id)
         sport.events = event_ids
@@ -26,12 +32,14 @@ class SportController:
         return sport
 
     @staticmethod
+    @uncached
     def deactivate_sport(sport_id: int):
-        sport = SportView.get_sport(sport_id)
+        sport = Sport.load(sport_id)
         sport.deactivate()
         return sport
 
 
+@stats.operations
 class EventController:
     @staticmethod
     def create_event(name: str, type: int, sport: int, status: int, scheduled_start: float):
@@ -42,40 +50,30 @@ class EventController:
         return new_event
 
     @staticmethod
+    @uncached
     def update_event(event_id: int, **kwargs):
-        event = EventView.get_event(event_id)
+        event = Event.load(event_id)
         event.update(**kwargs)
         event.put_model()
         return event
 
     @staticmethod
+    @uncached
     def update_event_selections(event_id: int, selection_ids: list):
-        event = EventView.get_event(event_id)
+        event = Event.load(event_id)
         event.selections = selection_ids
         event.put_model()
         return event
 
     @staticmethod
+    @uncached
     def deactivate_event(event_id: int):
-        event = EventView.get_event(event_id)
-
-        for selection_id in event.selections:
-            selection = SelectionView.get_selection(selection_id)
-            selection.deactivate()
-        event.deactivate()
-
-        # Deactivate sport if all of its events are inactive.
-        sport_id = event.sport
-        sport = SportView.get_sport(sport_id)
-
-        for event_id in sport.events:
-            sub_event = EventView.get_event(event_id)
-            if sub_event.active:
-                return event
-        sport.deactivate()
-        return event
+        # Deactivates its selections, and its sport if all of the sport's events are inactive.
+        Event.deactivate_cascade(event_id, parent="sport", children="selections")
+        return Event.load(event_id)
 
 
+@stats.operations
 class SelectionController:
     @staticmethod
     def create_selection(name: str, event: int, price: float, outcome: int):
@@ -85,26 +83,19 @@ class SelectionController:
         return new_selection
 
     @staticmethod
+    @uncached
     def update_selection(selection_id: int, **kwargs):
-        selection = SelectionView.get_selection(selection_id)
+        selection = Selection.load(selection_id)
         selection.update(**kwargs)
         selection.put_model()
         return selection
 
     @staticmethod
+    @uncached
     def deactivate_selection(selection_id: int):
-        selection = Selection.new(id=selection_id)
-        selection.deactivate()
-
-        # Deactivate event if all selections are inactive.
-        event = EventView.get_event(selection.event)
-
-        for selection_id in event.selections:
-            sub_selection = SelectionView.get_selection(selection_id)
-            if sub_selection.active:
-                return event
-        event.deactivate()
-        return selection
+        # Deactivates its event if all of the event's selections are inactive.
+        Selection.deactivate_cascade(selection_id, parent="event")
+        return Selection.load(selection_id)
 
 
 controller_mapping = {
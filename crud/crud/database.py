@@ -1,39 +1,292 @@
 # -*- coding: utf-8 -*-
+import asyncio
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, replace
+from functools import wraps
+from itertools import cycle
+import os
+import time
+
 from keydb import ConnectionPool, KeyDB
+import redis.asyncio
 
-pool = ConnectionPool(host='127.0.0.1')
-connection = KeyDB(connection_pool=pool)
+from . import memory, stats
+from .tracking import ClientCache
+from .utils import iterate_in_context
 
 
-"""
-def transaction(f):
-    @functools.wraps(f)
-    def wrapper(*args, **kwargs):
-        success = False
+@dataclass(frozen=True)
+class Settings:
+    # redis://host:port/db, rediss://..., unix:///path/to/socket?db=0
+    # or memory://name/db for an in-process server (see memory.py)
+    url: str = "redis://127.0.0.1:6379/0"
+    # Views read from these servers in turn, if there are any.
+    replica_urls: tuple = ()
+    # Overrides the database index in the urls.
+    db: int = None
+    max_connections: int = None
+    socket_timeout: float = None
+    socket_connect_timeout: float = None
+    socket_keepalive: bool = False
+    health_check_interval: int = 0
+
+    @classmethod
+    def from_env(cls, environ=os.environ):
+        def optional(name, convert):
+            value = environ.get(name)
+            return None if value in (None, "") else convert(value)
+
+        return cls(
+            url=environ.get("CRUD_URL", cls.url),
+            replica_urls=tuple(
+                url.strip() for url in environ.get("CRUD_REPLICA_URLS", "").split(",") if url.strip()
+            ),
+            db=optional("CRUD_DB", int),
+            max_connections=optional("CRUD_MAX_CONNECTIONS", int),
+            socket_timeout=optional("CRUD_SOCKET_TIMEOUT", float),
+            socket_connect_timeout=optional("CRUD_CONNECT_TIMEOUT", float),
+            socket_keepalive=environ.get("CRUD_KEEPALIVE", "").lower() in ("1", "true", "yes"),
+            health_check_interval=optional("CRUD_HEALTH_CHECK_INTERVAL", int) or 0
+        )
+
+    def pool_kwargs(self, url: str) -> dict:
+        kwargs = {
+            "socket_timeout": self.socket_timeout,
+            "health_check_interval": self.health_check_interval
+        }
+        # Unix domain socket connections take neither.
+        if not url.startswith("unix://"):
+            kwargs["socket_connect_timeout"] = self.socket_connect_timeout
+            kwargs["socket_keepalive"] = self.socket_keepalive
+        if self.max_connections is not None:
+            kwargs["max_connections"] = self.max_connections
+        if self.db is not None:
+            kwargs["db"] = self.db
+        return kwargs
+
+
+class ConnectionProvider:
+    # Creates the pools and clients every module uses.
+    # Pass a subclass or a replacement to set_provider to supply them some other way.
+    def __init__(self, settings: Settings):
+        self.settings = settings
+
+        self.pool = self._pool(settings.url)
+        self.primary = KeyDB(connection_pool=self.pool)
+        self.replicas = [KeyDB(connection_pool=self._pool(url)) for url in settings.replica_urls]
+
+        # Their connections belong to the event loop which opened them.
+        self.async_pool = self._async_pool(settings.url)
+        self.async_primary = redis.asyncio.Redis(connection_pool=self.async_pool)
+        self.async_replicas = [
+            redis.asyncio.Redis(connection_pool=self._async_pool(url)) for url in settings.replica_urls
+        ]
+
+        self._replicas = cycle(self.replicas or [self.primary])
+        self._async_replicas = cycle(self.async_replicas or [self.async_primary])
+
+    def _pool(self, url: str):
+        if url.startswith("memory://"):
+            return memory.connection_pool(url, **self.settings.pool_kwargs(url))
+        return ConnectionPool.from_url(url, **self.settings.pool_kwargs(url))
+
+    def _async_pool(self, url: str):
+        if url.startswith("memory://"):
+            return memory.async_connection_pool(url, **self.settings.pool_kwargs(url))
+        return redis.asyncio.ConnectionPool.from_url(url, **self.settings.pool_kwargs(url))
+
+    def replica(self):
+        # Replicas are used in turn.
+        return next(self._replicas)
+
+    def async_replica(self):
+        return next(self._async_replicas)
+
+    def close(self):
+        # The async pools can only be disconnected on their event loop, by aclose().
+        self.pool.disconnect()
+        for replica in self.replicas:
+            replica.connection_pool.disconnect()
+
+    async def aclose(self):
+        await self.async_pool.disconnect()
+        for replica in self.async_replicas:
+            await replica.connection_pool.disconnect()
+        self.close()
+
+
+_provider = None
+
+
+def provider() -> ConnectionProvider:
+    # Created on first use, from environment variables unless configure() was called.
+    global _provider
+    if _provider is None:
+        _provider = ConnectionProvider(Settings.from_env())
+    return _provider
+
+
+def set_provider(new_provider: ConnectionProvider):
+    global _provider
+    disable_client_cache()
+    if _provider is not None and _provider is not new_provider:
+        _provider.close()
+    _provider = new_provider
+
+
+def configure(**settings) -> ConnectionProvider:
+    # Settings not given are read from the environment, e.g. configure(max_connections=20).
+    set_provider(ConnectionProvider(replace(Settings.from_env(), **settings)))
+    return _provider
+
+
+async def async_configure(**settings) -> ConnectionProvider:
+    # As configure(), also disconnecting the old provider's async pools on the running loop.
+    old_provider = _provider
+    new_provider = configure(**settings)
+    if old_provider is not None and old_provider is not new_provider:
+        await old_provider.aclose()
+    return new_provider
+
+
+class ProviderAttribute:
+    # Forwards to an attribute of the current provider, so that modules which imported
+    # it before configure() was called still use the configured client.
+    def __init__(self, name: str):
+        self._name = name
+
+    def __getattr__(self, attribute):
+        return getattr(getattr(provider(), self._name), attribute)
+
+    def __repr__(self) -> str:
+        return f"<{self._name} of {provider()!r}>"
+
 
-        while not success:
+pool = ProviderAttribute("pool")
+connection = ProviderAttribute("primary")
+async_pool = ProviderAttribute("async_pool")
+async_connection = ProviderAttribute("async_primary")
+
+# Set while a view is reading, so that reads go to a replica if there is one.
+replica_reads = ContextVar("replica_reads", default=False)
+
+
+class Session:
+    # After a write within a session, its reads go to the primary so that they see
+    # the write. With a window, only for that many seconds after the latest write,
+    # by when the replicas are expected to have caught up.
+    def __init__(self, window: float = None):
+        self.window = window
+        self.written = None
+
+    def wrote(self):
+        self.written = time.monotonic()
+
+    def reads_primary(self) -> bool:
+        if self.written is None:
+            return False
+        return self.window is None or time.monotonic() - self.written < self.window
+
+
+current_session = ContextVar("current_session", default=None)
+
+
+@contextmanager
+def session(window: float = None):
+    # Read-your-writes consistency for the commands sent in the body.
+    token = current_session.set(Session(window))
+    try:
+        yield current_session.get()
+    finally:
+        current_session.reset(token)
+
+
+def wrote():
+    # Called after every write sent to the primary.
+    if current_session.get() is not None:
+        current_session.get().wrote()
+
+
+def _reads_replica() -> bool:
+    if not replica_reads.get():
+        return False
+    return current_session.get() is None or not current_session.get().reads_primary()
+
+
+def reads_from_replica() -> bool:
+    # Whether reads sent now go to a replica, which may not have received every write.
+    return _reads_replica() and len(provider().replicas) > 0
+
+
+def reader():
+    return provider().replica() if _reads_replica() else connection
+
+
+def async_reader():
+    return provider().async_replica() if _reads_replica() else async_connection
+
+
+def reads_replica(func):
+    # Runs a view method, and any iterator it returns, against the replicas.
+    if asyncio.iscoroutinefunction(func):
+        @wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            token = replica_reads.set(True)
             try:
-                connection.execute_command("MULTI")
-                f(*args, **kwargs)
-                result = connection.execute_command("EXEC")
-                success = True
-            except Exception as e:
-                print(f"Transaction failed: {e}")
-                connection.execute_command("DISCARD")
-                time.sleep(0.01)
+                return await func(*args, **kwargs)
+            finally:
+                replica_reads.reset(token)
+        return async_wrapper
 
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        token = replica_reads.set(True)
+        try:
+            result = func(*args, **kwargs)
+        finally:
+            replica_reads.reset(token)
+        if hasattr(result, "__next__"):
+            return iterate_in_context(replica_reads, True, result)
+        return result
     return wrapper
 
 
-def db(f):
-    @functools.wraps(f)
-    def wrapper(*args, **kwargs):
-        command = f(*args, **kwargs)
-        if isinstance(command, str):
-            command = [command]
+# Set by enable_client_cache; attribute reads are then served from it where possible.
+client_cache = None
 
-        for c in command:
-            connection.execute_command(c)
-        return command
-    return wrapper
-"""
\ No newline at end of file
+
+def enable_client_cache(size: int = 10000) -> ClientCache:
+    global client_cache
+    if client_cache is not None:
+        client_cache.stop()
+    client_cache = ClientCache(provider().pool, size)
+    client_cache.start()
+    return client_cache
+
+
+def disable_client_cache():
+    global client_cache
+    if client_cache is not None:
+        client_cache.stop()
+        client_cache = None
+
+
+@contextmanager
+def transaction():
+    # Commands queued on the pipeline are sent as one MULTI/EXEC block on exit.
+    # Nothing is sent if the body raises.
+    with connection.pipeline(transaction=True) as pipeline:
+        yield pipeline
+        with stats.timed([args for args, _ in pipeline.command_stack], "MULTI"):
+            pipeline.execute()
+    wrote()
+
+
+@asynccontextmanager
+async def async_transaction():
+    async with async_connection.pipeline(transaction=True) as pipeline:
+        yield pipeline
+        with stats.timed([args for args, _ in pipeline.command_stack], "MULTI"):
+            await pipeline.execute()
+    wrote()
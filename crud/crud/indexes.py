@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+from . import scripts
+from .database import transaction
+
+# Score ranges for ZRANGEBYSCORE, keyed by filter comparison operator.
+score_ranges = {
+    "<<": lambda value: ("-inf", f"({value}"),
+    "<=": lambda value: ("-inf", value),
+    ">>": lambda value: (f"({value}", "+inf"),
+    ">=": lambda value: (value, "+inf"),
+    "==": lambda value: (value, value)
+}
+
+regex_special_characters = ".^$*+?{}[]\\|()"
+
+
+def ids_key(model) -> str:
+    return f"{model._name()}:ids"
+
+
+def index_key(model, key_name: str) -> str:
+    return f"{model._name()}:index:{key_name}"
+
+
+def name_member(name: str, id: int) -> str:
+    return f"{name}:{id}"
+
+
+def active_key(model, id: int, relation: str) -> str:
+    # The ids of a parent's active children, e.g. sport:{id}:active_events
+    return f"{model._name()}:{id}:active_{relation}"
+
+
+def rename_commands(model, id: int, name: str) -> list:
+    # Sent before a new name is written, in the same transaction. The stored name is
+    # read by the script rather than taken from the model, which may be stale.
+    # The script must be loaded first, see scripts.load_missing.
+    return [(
+        "EVALSHA", scripts.remove_name.sha, 2,
+        index_key(model, "name"), model._layout.name_key(model, id),
+        model._layout.name, id, name
+    )]
+
+def write_commands(model, id: int, values: dict) -> list:
+    # values must already be converted for storage.
+    commands = [("SADD", ids_key(model), id)]
+
+    name = values.get("name")
+    if name is not None:
+        commands.append(("ZADD", index_key(model, "name"), 0, name_member(name, id)))
+
+    for key_name in model._indexes:
+        value = values.get(key_name)
+        if value is not None:
+            commands.append(("ZADD", index_key(model, key_name), value, id))
+    return commands
+
+
+def active_commands(parent, relation: str, id: int, active: bool,
+                    parent_id: int, old_parent_id: int = None) -> list:
+    # Keeps a child's membership of its parent's active children in step with the child.
+    commands = []
+    if old_parent_id is not None and old_parent_id != parent_id:
+        commands.append(("SREM", active_key(parent, old_parent_id, relation), id))
+    if parent_id is not None:
+        command = "SADD" if active else "SREM"
+        commands.append((command, active_key(parent, parent_id, relation), id))
+    return commands
+
+
+def all_ids_command(model) -> tuple:
+    return "SMEMBERS", ids_key(model)
+
+
+def parse_ids(ids) -> list:
+    return [int(id) for id in ids]
+
+
+def all_ids(model) -> list:
+    return parse_ids(model._exec(*all_ids_command(model)))
+
+
+def scan_ids(model, count: int):
+    # SSCAN may return an id more than once if the set is resized while it is walked.
+    cursor = 0
+    while True:
+        cursor, ids = model._exec("SSCAN", ids_key(model), cursor, "COUNT", count)
+        if len(ids) > 0:
+            yield [int(id) for id in ids]
+        if int(cursor) == 0:
+            return
+
+
+def names_command(model, prefix: str = "") -> tuple:
+    if prefix == "":
+        minimum, maximum = "-", "+"
+    else:
+        minimum = b"[" + prefix.encode("utf-8")
+        maximum = minimum + b"\xff"
+    return "ZRANGEBYLEX", index_key(model, "name"), minimum, maximum
+
+
+def parse_names(members) -> list:
+    pairs = []
+    for member in members:
+        name, id = member.decode("utf-8").rsplit(":", 1)
+        pairs.append((int(id), name))
+    return pairs
+
+
+def names(model, prefix: str = "") -> list:
+    # Returns (id, name) pairs for every model whose name starts with prefix.
+    return parse_names(model._exec(*names_command(model, prefix)))
+
+
+def score_range_command(model, key_name: str, op: str, value: float) -> tuple:
+    minimum, maximum = score_ranges[op](value)
+    return "ZRANGEBYSCORE", index_key(model, key_name), minimum, maximum
+
+
+def score_range(model, key_name: str, op: str, value: float) -> list:
+    return parse_ids(model._exec(*score_range_command(model, key_name, op, value)))
+
+
+def literal_prefix(pattern: str) -> str:
+    # The longest literal string every match of the pattern must start with.
+    # Patterns are applied with re.match, so they are always anchored at the start.
+    if "|" in pattern:
+        return ""
+
+    prefix = []
+    for char in pattern[1:] if pattern.startswith("^") else pattern:
+        if char in regex_special_characters:
+            # The previous character may be optional or repeated.
+            if char in "*?{" and len(prefix) > 0:
+                prefix.pop()
+            break
+        prefix.append(char)
+    return "".join(prefix)
+
+
+def rebuild(model, count: int) -> int:
+    # Indexes every model already stored, e.g. one written before indexes existed.
+    key_names = [f.name for f in model._stored_fields() if f.name not in model._relations()]
+    indexed = 0
+
+    for ids in model._layout.scan_ids(model, count):
+        if len(ids) == 0:
+            continue
+        values = model._read_values(ids)
+        with transaction() as pipeline:
+            for id, raw in values.items():
+                stored = {
+                    key_name: raw[key_name].decode("utf-8")
+                    for key_name in key_names if raw[key_name] is not None
+                }
+                for command in write_commands(model, id, stored):
+                    pipeline.execute_command(*command)
+                for key_name, relation in model._active_parents.items():
+                    parent = model._referenced(key_name)
+                    active = stored.get("active", "0") != "0"
+                    for command in active_commands(parent, relation, id, active, stored.get(key_name)):
+                        pipeline.execute_command(*command)
+        indexed += len(ids)
+    return indexed
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+from .database import transaction
+
+
+def flatten(results: list) -> list:
+    flat = []
+    for result in results:
+        if isinstance(result, list):
+            flat.extend(result)
+        else:
+            flat.append(result)
+    return flat
+
+
+def is_id_key(key: bytes, parts: int) -> bool:
+    # Skips index keys such as {model}:index:name which share the model's prefix.
+    split = key.split(b":")
+    return len(split) == parts and split[1].isdigit()
+
+
+class KeyLayout:
+    # Every attribute is stored in its own key: {model}:{id}:{attribute}
+    name = "keys"
+
+    @staticmethod
+    def read_command(model, id: int, key_name: str) -> tuple:
+        return (model._read_command(id, key_name),)
+
+    @staticmethod
+    def write_command(model, id: int, key_name: str, value) -> tuple:
+        return model._write_command(id, key_name, value)
+
+    @classmethod
+    def read_commands(cls, model, id: int, key_names: list) -> list:
+        return [cls.read_command(model, id, key_name) for key_name in key_names]
+
+    @staticmethod
+    def parse(model, key_names: list, results: list) -> dict:
+        return dict(zip(key_names, results))
+
+    @classmethod
+    def write_commands(cls, model, id: int, values: dict) -> list:
+        return [
+            cls.write_command(model, id, key_name, value)
+            for key_name, value in values.items()
+        ]
+
+    @staticmethod
+    def delete_commands(model, id: int, key_names: list) -> list:
+        return [("DEL", *(model._generate_key(id, key_name) for key_name in key_names))]
+
+    @staticmethod
+    def name_commands(model, ids: list) -> list:
+        return [("MGET", *(model._generate_key(id, "name") for id in ids))]
+
+    @staticmethod
+    def name_key(model, id: int) -> str:
+        return model._generate_key(id, "name")
+
+    @staticmethod
+    def scan_ids(model, count: int):
+        cursor = 0
+        while True:
+            cursor, keys = model._exec(
+                "SCAN", cursor, "MATCH", f"{model._name()}:*:name", "COUNT", count
+            )
+            yield [int(key.split(b":")[1]) for key in keys if is_id_key(key, 3)]
+            if int(cursor) == 0:
+                return
+
+
+class HashLayout:
+    # Scalar attributes are stored in a single hash: {model}:{id}
+    # List relations keep their own keys, as in KeyLayout.
+    name = "hash"
+
+    @staticmethod
+    def key(model, id: int) -> str:
+        return f"{model._name()}:{id}"
+
+    @classmethod
+    def read_command(cls, model, id: int, key_name: str) -> tuple:
+        if key_name in model._relations():
+            return KeyLayout.read_command(model, id, key_name)
+        return "HGET", cls.key(model, id), key_name
+
+    @classmethod
+    def write_command(cls, model, id: int, key_name: str, value) -> tuple:
+        if key_name in model._relations():
+            return KeyLayout.write_command(model, id, key_name, value)
+        return "HSET", cls.key(model, id), key_name, value
+
+    @classmethod
+    def read_commands(cls, model, id: int, key_names: list) -> list:
+        relations = model._relations()
+        return [("HGETALL", cls.key(model, id))] + [
+            KeyLayout.read_command(model, id, key_name)
+            for key_name in key_names if key_name in relations
+        ]
+
+    @staticmethod
+    def parse(model, key_names: list, results: list) -> dict:
+        relations = model._relations()
+        stored = {k.decode("utf-8"): v for k, v in results[0].items()}
+        values = dict(zip(
+            [key_name for key_name in key_names if key_name in relations],
+            results[1:]
+        ))
+        for key_name in key_names:
+            if key_name not in relations:
+                values[key_name] = stored.get(key_name)
+        return values
+
+    @classmethod
+    def write_commands(cls, model, id: int, values: dict) -> list:
+        relations = model._relations()
+        commands = [
+            KeyLayout.write_command(model, id, key_name, value)
+            for key_name, value in values.items() if key_name in relations
+        ]
+
+        pairs = [
+            item for key_name, value in values.items() if key_name not in relations
+            for item in (key_name, value)
+        ]
+        if len(pairs) > 0:
+            commands.insert(0, ("HSET", cls.key(model, id), *pairs))
+        return commands
+
+    @classmethod
+    def delete_commands(cls, model, id: int, key_names: list) -> list:
+        return [("DEL", cls.key(model, id))]
+
+    @classmethod
+    def name_commands(cls, model, ids: list) -> list:
+        return [("HGET", cls.key(model, id), "name") for id in ids]
+
+    @classmethod
+    def name_key(cls, model, id: int) -> str:
+        return cls.key(model, id)
+
+    @staticmethod
+    def scan_ids(model, count: int):
+        cursor = 0
+        while True:
+            cursor, keys = model._exec(
+                "SCAN", cursor, "MATCH", f"{model._name()}:*", "COUNT", count, "TYPE", "hash"
+            )
+            yield [int(key.split(b":")[1]) for key in keys if is_id_key(key, 2)]
+            if int(cursor) == 0:
+                return
+
+
+layout_mapping = {
+    KeyLayout.name: KeyLayout,
+    HashLayout.name: HashLayout
+}
+
+
+def migrate(model, source, target, count: int):
+    # Moves the scalar attributes of every stored model from one layout to another.
+    # List relations are stored identically by both layouts and are left alone.
+    key_names = [
+        f.name for f in model._stored_fields() if f.name not in model._relations()
+    ]
+    migrated = 0
+
+    for ids in source.scan_ids(model, count):
+        if len(ids) == 0:
+            continue
+        reads = [source.read_commands(model, id, key_names) for id in ids]
+        results = model._exec_pipeline([c for commands in reads for c in commands])
+
+        with transaction() as pipeline:
+            offset = 0
+            for id, commands in zip(ids, reads):
+                raw = source.parse(model, key_names, results[offset:offset + len(commands)])
+                offset += len(commands)
+
+                values = {k: v for k, v in raw.items() if v is not None}
+                for command in source.delete_commands(model, id, key_names):
+                    pipeline.execute_command(*command)
+                for command in target.write_commands(model, id, values):
+                    pipeline.execute_command(*command)
+        migrated += len(ids)
+    return migrated
+
+
+def convert_relations(model, count: int) -> int:
+    # Stores list relations written before relations were sets, which would otherwise
+    # fail to be read with WRONGTYPE, as sets. Returns the number of keys converted.
+    # Run it while nothing writes the model, then reindex to count active children.
+    converted = 0
+
+    for ids in model._layout.scan_ids(model, count):
+        keys = [
+            model._generate_key(id, key_name) for id in ids for key_name in model._relations()
+        ]
+        if len(keys) == 0:
+            continue
+        types = model._exec_pipeline([("TYPE", key) for key in keys])
+        lists = [key for key, key_type in zip(keys, types) if key_type in (b"list", "list")]
+        if len(lists) == 0:
+            continue
+        members = model._exec_pipeline([("LRANGE", key, 0, -1) for key in lists])
+
+        with transaction() as pipeline:
+            for key, values in zip(lists, members):
+                pipeline.execute_command("DEL", key)
+                if len(values) > 0:
+                    pipeline.execute_command("SADD", key, *values)
+        converted += len(lists)
+    return converted
@@ -0,0 +1,882 @@
+# -*- coding: utf-8 -*-
+# An in-memory server for the commands the models send, selected with a memory:// url,
+# e.g. CRUD_URL=memory:// or memory://name/db. Each name is a separate server.
+# Clients talk to it over a socket pair in the Redis protocol, so sync and async clients,
+# pipelines, transactions and pub/sub work exactly as they do against a real server.
+# redis-py's connections and parsers are used unchanged, including the blocking reads
+# with timeouts which pub/sub and the client cache's listener rely on; commands handed
+# to a dispatcher directly would need both the sync and async connections reimplemented.
+import asyncio
+from collections import defaultdict, deque
+from functools import lru_cache
+import heapq
+from inspect import Signature, signature
+from itertools import count as counter
+import math
+import re
+import socket
+from threading import Condition, RLock, Thread
+from urllib.parse import urlparse
+import zlib
+
+import redis.asyncio
+import redis.connection
+from keydb import ConnectionPool
+
+from . import scripts
+from .utils import log
+
+
+class Error(Exception):
+    pass
+
+
+class Status(str):
+    # Sent as a simple string, e.g. +OK.
+    pass
+
+
+OK = Status("OK")
+wrong_type = Error("WRONGTYPE Operation against a key holding the wrong kind of value")
+
+
+class SortedSet(dict):
+    # member: score
+    def ordered(self) -> list:
+        return sorted(self.items(), key=lambda item: (item[1], item[0]))
+
+
+def encode(reply) -> bytes:
+    if reply is None:
+        return b"$-1\r\n"
+    if isinstance(reply, Error):
+        message = str(reply)
+        if not message.split(" ", 1)[0].isupper():
+            message = f"ERR {message}"
+        return f"-{message}\r\n".encode("utf-8")
+    if isinstance(reply, Status):
+        return f"+{reply}\r\n".encode("utf-8")
+    if isinstance(reply, bool):
+        return b":1\r\n" if reply else b":0\r\n"
+    if isinstance(reply, int):
+        return f":{reply}\r\n".encode("utf-8")
+    if isinstance(reply, (list, tuple)):
+        return b"".join([f"*{len(reply)}\r\n".encode("utf-8")] + [encode(item) for item in reply])
+    if isinstance(reply, float):
+        reply = format_score(reply)
+    if isinstance(reply, str):
+        reply = reply.encode("utf-8")
+    return b"$%d\r\n%s\r\n" % (len(reply), reply)
+
+
+def format_score(score: float) -> bytes:
+    if math.isinf(score):
+        return b"inf" if score > 0 else b"-inf"
+    if score == int(score):
+        return str(int(score)).encode("utf-8")
+    return repr(score).encode("utf-8")
+
+
+def parse_score(value: bytes, exclusive: bool = False):
+    # Returns (score, exclusive) for a ZRANGEBYSCORE bound such as (1.5 or -inf.
+    if value.startswith(b"("):
+        return parse_score(value[1:], True)
+    try:
+        return float(value), exclusive
+    except ValueError:
+        raise Error("min or max is not a float")
+
+
+def scan_position(item: bytes) -> int:
+    # Cursor 0 starts and ends a scan, so positions start at 1.
+    return zlib.crc32(item) + 1
+
+
+def glob_pattern(pattern: bytes):
+    # Redis glob-style patterns: *, ?, [abc], [^abc], [a-z] and \ escapes.
+    regex = b""
+    i = 0
+    while i < len(pattern):
+        c = pattern[i:i + 1]
+        if c == b"*":
+            regex += b".*"
+        elif c == b"?":
+            regex += b"."
+        elif c == b"\\" and i + 1 < len(pattern):
+            i += 1
+            regex += re.escape(pattern[i:i + 1])
+        elif c == b"[" and b"]" in pattern[i + 1:]:
+            end = pattern.index(b"]", i + 1)
+            regex += b"[" + pattern[i + 1:end].replace(b"\\", b"\\\\") + b"]"
+            i = end
+        else:
+            regex += re.escape(c)
+        i += 1
+    return re.compile(regex + b"\\Z", re.DOTALL)
+
+
+class Client:
+    # A connection's state: its database, queued MULTI commands and subscriptions.
+    def __init__(self, server, sock: socket.socket, id: int):
+        self.server = server
+        self.sock = sock
+        self.id = id
+        self.db = 0
+        self.queued = None
+        self.channels = set()
+        self.patterns = set()
+        # The id of the client sent invalidations of the keys this one reads, once
+        # it has turned CLIENT TRACKING on.
+        self.tracking = None
+        # Replies the socket had no room for, sent by a thread of their own so that
+        # commands are still read while a client sends a large pipeline before reading
+        # any of its replies. Otherwise replies are sent straight away, keeping them in
+        # order with the messages published to other clients.
+        self.unsent = deque()
+        self.sending = Condition()
+        self.closed = False
+        Thread(target=self._send_unsent, daemon=True).start()
+
+    def send(self, reply):
+        data = encode(reply)
+        with self.sending:
+            if len(self.unsent) == 0:
+                try:
+                    data = data[self.sock.send(data, socket.MSG_DONTWAIT):]
+                except BlockingIOError:
+                    pass
+                except OSError:
+                    return
+                if len(data) == 0:
+                    return
+            self.unsent.append(data)
+            self.sending.notify()
+
+    def close(self):
+        with self.sending:
+            self.closed = True
+            self.sending.notify()
+
+    def _send_unsent(self):
+        while True:
+            with self.sending:
+                while len(self.unsent) == 0 and not self.closed:
+                    self.sending.wait()
+                if len(self.unsent) == 0:
+                    self.sock.close()
+                    return
+                data = self.unsent[0]
+            try:
+                self.sock.sendall(data)
+            except OSError:
+                pass
+            with self.sending:
+                self.unsent.popleft()
+
+
+@lru_cache(maxsize=None)
+def handler_signature(handler) -> Signature:
+    return signature(handler)
+
+
+class MemoryServer:
+    def __init__(self, name: str = ""):
+        self.name = name
+        self.dbs = defaultdict(dict)
+        self.config = {"notify-keyspace-events": ""}
+        self.scripts = set()
+        self.clients = {}
+        # (db, key): ids of the tracking clients which have read the key since it was written.
+        self.tracked = defaultdict(set)
+        self.lock = RLock()
+        self._ids = counter(1)
+
+    def connect(self) -> socket.socket:
+        # Returns the client's end of a socket pair; a thread serves the other end.
+        client_sock, server_sock = socket.socketpair()
+        client = Client(self, server_sock, next(self._ids))
+        with self.lock:
+            self.clients[client.id] = client
+        Thread(target=self._serve, args=(client,), daemon=True).start()
+        return client_sock
+
+    def _serve(self, client: Client):
+        stream = client.sock.makefile("rb")
+        try:
+            while True:
+                command = self._read_command(stream)
+                if command is None:
+                    return
+                client.send(self.execute(client, command))
+        except (OSError, ValueError):
+            return
+        finally:
+            with self.lock:
+                self.clients.pop(client.id, None)
+            client.close()
+
+    @staticmethod
+    def _read_command(stream):
+        line = stream.readline()
+        if not line:
+            return None
+        if not line.startswith(b"*"):
+            return line.split()
+        command = []
+        for _ in range(int(line[1:])):
+            length = int(stream.readline()[1:])
+            command.append(stream.read(length + 2)[:-2])
+        return command
+
+    def execute(self, client: Client, command: list):
+        name = command[0].upper().decode("utf-8")
+        args = command[1:]
+        if client.queued is not None and name not in ("EXEC", "DISCARD", "MULTI"):
+            client.queued.append((name, args))
+            return Status("QUEUED")
+        with self.lock:
+            return self.call(client, name, args)
+
+    def call(self, client: Client, name: str, args: list):
+        handler = getattr(self, f"cmd_{name.lower()}", None)
+        if handler is None:
+            return Error(f"unknown command '{name}'")
+        try:
+            handler_signature(handler.__func__).bind(self, client, *args)
+        except TypeError:
+            return Error(f"wrong number of arguments for '{name.lower()}' command")
+        try:
+            return handler(client, *args)
+        except Error as e:
+            return e
+
+    # Keyspace
+
+    def _db(self, client: Client) -> dict:
+        return self.dbs[client.db]
+
+    def _value(self, client: Client, key: bytes, kind, create: bool = False):
+        db = self._db(client)
+        value = db.get(key)
+        if value is None:
+            if not create:
+                return kind()
+            value = db[key] = kind()
+        if type(value) is not kind:
+            raise wrong_type
+        return value
+
+    def _prune(self, client: Client, key: bytes):
+        # Empty collections do not exist.
+        value = self._db(client).get(key)
+        if value is not None and not isinstance(value, bytes) and len(value) == 0:
+            del self._db(client)[key]
+
+    def _track(self, client: Client, keys):
+        if client.tracking is not None:
+            for key in keys:
+                self.tracked[(client.db, key)].add(client.id)
+
+    def _invalidate(self, db: int, key: bytes = None):
+        # Sends the tracking clients which have read the key, or any key in db if none
+        # is given, an invalidation message through the client they redirect to.
+        if key is None:
+            tracked = [self.tracked.pop(db_key) for db_key in list(self.tracked) if db_key[0] == db]
+        else:
+            tracked = [self.tracked.pop((db, key), ())]
+        targets = {
+            self.clients[id].tracking
+            for ids in tracked for id in ids if id in self.clients
+        }
+        for target in targets:
+            if target in self.clients:
+                self.clients[target].send([b"message", b"__redis__:invalidate", None if key is None else [key]])
+
+    def _notify(self, client: Client, key: bytes, event: str):
+        self._invalidate(client.db, key)
+        if "K" not in self.config["notify-keyspace-events"]:
+            return
+        channel = f"__keyspace@{client.db}__:".encode("utf-8") + key
+        self._deliver(channel, event.encode("utf-8"))
+
+    def _deliver(self, channel: bytes, message: bytes) -> int:
+        received = 0
+        for subscriber in list(self.clients.values()):
+            if channel in subscriber.channels:
+                subscriber.send([b"message", channel, message])
+                received += 1
+            for pattern in subscriber.patterns:
+                if glob_pattern(pattern).match(channel):
+                    subscriber.send([b"pmessage", pattern, channel, message])
+                    received += 1
+        return received
+
+    # Connection and server
+
+    def cmd_ping(self, client, message=None):
+        if client.channels or client.patterns:
+            return [b"pong", message or b""]
+        return Status("PONG") if message is None else message
+
+    def cmd_hello(self, client, *args):
+        raise Error("NOPROTO this server supports RESP2 only")
+
+    def cmd_echo(self, client, message):
+        return message
+
+    def cmd_select(self, client, db):
+        client.db = int(db)
+        return OK
+
+    def cmd_client(self, client, subcommand, *args):
+        subcommand = subcommand.upper()
+        if subcommand == b"ID":
+            return client.id
+        if subcommand in (b"SETINFO", b"SETNAME"):
+            return OK
+        if subcommand == b"TRACKING":
+            return self._client_tracking(client, *args)
+        raise Error(f"unsupported CLIENT subcommand '{subcommand.decode('utf-8')}'")
+
+    def _client_tracking(self, client, state: bytes = b"", *options):
+        # Only the default mode, redirected to another client as RESP2 requires.
+        state = state.upper()
+        if state == b"OFF":
+            client.tracking = None
+            return OK
+        if state != b"ON" or len(options) != 2 or options[0].upper() != b"REDIRECT":
+            raise Error("unsupported CLIENT TRACKING options")
+        target = int(options[1])
+        if target not in self.clients:
+            raise Error("The client ID you want redirect to does not exist")
+        client.tracking = target
+        return OK
+
+    def cmd_config(self, client, subcommand, *args):
+        subcommand = subcommand.upper()
+        if subcommand == b"SET":
+            for name, value in zip(args[::2], args[1::2]):
+                self.config[name.decode("utf-8").lower()] = value.decode("utf-8")
+            return OK
+        if subcommand == b"GET":
+            pattern = glob_pattern(args[0])
+            return [
+                item.encode("utf-8") for name, value in self.config.items()
+                if pattern.match(name.encode("utf-8")) for item in (name, value)
+            ]
+        raise Error(f"unsupported CONFIG subcommand '{subcommand.decode('utf-8')}'")
+
+    def cmd_flushall(self, client, *args):
+        for db in {db for db, _ in self.tracked}:
+            self._invalidate(db)
+        self.dbs.clear()
+        return OK
+
+    def cmd_flushdb(self, client, *args):
+        self._invalidate(client.db)
+        self._db(client).clear()
+        return OK
+
+    def cmd_dbsize(self, client):
+        return len(self._db(client))
+
+    # Transactions
+
+    def cmd_multi(self, client):
+        if client.queued is not None:
+            raise Error("MULTI calls can not be nested")
+        client.queued = []
+        return OK
+
+    def cmd_exec(self, client):
+        if client.queued is None:
+            raise Error("EXEC without MULTI")
+        queued, client.queued = client.queued, None
+        return [self.call(client, name, args) for name, args in queued]
+
+    def cmd_discard(self, client):
+        if client.queued is None:
+            raise Error("DISCARD without MULTI")
+        client.queued = None
+        return OK
+
+    # Pub/sub
+
+    def cmd_subscribe(self, client, *channels):
+        replies = []
+        for channel in channels:
+            client.channels.add(channel)
+            replies.append([b"subscribe", channel, len(client.channels) + len(client.patterns)])
+        return self._subscription_replies(client, replies)
+
+    def cmd_psubscribe(self, client, *patterns):
+        replies = []
+        for pattern in patterns:
+            client.patterns.add(pattern)
+            replies.append([b"psubscribe", pattern, len(client.channels) + len(client.patterns)])
+        return self._subscription_replies(client, replies)
+
+    def cmd_unsubscribe(self, client, *channels):
+        replies = []
+        for channel in channels or list(client.channels):
+            client.channels.discard(channel)
+            replies.append([b"unsubscribe", channel, len(client.channels) + len(client.patterns)])
+        return self._subscription_replies(client, replies)
+
+    def cmd_punsubscribe(self, client, *patterns):
+        replies = []
+        for pattern in patterns or list(client.patterns):
+            client.patterns.discard(pattern)
+            replies.append([b"punsubscribe", pattern, len(client.channels) + len(client.patterns)])
+        return self._subscription_replies(client, replies)
+
+    @staticmethod
+    def _subscription_replies(client, replies: list):
+        # One reply per channel; all but the last are sent here.
+        for reply in replies[:-1]:
+            client.send(reply)
+        return replies[-1]
+
+    def cmd_publish(self, client, channel, message):
+        return self._deliver(channel, message)
+
+    # Scripts, which must have a Python implementation in script_functions.
+
+    def cmd_script(self, client, subcommand, *args):
+        subcommand = subcommand.upper()
+        if subcommand == b"LOAD":
+            script = scripts.Script(args[0].decode("utf-8"))
+            self.scripts.add(script.sha)
+            return script.sha
+        if subcommand == b"EXISTS":
+            return [int(sha.decode("utf-8") in self.scripts) for sha in args]
+        if subcommand == b"FLUSH":
+            self.scripts.clear()
+            return OK
+        raise Error(f"unsupported SCRIPT subcommand '{subcommand.decode('utf-8')}'")
+
+    def cmd_eval(self, client, source, numkeys, *args):
+        script = scripts.Script(source.decode("utf-8"))
+        self.scripts.add(script.sha)
+        return self.cmd_evalsha(client, script.sha.encode("utf-8"), numkeys, *args)
+
+    def cmd_evalsha(self, client, sha, numkeys, *args):
+        sha = sha.decode("utf-8")
+        if sha not in self.scripts:
+            raise Error("NOSCRIPT No matching script. Please use EVAL.")
+        if sha not in script_functions:
+            raise Error("scripts without a Python implementation are not supported")
+        numkeys = int(numkeys)
+
+        def call(name: str, *call_args):
+            result = self.call(client, name, [encode_arg(arg) for arg in call_args])
+            if isinstance(result, Error):
+                raise result
+            return result
+
+        return script_functions[sha](call, list(args[:numkeys]), list(args[numkeys:]))
+
+    # Keys
+
+    def cmd_del(self, client, *keys):
+        deleted = 0
+        for key in keys:
+            if self._db(client).pop(key, None) is not None:
+                deleted += 1
+                self._notify(client, key, "del")
+        return deleted
+
+    def cmd_exists(self, client, *keys):
+        return sum(1 for key in keys if key in self._db(client))
+
+    def cmd_type(self, client, key):
+        value = self._db(client).get(key)
+        return Status(type_names.get(type(value), "none"))
+
+    def cmd_keys(self, client, pattern):
+        pattern = glob_pattern(pattern)
+        return [key for key in self._db(client) if pattern.match(key)]
+
+    def cmd_scan(self, client, cursor, *options):
+        return self._scan_items(self._db(client), cursor, options, self._db(client))
+
+    def cmd_sscan(self, client, key, cursor, *options):
+        return self._scan_items(self._value(client, key, set), cursor, options)
+
+    @staticmethod
+    def _scan_items(items, cursor: bytes, options: tuple, db: dict = None):
+        # Items are walked in order of a hash of their name, so that, as with Redis,
+        # every item present for the whole scan is returned however the rest change.
+        count, pattern, kind = 10, None, None
+        for option, value in zip(options[::2], options[1::2]):
+            option = option.upper()
+            if option == b"COUNT":
+                count = int(value)
+            elif option == b"MATCH":
+                pattern = glob_pattern(value)
+            elif option == b"TYPE":
+                kind = value.decode("utf-8")
+            else:
+                raise Error("syntax error")
+        start = int(cursor)
+        remaining = [(scan_position(item), item) for item in items]
+        remaining = [(position, item) for position, item in remaining if position >= start]
+        page = heapq.nsmallest(count, remaining)
+        if len(page) == len(remaining):
+            end = 0
+        else:
+            # Items sharing the last position are returned with it.
+            end = page[-1][0] + 1
+            page = [(position, item) for position, item in remaining if position < end]
+        found = [
+            item for _, item in page
+            if (pattern is None or pattern.match(item))
+            and (kind is None or type_names[type(db[item])] == kind)
+        ]
+        return [str(end).encode("utf-8"), found]
+
+    # Strings
+
+    def cmd_get(self, client, key):
+        self._track(client, [key])
+        value = self._db(client).get(key)
+        if value is not None and not isinstance(value, bytes):
+            raise wrong_type
+        return value
+
+    def cmd_set(self, client, key, value, *options):
+        options = [option.upper() for option in options]
+        exists = key in self._db(client)
+        if (b"NX" in options and exists) or (b"XX" in options and not exists):
+            return None
+        self._db(client)[key] = value
+        self._notify(client, key, "set")
+        return OK
+
+    def cmd_mget(self, client, *keys):
+        self._track(client, keys)
+        values = [self._db(client).get(key) for key in keys]
+        return [value if isinstance(value, bytes) else None for value in values]
+
+    def cmd_mset(self, client, *pairs):
+        for key, value in zip(pairs[::2], pairs[1::2]):
+            self.cmd_set(client, key, value)
+        return OK
+
+    def cmd_incrby(self, client, key, increment):
+        value = self.cmd_get(client, key)
+        try:
+            value = int(value or 0) + int(increment)
+        except ValueError:
+            raise Error("value is not an integer or out of range")
+        self._db(client)[key] = str(value).encode("utf-8")
+        self._notify(client, key, "incrby")
+        return value
+
+    def cmd_incr(self, client, key):
+        return self.cmd_incrby(client, key, 1)
+
+    # Lists
+
+    def cmd_lpush(self, client, key, *values):
+        items = self._value(client, key, list, create=True)
+        for value in values:
+            items.insert(0, value)
+        self._notify(client, key, "lpush")
+        return len(items)
+
+    def cmd_rpush(self, client, key, *values):
+        items = self._value(client, key, list, create=True)
+        items.extend(values)
+        self._notify(client, key, "rpush")
+        return len(items)
+
+    def cmd_lrange(self, client, key, start, stop):
+        items = self._value(client, key, list)
+        start, stop = int(start), int(stop)
+        if start < 0:
+            start = max(len(items) + start, 0)
+        stop = len(items) + stop if stop < 0 else stop
+        return items[start:stop + 1]
+
+    def cmd_llen(self, client, key):
+        return len(self._value(client, key, list))
+
+    # Hashes
+
+    def cmd_hset(self, client, key, *pairs):
+        if len(pairs) == 0 or len(pairs) % 2 != 0:
+            raise Error("wrong number of arguments for 'hset' command")
+        fields = self._value(client, key, dict, create=True)
+        added = sum(1 for field in pairs[::2] if field not in fields)
+        fields.update(zip(pairs[::2], pairs[1::2]))
+        self._notify(client, key, "hset")
+        return added
+
+    def cmd_hget(self, client, key, field):
+        return self._value(client, key, dict).get(field)
+
+    def cmd_hmget(self, client, key, *fields):
+        values = self._value(client, key, dict)
+        return [values.get(field) for field in fields]
+
+    def cmd_hgetall(self, client, key):
+        return [item for pair in self._value(client, key, dict).items() for item in pair]
+
+    def cmd_hdel(self, client, key, *fields):
+        values = self._value(client, key, dict)
+        deleted = sum(1 for field in fields if values.pop(field, None) is not None)
+        if deleted > 0:
+            self._prune(client, key)
+            self._notify(client, key, "hdel")
+        return deleted
+
+    def cmd_hlen(self, client, key):
+        return len(self._value(client, key, dict))
+
+    # Sets
+
+    def cmd_sadd(self, client, key, *members):
+        if len(members) == 0:
+            raise Error("wrong number of arguments for 'sadd' command")
+        values = self._value(client, key, set, create=True)
+        added = len(set(members) - values)
+        values.update(members)
+        self._notify(client, key, "sadd")
+        return added
+
+    def cmd_srem(self, client, key, *members):
+        if len(members) == 0:
+            raise Error("wrong number of arguments for 'srem' command")
+        values = self._value(client, key, set)
+        removed = len(values & set(members))
+        values.difference_update(members)
+        if removed > 0:
+            self._prune(client, key)
+            self._notify(client, key, "srem")
+        return removed
+
+    def cmd_smembers(self, client, key):
+        return list(self._value(client, key, set))
+
+    def cmd_sismember(self, client, key, member):
+        return member in self._value(client, key, set)
+
+    def cmd_scard(self, client, key):
+        return len(self._value(client, key, set))
+
+    # Sorted sets
+
+    def cmd_zadd(self, client, key, *pairs):
+        if len(pairs) == 0 or len(pairs) % 2 != 0:
+            raise Error("syntax error")
+        scores = self._value(client, key, SortedSet, create=True)
+        added = 0
+        for score, member in zip(pairs[::2], pairs[1::2]):
+            added += member not in scores
+            scores[member] = parse_score(score)[0]
+        self._notify(client, key, "zadd")
+        return added
+
+    def cmd_zrem(self, client, key, *members):
+        scores = self._value(client, key, SortedSet)
+        removed = sum(1 for member in members if scores.pop(member, None) is not None)
+        if removed > 0:
+            self._prune(client, key)
+            self._notify(client, key, "zrem")
+        return removed
+
+    def cmd_zscore(self, client, key, member):
+        score = self._value(client, key, SortedSet).get(member)
+        return None if score is None else format_score(score)
+
+    def cmd_zcard(self, client, key):
+        return len(self._value(client, key, SortedSet))
+
+    def cmd_zrange(self, client, key, start, stop, *options):
+        ordered = self._value(client, key, SortedSet).ordered()
+        start, stop = int(start), int(stop)
+        if start < 0:
+            start = max(len(ordered) + start, 0)
+        stop = len(ordered) + stop if stop < 0 else stop
+        return self._range_reply(ordered[start:stop + 1], options)
+
+    def cmd_zrangebyscore(self, client, key, minimum, maximum, *options):
+        (low, low_exclusive), (high, high_exclusive) = parse_score(minimum), parse_score(maximum)
+        ordered = [
+            (member, score) for member, score in self._value(client, key, SortedSet).ordered()
+            if (score > low if low_exclusive else score >= low)
+            and (score < high if high_exclusive else score <= high)
+        ]
+        return self._range_reply(ordered, options)
+
+    def cmd_zrangebylex(self, client, key, minimum, maximum, *options):
+        def within(member: bytes, bound: bytes, above: bool) -> bool:
+            if bound in (b"-", b"+"):
+                return (bound == b"-") == above
+            if bound[:1] not in (b"[", b"("):
+                raise Error("min or max not valid string range item")
+            value = bound[1:]
+            if above:
+                return member > value if bound[:1] == b"(" else member >= value
+            return member < value if bound[:1] == b"(" else member <= value
+
+        ordered = [
+            (member, score) for member, score in self._value(client, key, SortedSet).ordered()
+            if within(member, minimum, True) and within(member, maximum, False)
+        ]
+        return self._range_reply(ordered, options)
+
+    @staticmethod
+    def _range_reply(ordered: list, options: tuple) -> list:
+        options = [option.upper() if isinstance(option, bytes) else option for option in options]
+        if b"LIMIT" in options:
+            i = options.index(b"LIMIT")
+            offset, count = int(options[i + 1]), int(options[i + 2])
+            ordered = ordered[offset:] if count < 0 else ordered[offset:offset + count]
+        if b"WITHSCORES" in options:
+            return [item for member, score in ordered for item in (member, format_score(score))]
+        return [member for member, _ in ordered]
+
+
+type_names = {bytes: "string", list: "list", dict: "hash", set: "set", SortedSet: "zset"}
+
+
+def encode_arg(arg) -> bytes:
+    if isinstance(arg, bytes):
+        return arg
+    if isinstance(arg, float):
+        return format_score(arg)
+    return str(arg).encode("utf-8")
+
+
+def deactivate_cascade(call, keys: list, argv: list):
+    # scripts.deactivate_cascade, line for line.
+    argv = [arg.decode("utf-8") for arg in argv]
+
+    def read(model, layout, id, field):
+        if layout == "hash":
+            return call("HGET", f"{model}:{id}", field)
+        return call("GET", f"{model}:{id}:{field}")
+
+    def deactivate(model, layout, id):
+        if layout == "hash":
+            if call("EXISTS", f"{model}:{id}") == 1:
+                call("HSET", f"{model}:{id}", "active", 0)
+        elif call("EXISTS", f"{model}:{id}:name") == 1:
+            call("SET", f"{model}:{id}:active", 0)
+
+    def active_key(model, id, relation):
+        return f"{model}:{id}:active_{relation}"
+
+    model, layout, id = argv[0], argv[1], argv[2]
+    if read(model, layout, id, "name") is None:
+        return None
+    deactivate(model, layout, id)
+
+    if argv[3] != "":
+        for child in call("SMEMBERS", f"{model}:{id}:{argv[3]}"):
+            child = child.decode("utf-8")
+            deactivate(argv[4], argv[5], child)
+            call("SREM", active_key(model, id, argv[3]), child)
+
+    parent = read(model, layout, id, argv[6])
+    if parent is None:
+        return 0
+    parent = parent.decode("utf-8")
+    siblings = active_key(argv[7], parent, argv[9])
+    call("SREM", siblings, id)
+    if call("SCARD", siblings) > 0:
+        return 0
+    deactivate(argv[7], argv[8], parent)
+
+    if argv[10] != "":
+        grandparent = read(argv[7], argv[8], parent, argv[10])
+        if grandparent is not None:
+            call("SREM", active_key(argv[11], grandparent.decode("utf-8"), argv[12]), parent)
+    return 1
+
+
+def remove_name(call, keys: list, argv: list):
+    # scripts.remove_name, line for line.
+    layout, id, new_name = [arg.decode("utf-8") for arg in argv]
+    if layout == "hash":
+        name = call("HGET", keys[1], "name")
+    else:
+        name = call("GET", keys[1])
+    if name is None or name.decode("utf-8") == new_name:
+        return 0
+    return call("ZREM", keys[0], name + f":{id}".encode("utf-8"))
+
+
+# Python implementations of the scripts in scripts.py, keyed by sha.
+script_functions = {
+    scripts.deactivate_cascade.sha: deactivate_cascade,
+    scripts.remove_name.sha: remove_name
+}
+
+servers = {}
+_servers_lock = RLock()
+
+
+def server(name: str = "") -> MemoryServer:
+    with _servers_lock:
+        if name not in servers:
+            servers[name] = MemoryServer(name)
+            log.debug(f"Started in-memory server. name={name!r}")
+        return servers[name]
+
+
+class MemoryConnection(redis.connection.Connection):
+    def __init__(self, server: MemoryServer = None, **kwargs):
+        super().__init__(**kwargs)
+        self.server = server
+
+    def _connect(self):
+        sock = self.server.connect()
+        sock.settimeout(self.socket_timeout)
+        return sock
+
+    def _host_error(self) -> str:
+        return f"memory://{self.server.name}"
+
+    def repr_pieces(self):
+        return [("server", self.server.name), ("db", self.db)]
+
+
+class AsyncMemoryConnection(redis.asyncio.Connection):
+    def __init__(self, server: MemoryServer = None, **kwargs):
+        super().__init__(**kwargs)
+        self.server = server
+
+    async def _connect(self):
+        self._reader, self._writer = await asyncio.open_connection(
+            sock=self.server.connect()
+        )
+
+    def _host_error(self) -> str:
+        return f"memory://{self.server.name}"
+
+    def repr_pieces(self):
+        return [("server", self.server.name), ("db", self.db)]
+
+
+def _pool_kwargs(url: str, kwargs: dict) -> dict:
+    # memory://name/db
+    parsed = urlparse(url)
+    path = parsed.path.strip("/")
+    kwargs = {"db": int(path) if path else 0, **kwargs}
+    kwargs["server"] = server(parsed.netloc)
+    # The server speaks RESP2 only.
+    kwargs["protocol"] = 2
+    return kwargs
+
+
+def connection_pool(url: str, **kwargs) -> ConnectionPool:
+    return ConnectionPool(connection_class=MemoryConnection, **_pool_kwargs(url, kwargs))
+
+
+def async_connection_pool(url: str, **kwargs) -> redis.asyncio.ConnectionPool:
+    return redis.asyncio.ConnectionPool(
+        connection_class=AsyncMemoryConnection, **_pool_kwargs(url, kwargs)
+    )
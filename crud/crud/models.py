@@ -1,14 +1,28 @@
 # -*- coding: utf-8 -*-
 from collections.abc import Iterable
+from contextvars import ContextVar
 from dataclasses import dataclass, field, fields, MISSING
 from datetime import datetime
 from enum import Enum, unique
+from functools import lru_cache
 
-from .database import connection
-from .errors import ForeignKeyException, InstantiationException
+from redis.exceptions import NoScriptError
+
+from . import database, indexes, scripts, stats
+from .database import connection, transaction
+from .cache import cached_reads, object_cache
+from .errors import ForeignKeyException, InstantiationException, MissingResultException
+from .layouts import KeyLayout, flatten
 from .utils import IDs, Names, log
 from .validators import Validator
 
+model_registry = {}
+
+# Cleared while the async API instantiates a model, as it writes the model itself.
+write_on_init = ContextVar("write_on_init", default=True)
+# Cleared while importing records which are already known to be valid, see bulk.py.
+validate_on_init = ContextVar("validate_on_init", default=True)
+
 
 @dataclass
 class Model:
@@ -17,9 +31,15 @@ class Model:
 
     _excluded = ("id",)
     _foreign_keys = {}
+    # Foreign keys to parents which keep a set of their active children, mapped to
+    # the parent's relation holding those children.
+    _active_parents = {}
 
     _validation_schema = {}
 
+    _layout = KeyLayout
+    _indexes = ()
+
     key_format = "{model}:{id}:{attribute}"
 
     class Read:
@@ -52,60 +72,148 @@ class Model:
             return f"{command} {' '.join(str(e) for e in extras)}"
         return f"{command} '{extras}'"
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        model_registry[cls._name()] = cls
+
+    @classmethod
+    def _name(cls) -> str:
+        return cls.__name__.lower()
+
     @classmethod
     def _generate_key(cls, id: int, key_name: str) -> str:
-        return f"{cls.__name__.lower()}:{id}:{key_name}"
+        return f"{cls._name()}:{id}:{key_name}"
 
     @classmethod
-    def _exec(cls, command: str, value=None):
-        if value is None:
-            return connection.execute_command(command)
-        return connection.execute_command(command, value)
+    def _exec(cls, command: str, *values):
+        with stats.timed([(command, *values)], model=cls._name()):
+            return database.reader().execute_command(command, *values)
 
     @classmethod
-    def _resolve_foreign_keys(cls, key_name: str, ids):
-        key_name = cls._foreign_keys[key_name]
+    def _exec_pipeline(cls, commands: list) -> list:
+        # Every command is sent in a single round trip.
+        pipeline = database.reader().pipeline(transaction=False)
+        for command in commands:
+            pipeline.execute_command(*command)
+        with stats.timed(commands, "PIPELINE", cls._name()):
+            return pipeline.execute()
 
-        def _resolve(k):
-            command = f"{cls.Read.Commands.get(key_name)}:{k}:name"
-            try:
-                result = connection.execute_command(command)
-                if result is None:
-                    raise ForeignKeyException(
-                        f"Could not resolve foreign key."
-                        f"key_name={key_name} k={k} cls={cls}"
-                    )
-            except:
-                log.exception(f"Something went wrong while attempting to resolve foreign keys.")
-                raise
+    @classmethod
+    def _referenced(cls, key_name: str):
+        return model_registry[cls._foreign_keys[key_name]]
 
-        if not isinstance(ids, Iterable) or isinstance(ids, str):
-            ids = [ids]
-        for i in ids:
-            _resolve(i)
+    @classmethod
+    def _exec_script(cls, script, *args):
+        # Scripts write, so they always run on the primary. Arguments are passed as ARGV,
+        # not KEYS, as the scripts derive keys from what they read (see scripts.py).
+        try:
+            with stats.timed([("EVALSHA", script.sha, 0, *args)], model=cls._name()):
+                result = database.connection.execute_command("EVALSHA", script.sha, 0, *args)
+        except NoScriptError:
+            # The script was never loaded, or the server's script cache was flushed.
+            # EVAL runs it and caches it for the next EVALSHA.
+            with stats.timed([("EVAL", script.source, 0, *args)], model=cls._name()):
+                result = database.connection.execute_command("EVAL", script.source, 0, *args)
+        database.wrote()
+        return result
 
     @classmethod
-    def get(cls, id: int, key_name: str):
+    def _foreign_key_reads(cls, references: dict) -> tuple:
+        # The commands checking every referenced id, and the (model name, id) each
+        # check refers to.
+        checks = {}
+        for key_name, ids in references.items():
+            if not isinstance(ids, Iterable) or isinstance(ids, str):
+                ids = [ids]
+            checks.setdefault(cls._foreign_keys[key_name], []).extend(ids)
+
+        commands = []
+        for model_name, ids in checks.items():
+            model = model_registry[model_name]
+            commands.extend(model._layout.name_commands(model, ids))
+
+        referenced = [(model_name, k) for model_name, ids in checks.items() for k in ids]
+        return commands, referenced
+
+    @classmethod
+    def _check_foreign_keys(cls, referenced: list, results: list):
+        for (key_name, k), result in zip(referenced, results):
+            if result is None:
+                raise ForeignKeyException(
+                    f"Could not resolve foreign key."
+                    f"key_name={key_name} k={k} cls={cls}"
+                )
+
+    @classmethod
+    def _resolve_foreign_keys(cls, references: dict):
+        # Checks every referenced id in a single round trip.
+        commands, referenced = cls._foreign_key_reads(references)
+        if len(commands) == 0:
+            return
+        try:
+            cls._check_foreign_keys(referenced, flatten(cls._exec_pipeline(commands)))
+        except:
+            log.exception(f"Something went wrong while attempting to resolve foreign keys.")
+            raise
+
+    @classmethod
+    def _read_command(cls, id: int, key_name: str) -> str:
         key = cls._generate_key(id, key_name)
         try:
             read_func = getattr(cls.Read.Commands, key_name)
         except AttributeError:
             read_func = cls.Read.Commands.get
+        return read_func(key)
 
-        command = read_func(key)
-        result = cls._exec(command)
+    @classmethod
+    def _length_command(cls, id: int, key_name: str) -> str:
+        return f"SCARD {cls._generate_key(id, key_name)}"
 
+    @classmethod
+    def _convert(cls, key_name: str, value):
         convert = getattr(cls.Read.Converters, key_name, cls.Read.Converters._all)
-        result = convert(result)
-        return result
+        return convert(value)
 
     @classmethod
-    def put(cls, id: int, key_name: str, value):
-        key = cls._generate_key(id, key_name)
+    def _string_key(cls, key_name: str) -> bool:
+        return cls._layout is KeyLayout and key_name not in cls._relations()
 
+    @classmethod
+    def _client_cached(cls, key_name: str) -> bool:
+        # Only values stored in their own string key can be cached client side.
+        return database.client_cache is not None and cls._string_key(key_name)
+
+    @classmethod
+    def _attribute_reads(cls, ids: list, key_name: str):
+        # Raw stored values of one attribute of every model, in a single round trip.
+        # A generator of reads, see query.run.
+        if len(ids) == 0:
+            return []
+        keys = [cls._generate_key(id, key_name) for id in ids]
+        if cls._client_cached(key_name):
+            return database.client_cache.get_many(keys)
+        if cls._string_key(key_name):
+            return (yield [("MGET", *keys)])[0]
+        return (yield [cls._layout.read_command(cls, id, key_name) for id in ids])
+
+    @classmethod
+    def get(cls, id: int, key_name: str):
+        if cls._client_cached(key_name):
+            return cls._convert(key_name, database.client_cache.get(cls._generate_key(id, key_name)))
+        command = cls._layout.read_command(cls, id, key_name)
+        result = cls._exec(*command)
+        return cls._convert(key_name, result)
+
+    @classmethod
+    def _to_storage(cls, key_name: str, value):
         converter = getattr(cls.Write.Converters, key_name, None)
         if converter is not None:
             value = converter(value)
+        return value
+
+    @classmethod
+    def _write_command(cls, id: int, key_name: str, value) -> tuple:
+        key = cls._generate_key(id, key_name)
 
         try:
             write_func = getattr(cls.Write.Commands, key_name)
@@ -113,37 +221,171 @@ class Model:
             write_func = cls.Write.Commands.set
 
         command = write_func(key)
+        if isinstance(value, list):
+            return (command, *value)
+        return command, value
 
-        if key_name in cls._foreign_keys:
-            cls._resolve_foreign_keys(key_name, value)
+    @classmethod
+    def _remove_command(cls, id: int, key_name: str, members: list) -> tuple:
+        return (f"SREM {cls._generate_key(id, key_name)}", *members)
 
-        result = cls._exec(command, value)
-        return result
+    @classmethod
+    def _references(cls, values: dict) -> dict:
+        # The foreign keys among values, which are checked before they are written.
+        return {
+            key_name: value for key_name, value in values.items() if key_name in cls._foreign_keys
+        }
 
     @classmethod
-    def get_model(cls, id: int, post: list):
-        for f in fields(cls):
-            if not f.init and f.name not in cls._excluded:
-                post.append(
-                    (f.name, cls.get(id, f.name),)
-                )
+    def _write_commands(cls, id: int, values: dict, stored_before: bool = True) -> list:
+        cls._resolve_foreign_keys(cls._references(values))
+        return cls._writes(id, values, stored_before)
 
-            if f.name in cls._excluded or not f.init:
-                continue
-            yield f.name, cls.get(id, f.name)
+    @classmethod
+    def _writes(cls, id: int, values: dict, stored_before: bool = True) -> list:
+        # A model which may have been stored before has its stored name removed from
+        # the name index within the same transaction, before the new name is written.
+        stored = {key_name: cls._to_storage(key_name, value) for key_name, value in values.items()}
+        commands = cls._layout.write_commands(cls, id, stored) + indexes.write_commands(cls, id, stored)
+        if stored_before and "name" in stored:
+            commands = indexes.rename_commands(cls, id, stored["name"]) + commands
+        return commands
 
-    def put_model(self):
-        for f in fields(self):
-            if f.name in self._excluded:
-                continue
+    @classmethod
+    def _load_scripts(cls, commands: list):
+        def exec(*command):
+            with stats.timed([command], model=cls._name()):
+                return database.connection.execute_command(*command)
+
+        scripts.load_missing(exec, commands)
+
+    @classmethod
+    def _exec_transaction(cls, commands: list):
+        cls._load_scripts(commands)
+        with transaction() as pipeline:
+            for command in commands:
+                pipeline.execute_command(*command)
+        # The server's own invalidations arrive asynchronously, after this returns.
+        if database.client_cache is not None:
+            database.client_cache.invalidate_commands(commands)
 
-            try:
-                value = getattr(self, f.name)
-                if isinstance(value, list) or value is None or value == MISSING:
-                    continue
-                self.put(self.id, f.name, value)
-            except AttributeError:
+    @classmethod
+    def put(cls, id: int, key_name: str, value):
+        cls._exec_transaction(cls._write_commands(id, {key_name: value}))
+        object_cache.invalidate(cls._name(), id)
+
+    @classmethod
+    @lru_cache(maxsize=None)
+    def _stored_fields(cls) -> tuple:
+        return tuple(f for f in fields(cls) if f.name not in cls._excluded)
+
+    @classmethod
+    @lru_cache(maxsize=None)
+    def _stored_names(cls) -> frozenset:
+        return frozenset(f.name for f in cls._stored_fields())
+
+    @classmethod
+    @lru_cache(maxsize=None)
+    def _relations(cls) -> tuple:
+        return tuple(f.name for f in cls._stored_fields() if f.type == list)
+
+    @classmethod
+    def _values_reads(cls, ids: list) -> tuple:
+        key_names = [f.name for f in cls._stored_fields()]
+        return key_names, [cls._layout.read_commands(cls, id, key_names) for id in ids]
+
+    @classmethod
+    def _read_values(cls, ids: list) -> dict:
+        # Reads every stored field of every model in a single round trip.
+        key_names, reads = cls._values_reads(ids)
+        results = cls._exec_pipeline([c for commands in reads for c in commands])
+        return cls._parse_values(ids, key_names, reads, results)
+
+    @classmethod
+    def _parse_values(cls, ids: list, key_names: list, reads: list, results: list) -> dict:
+        values = {}
+        offset = 0
+        for id, commands in zip(ids, reads):
+            values[id] = cls._layout.parse(cls, key_names, results[offset:offset + len(commands)])
+            offset += len(commands)
+        return values
+
+    @classmethod
+    def _missing(cls, values: dict) -> list:
+        # Every model has a name, so a missing name means a missing model.
+        return [id for id, raw in values.items() if raw.get("name") is None]
+
+    @classmethod
+    def get_model(cls, id: int, post: list, raw: dict = None):
+        if raw is None:
+            raw = cls._read_values([id])[id]
+
+        for f in cls._stored_fields():
+            value = cls._convert(f.name, raw[f.name])
+            if not f.init:
+                post.append((f.name, value,))
+                continue
+            yield f.name, value
+
+    def _commit(self):
+        commands, self._commands = self._commands, []
+        self._exec_transaction(commands)
+
+    def _changes(self) -> tuple:
+        # The values changed since the model was created, loaded or last put, and the
+        # commands written alongside them.
+        values = {}
+        removals = []
+        for key_name, original in self._dirty.items():
+            if key_name in self._relations():
+                continue
+            value = getattr(self, key_name, None)
+            if value is None or value == MISSING:
+                continue
+            values[key_name] = value
+
+        # Relations may be changed in place, e.g. by sport.events.append(id), so they
+        # are compared with a copy taken when the model was last clean.
+        snapshot = self.__dict__.get("_snapshot", {})
+        for key_name in self._relations():
+            if key_name in snapshot:
+                original = snapshot[key_name]
+            elif key_name in self._dirty:
+                original = self._dirty[key_name]
+            else:
                 continue
+            value = getattr(self, key_name, None)
+            # Relations are stored as sets, so only added and removed members are sent.
+            old = set(original) if isinstance(original, list) else set()
+            new = set(value) if isinstance(value, list) else set()
+            if len(new - old) > 0:
+                values[key_name] = sorted(new - old)
+            if len(old - new) > 0:
+                removals.append(self._remove_command(self.id, key_name, sorted(old - new)))
+        return values, removals + self._active_commands()
+
+    def _clean(self):
+        # Called once the model matches what is stored.
+        self._dirty = {}
+        self._snapshot = {
+            key_name: list(getattr(self, key_name)) for key_name in self._relations()
+            if isinstance(getattr(self, key_name, None), list)
+        }
+
+    def _stored_before(self) -> bool:
+        # New models have no name to replace.
+        return self._dirty.get("name") is not MISSING
+
+    def put_model(self):
+        # Only the fields changed since the model was created, loaded or last put are written.
+        values, commands = self._changes()
+        if len(values) > 0:
+            self._commands.extend(self._write_commands(self.id, values, self._stored_before()))
+        self._commands.extend(commands)
+        if len(self._commands) > 0:
+            self._commit()
+            object_cache.invalidate(self._name(), self.id)
+        self._clean()
 
     @classmethod
     def new(cls, *args, id: int = None, **kwargs):
@@ -156,17 +398,59 @@ class Model:
         else:
             return cls(*args, id=IDs.generate_id(), **kwargs)
 
+    @classmethod
+    def _build(cls, id: int, raw: dict):
+        # Stored values were validated when they were written, so the instance is
+        # hydrated directly, without __init__, validation or writing it back.
+        inst = cls.__new__(cls)
+        inst.id = id
+        for f in cls._stored_fields():
+            setattr(inst, f.name, cls._convert(f.name, raw[f.name]))
+        inst._commands = []
+        inst._clean()
+        inst._derive()
+        return inst
+
     @classmethod
     def load(cls, id):
-        post_init = []
-        kwargs = {
-            field_name: value for field_name, value in cls.get_model(id, post_init)
-        }
-        inst = cls(id=id, **kwargs)
+        return cls.load_many([id])[0]
 
-        for attr_name, value in post_init:
-            setattr(inst, attr_name, value)
-        return inst
+    @classmethod
+    def load_many(cls, ids: list) -> list:
+        ids = [int(id) for id in ids]
+        generation = object_cache.generation()
+        values = cls._cached_values(ids)
+        unread = [id for id in dict.fromkeys(ids) if id not in values]
+        read = cls._read_values(unread) if len(unread) > 0 else {}
+        return cls._loaded(ids, values, read, generation)
+
+    @classmethod
+    def _cached_values(cls, ids: list) -> dict:
+        values = {}
+        if object_cache.enabled and cached_reads.get():
+            for id in dict.fromkeys(ids):
+                raw = object_cache.get(cls._name(), id)
+                if raw is not None:
+                    values[id] = raw
+        return values
+
+    @classmethod
+    def _loaded(cls, ids: list, values: dict, read: dict, generation: int = None) -> list:
+        # Builds the models from cached values and those just read, in the order of ids.
+        missing = cls._missing(read)
+        if len(missing) > 0:
+            raise MissingResultException(
+                f"Could not find {cls.__name__.lower()} objects. ids={missing}"
+            )
+        # A replica may not have received a write whose invalidation has already been
+        # handled, so only values read from the primary are cached.
+        if not database.reads_from_replica():
+            for id, raw in read.items():
+                object_cache.set(cls._name(), id, raw, generation)
+        values.update(read)
+
+        built = {id: cls._build(id, raw) for id, raw in values.items()}
+        return [built[id] for id in ids]
 
     def update(self, **kwargs):
         for attr_name in (f.name for f in fields(self) if f.name not in self._excluded):
@@ -177,10 +461,43 @@ class Model:
                     pass
         return self
 
+    def __setattr__(self, name, value):
+        # Stored fields remember their original value the first time they change.
+        if name in self._stored_names():
+            dirty = self.__dict__.setdefault("_dirty", {})
+            original = self.__dict__.get(name, MISSING)
+            if name not in dirty and original != value:
+                dirty[name] = original
+        super().__setattr__(name, value)
+
+    def _active_commands(self) -> list:
+        commands = []
+        for key_name, relation in self._active_parents.items():
+            if key_name not in self._dirty and "active" not in self._dirty:
+                continue
+            old_parent_id = self._dirty.get(key_name)
+            commands.extend(indexes.active_commands(
+                self._referenced(key_name), relation, self.id, self.active,
+                getattr(self, key_name),
+                None if old_parent_id is MISSING else old_parent_id
+            ))
+        return commands
+
+    @classmethod
+    def active_children(cls, id: int, relation: str) -> int:
+        return cls._exec("SCARD", indexes.active_key(cls, id, relation))
+
+    def _derive(self):
+        # Sets attributes which are derived from others rather than stored.
+        pass
+
     def __post_init__(self, *args, **kwargs):
-        Validator(self).validate()
+        self._derive()
+        if validate_on_init.get():
+            Validator.for_model(type(self)).validate_model(self)
         self._commands = []
-        self.put_model()  # FIXME Do not put if the model has just been read from DB.
+        if write_on_init.get():
+            self.put_model()
 
     def activate(self):
         self.active = True
@@ -190,6 +507,46 @@ class Model:
         self.active = False
         self.put_model()
 
+    @classmethod
+    def deactivate_cascade(cls, id: int, parent: str, children: str = None) -> bool:
+        # Deactivates the model and its children, then its parent if none of the parent's
+        # children are still active, atomically in one round trip.
+        # Returns whether the parent was deactivated.
+        result = cls._exec_script(scripts.deactivate_cascade, *cls._cascade_args(id, parent, children))
+        return cls._cascaded(id, parent, children, result)
+
+    @classmethod
+    def _cascade_args(cls, id: int, parent: str, children: str = None) -> tuple:
+        parent_model = cls._referenced(parent)
+        child_args = ("", "", "")
+        if children is not None:
+            child_model = cls._referenced(children)
+            child_args = (children, child_model._name(), child_model._layout.name)
+
+        grandparent_args = ("", "", "")
+        for key_name, relation in parent_model._active_parents.items():
+            grandparent_args = (key_name, parent_model._referenced(key_name)._name(), relation)
+
+        return (
+            cls._name(), cls._layout.name, id, *child_args,
+            parent, parent_model._name(), parent_model._layout.name,
+            cls._active_parents[parent], *grandparent_args
+        )
+
+    @classmethod
+    def _cascaded(cls, id: int, parent: str, children: str, result) -> bool:
+        if result is None:
+            raise MissingResultException(f"Could not find {cls._name()} objects. ids={[id]}")
+
+        # The script does not report which children and parent it wrote.
+        if database.client_cache is not None:
+            database.client_cache.invalidate_matching(lambda key: key.endswith(":active"))
+        object_cache.invalidate(cls._name(), id)
+        object_cache.invalidate_model(cls._referenced(parent)._name())
+        if children is not None:
+            object_cache.invalidate_model(cls._referenced(children)._name())
+        return bool(result)
+
 
 @dataclass
 class Sport(Model):
@@ -207,7 +564,7 @@ class Sport(Model):
         class Commands(Model.Read.Commands):
             @staticmethod
             def events(key):
-                return f"LRANGE {key} 0 -1"
+                return f"SMEMBERS {key}"
 
         class Converters(Model.Read.Converters):
             @staticmethod
@@ -216,13 +573,13 @@ class Sport(Model):
 
             @staticmethod
             def events(value):
-                return value
+                return sorted(int(id) for id in value)
 
     class Write(Model.Write):
         class Commands(Model.Write.Commands):
             @staticmethod
             def events(key):
-                return f"LPUSH {key}"
+                return f"SADD {key}"
 
         class Converters(Model.Write.Converters):
             @staticmethod
@@ -251,9 +608,8 @@ class Sport(Model):
         self.active = False
         self.put_model()
 
-    def __post_init__(self, *args, **kwargs):
+    def _derive(self):
         self.slug = Names.generate_slug(self.name)
-        super().__post_init__(*args, **kwargs)
 
 
 @dataclass
@@ -286,6 +642,10 @@ class Event(Model):
         "selections": "selection",
         "sport": "sport"
     }
+    _active_parents = {
+        "sport": "events"
+    }
+    _indexes = ("status", "scheduled_start",)
 
     _validation_schema = {
         "type": {"allowed": Types},
@@ -298,7 +658,7 @@ class Event(Model):
         class Commands(Model.Read.Commands):
             @staticmethod
             def selections(key):
-                return f"LRANGE {key} 0 -1"
+                return f"SMEMBERS {key}"
 
         class Converters(Model.Read.Converters):
             @staticmethod
@@ -317,7 +677,7 @@ class Event(Model):
 
             @staticmethod
             def selections(value):
-                return [int(id) for id in value]
+                return sorted(int(id) for id in value)
 
             @staticmethod
             def sport(value):
@@ -335,7 +695,7 @@ class Event(Model):
         class Commands(Model.Write.Commands):
             @staticmethod
             def selections(key):
-                return f"LPUSH {key}"
+                return f"SADD {key}"
 
         class Converters(Model.Write.Converters):
             @staticmethod
@@ -358,9 +718,8 @@ class Event(Model):
                     return []
                 return value
 
-    def __post_init__(self, *args, **kwargs):
+    def _derive(self):
         self.slug = Names.generate_slug(self.name)
-        super().__post_init__(*args, **kwargs)
 
 
 @dataclass
@@ -368,6 +727,10 @@ class Selection(Model):
     _foreign_keys = {
         "event": "event"
     }
+    _active_parents = {
+        "event": "selections"
+    }
+    _indexes = ("price",)
 
     @unique
     class Outcomes(Enum):
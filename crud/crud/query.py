@@ -0,0 +1,317 @@
+# -*- coding: utf-8 -*-
+import operator
+import re
+
+from . import indexes
+from .errors import FilterException
+
+comparisons = {
+    "<<": operator.lt,
+    "<=": operator.le,
+    ">>": operator.gt,
+    ">=": operator.ge,
+    "==": operator.eq
+}
+
+
+def run(reads, model):
+    # Predicates read through generators which yield the commands of each round trip
+    # and are sent back the results, so the same plan can be sent synchronously here
+    # or asynchronously by aio. A single command is sent on its own, not pipelined.
+    try:
+        commands = next(reads)
+        while True:
+            if len(commands) == 1:
+                results = [model._exec(*commands[0])]
+            else:
+                results = model._exec_pipeline(commands) if len(commands) > 0 else []
+            commands = reads.send(results)
+    except StopIteration as stop:
+        return stop.value
+
+
+class Predicate:
+    # Predicates are evaluated against ids, reading as few keys as possible.
+    # Models are only loaded for the ids which survive every predicate.
+    # Compiled predicates hold no per-query state and can be reused; anything
+    # read during a single query is kept in its memo dictionary instead.
+    cost = 0
+    indexed = False
+
+    def candidate_reads(self, model, memo: dict):
+        # A superset of the matching ids read from indexes, or None if unknown.
+        return None
+        yield
+
+    def select_reads(self, model, ids: list, memo: dict):
+        # The matching ids among ids, in their original order.
+        raise NotImplementedError
+
+    def candidates(self, model, memo: dict):
+        return run(self.candidate_reads(model, memo), model)
+
+    def select(self, model, ids: list, memo: dict) -> list:
+        return run(self.select_reads(model, ids, memo), model)
+
+
+class IndexedPredicate(Predicate):
+    indexed = True
+
+    def _read_candidates(self, model):
+        raise NotImplementedError
+
+    def _read_select(self, model, ids: list):
+        raise NotImplementedError
+
+    def candidate_reads(self, model, memo: dict):
+        if self not in memo:
+            memo[self] = yield from self._read_candidates(model)
+        return memo[self]
+
+    def select_reads(self, model, ids: list, memo: dict):
+        # Index reads are exact, so candidates already read answer the predicate.
+        if self in memo:
+            return [id for id in ids if id in memo[self]]
+        return (yield from self._read_select(model, ids))
+
+
+class NameMatch(IndexedPredicate):
+    cost = 1
+
+    def __init__(self, pattern: str):
+        self._pattern = pattern
+        self._regex = re.compile(pattern)
+
+    def _read_candidates(self, model):
+        prefix = indexes.literal_prefix(self._pattern)
+        members = (yield [indexes.names_command(model, prefix)])[0]
+        return {
+            id for id, name in indexes.parse_names(members)
+            if self._regex.match(name) is not None
+        }
+
+    def _read_select(self, model, ids: list):
+        names = yield from model._attribute_reads(ids, "name")
+        return [
+            id for id, name in zip(ids, names)
+            if name is not None and self._regex.match(name.decode("utf-8")) is not None
+        ]
+
+
+class Comparison(Predicate):
+    def __init__(self, attribute: str, op: str, operand: float):
+        self._attribute = attribute
+        self._op = op
+        self._operator = comparisons[op]
+        self._operand = operand
+
+
+class AttributeComparison(Comparison):
+    # Compares stored values, e.g. timestamps rather than datetimes.
+    cost = 2
+
+    def select_reads(self, model, ids: list, memo: dict):
+        values = yield from model._attribute_reads(ids, self._attribute)
+        return [
+            id for id, value in zip(ids, values)
+            if value is not None and self._operator(float(value), self._operand)
+        ]
+
+
+class IndexedComparison(IndexedPredicate, AttributeComparison):
+    cost = 1
+
+    def _read_candidates(self, model):
+        command = indexes.score_range_command(model, self._attribute, self._op, self._operand)
+        return set(indexes.parse_ids((yield [command])[0]))
+
+    def _read_select(self, model, ids: list):
+        return (yield from AttributeComparison.select_reads(self, model, ids, {}))
+
+
+class RelationLength(Comparison):
+    cost = 2
+
+    def select_reads(self, model, ids: list, memo: dict):
+        lengths = yield [(model._length_command(id, self._attribute),) for id in ids]
+        return [
+            id for id, length in zip(ids, lengths)
+            if self._operator(length, self._operand)
+        ]
+
+
+class And(Predicate):
+    def __init__(self, children: list):
+        # Cheapest predicates first, so later ones read keys for fewer ids.
+        self._children = sorted(children, key=lambda p: p.cost)
+        self.cost = sum(child.cost for child in children)
+        self.indexed = any(child.indexed for child in children)
+
+    def candidate_reads(self, model, memo: dict):
+        result = None
+        for child in self._children:
+            candidates = yield from child.candidate_reads(model, memo)
+            if candidates is not None:
+                result = candidates if result is None else result & candidates
+        return result
+
+    def select_reads(self, model, ids: list, memo: dict):
+        for child in self._children:
+            if len(ids) == 0:
+                break
+            ids = yield from child.select_reads(model, ids, memo)
+        return ids
+
+
+class Or(Predicate):
+    def __init__(self, children: list):
+        self._children = sorted(children, key=lambda p: p.cost)
+        self.cost = sum(child.cost for child in children)
+        self.indexed = all(child.indexed for child in children)
+
+    def candidate_reads(self, model, memo: dict):
+        result = set()
+        for child in self._children:
+            candidates = yield from child.candidate_reads(model, memo)
+            if candidates is None:
+                return None
+            result |= candidates
+        return result
+
+    def select_reads(self, model, ids: list, memo: dict):
+        # Each child only examines the ids no earlier child has matched.
+        matched = set()
+        for child in self._children:
+            remaining = [id for id in ids if id not in matched]
+            if len(remaining) == 0:
+                break
+            matched.update((yield from child.select_reads(model, remaining, memo)))
+        return [id for id in ids if id in matched]
+
+
+class Not(Predicate):
+    def __init__(self, child: Predicate):
+        self._child = child
+        self.cost = child.cost
+
+    def select_reads(self, model, ids: list, memo: dict):
+        excluded = set((yield from self._child.select_reads(model, ids, memo)))
+        return [id for id in ids if id not in excluded]
+
+
+def plan(predicate: Predicate, model):
+    # Candidates are read from indexes where possible, then narrowed down to
+    # the exact matches before any model is loaded. A generator of reads.
+    memo = {}
+    candidates = yield from predicate.candidate_reads(model, memo)
+    if candidates is None:
+        ids = indexes.parse_ids((yield [indexes.all_ids_command(model)])[0])
+    else:
+        ids = list(candidates)
+    return (yield from predicate.select_reads(model, ids, memo))
+
+
+def execute(predicate: Predicate, model) -> list:
+    return run(plan(predicate, model), model)
+
+
+keyword_pattern = re.compile(r"(AND|OR|NOT)(?=[\s(]|$)")
+separator_pattern = re.compile(r"\s+(AND|OR)(?=[\s(]|$)")
+
+
+def tokenize(filter_string: str) -> list:
+    # Tokens are (kind, text) pairs. A term runs until AND/OR, or a closing
+    # parenthesis it did not open itself, so regexes may contain groups.
+    tokens = []
+    i = 0
+    while i < len(filter_string):
+        char = filter_string[i]
+        if char.isspace():
+            i += 1
+            continue
+        if char in "()":
+            tokens.append((char, char))
+            i += 1
+            continue
+
+        keyword = keyword_pattern.match(filter_string, i)
+        if keyword is not None:
+            tokens.append((keyword.group(1), keyword.group(1)))
+            i = keyword.end()
+            continue
+
+        start = i
+        depth = 0
+        while i < len(filter_string):
+            char = filter_string[i]
+            if char == "\\":
+                i += 2
+                continue
+            if char == "(":
+                depth += 1
+            elif char == ")":
+                if depth == 0:
+                    break
+                depth -= 1
+            elif depth == 0 and separator_pattern.match(filter_string, i):
+                break
+            i += 1
+        tokens.append(("term", filter_string[start:i].strip()))
+    return tokens
+
+
+class Parser:
+    # expression := and ("OR" and)*
+    # and        := not ("AND" not)*
+    # not        := "NOT" not | "(" expression ")" | term
+    def __init__(self, filter_string: str, term):
+        self._tokens = tokenize(filter_string)
+        self._position = 0
+        self._term = term
+
+    def _peek(self):
+        if self._position < len(self._tokens):
+            return self._tokens[self._position][0]
+
+    def _next(self):
+        token = self._tokens[self._position]
+        self._position += 1
+        return token
+
+    def parse(self) -> Predicate:
+        if len(self._tokens) == 0:
+            raise FilterException("Empty filter.")
+        predicate = self._or()
+        if self._position != len(self._tokens):
+            raise FilterException(f"Unexpected token: {self._tokens[self._position][1]}")
+        return predicate
+
+    def _or(self) -> Predicate:
+        children = [self._and()]
+        while self._peek() == "OR":
+            self._next()
+            children.append(self._and())
+        return children[0] if len(children) == 1 else Or(children)
+
+    def _and(self) -> Predicate:
+        children = [self._not()]
+        while self._peek() == "AND":
+            self._next()
+            children.append(self._not())
+        return children[0] if len(children) == 1 else And(children)
+
+    def _not(self) -> Predicate:
+        kind = self._peek()
+        if kind == "NOT":
+            self._next()
+            return Not(self._not())
+        if kind == "(":
+            self._next()
+            predicate = self._or()
+            if self._peek() != ")":
+                raise FilterException("Missing closing parenthesis.")
+            self._next()
+            return predicate
+        if kind == "term":
+            return self._term(self._next()[1])
+        raise FilterException(f"Expected a filter, found: {kind}")
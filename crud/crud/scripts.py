@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+import hashlib
+
+
+class Script:
+    def __init__(self, source: str):
+        self.source = source
+        self.sha = hashlib.sha1(source.encode("utf-8")).hexdigest()
+
+
+# Deactivates a model and every child in one of its relations, then its parent
+# if the parent has no active children left. Keys follow each model's layout,
+# so the script reads and writes exactly what the models do, and keeps the
+# sets of active children (see indexes.active_key) up to date. Children and parents
+# which no longer exist, e.g. ids left in a relation after their model was removed,
+# are not written, so that no key is created for them.
+# The keys of the children and parents are only known once the script has read the
+# relation and the parent's id, so they cannot be passed as KEYS: like the rest of
+# the models, which write many unrelated keys in one transaction, the script needs a
+# single server rather than a cluster or a proxy which routes commands by key.
+# ARGV: model, layout, id,
+#       children relation, child model, child layout  (empty if none)
+#       parent field, parent model, parent layout, parent's children relation,
+#       parent's parent field, grandparent model, grandparent's children relation  (empty if none)
+# Returns nil if the model does not exist, 1 if the parent was deactivated, 0 otherwise.
+deactivate_cascade = Script("""
+local function read(model, layout, id, field)
+    if layout == "hash" then
+        return redis.call("HGET", model .. ":" .. id, field)
+    end
+    return redis.call("GET", model .. ":" .. id .. ":" .. field)
+end
+
+local function deactivate(model, layout, id)
+    if layout == "hash" then
+        if redis.call("EXISTS", model .. ":" .. id) == 1 then
+            redis.call("HSET", model .. ":" .. id, "active", 0)
+        end
+    elseif redis.call("EXISTS", model .. ":" .. id .. ":name") == 1 then
+        redis.call("SET", model .. ":" .. id .. ":active", 0)
+    end
+end
+
+local function active_key(model, id, relation)
+    return model .. ":" .. id .. ":active_" .. relation
+end
+
+local model, layout, id = ARGV[1], ARGV[2], ARGV[3]
+if not read(model, layout, id, "name") then
+    return nil
+end
+deactivate(model, layout, id)
+
+if ARGV[4] ~= "" then
+    for _, child in ipairs(redis.call("SMEMBERS", model .. ":" .. id .. ":" .. ARGV[4])) do
+        deactivate(ARGV[5], ARGV[6], child)
+        redis.call("SREM", active_key(model, id, ARGV[4]), child)
+    end
+end
+
+local parent = read(model, layout, id, ARGV[7])
+if not parent then
+    return 0
+end
+local siblings = active_key(ARGV[8], parent, ARGV[10])
+redis.call("SREM", siblings, id)
+if redis.call("SCARD", siblings) > 0 then
+    return 0
+end
+deactivate(ARGV[8], ARGV[9], parent)
+
+if ARGV[11] ~= "" then
+    local grandparent = read(ARGV[8], ARGV[9], parent, ARGV[11])
+    if grandparent then
+        redis.call("SREM", active_key(ARGV[12], grandparent, ARGV[13]), parent)
+    end
+end
+return 1
+""")
+
+# Removes the name a model has stored from the name index (see indexes.index_key),
+# unless it is the name about to be written. Sent in the same transaction as, and
+# before, the new name, so that the index never keeps a name the model no longer has.
+# KEYS: the name index, the key holding the model's name
+# ARGV: layout, id, new name
+# Returns 1 if a name was removed, 0 otherwise.
+remove_name = Script("""
+local name
+if ARGV[1] == "hash" then
+    name = redis.call("HGET", KEYS[2], "name")
+else
+    name = redis.call("GET", KEYS[2])
+end
+if not name or name == ARGV[3] then
+    return 0
+end
+return redis.call("ZREM", KEYS[1], name .. ":" .. ARGV[2])
+""")
+
+scripts = (deactivate_cascade, remove_name)
+scripts_by_sha = {script.sha: script for script in scripts}
+
+
+def load(exec):
+    # Caches every script on the server, so each call is a single EVALSHA.
+    for script in scripts:
+        exec("SCRIPT", "LOAD", script.source)
+
+
+def called(commands: list) -> list:
+    # The shas of the scripts commands call with EVALSHA.
+    return list(dict.fromkeys(command[1] for command in commands if command[0] == "EVALSHA"))
+
+
+def load_missing(exec, commands: list):
+    # A script missing from the server's cache fails within a transaction, after the
+    # rest of it has been applied, so the scripts the commands call are loaded first.
+    shas = called(commands)
+    if len(shas) == 0:
+        return
+    for sha, exists in zip(shas, exec("SCRIPT", "EXISTS", *shas)):
+        if not exists:
+            exec("SCRIPT", "LOAD", scripts_by_sha[sha].source)
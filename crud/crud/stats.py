@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+# Counts the commands sent to the database and times each round trip, attributed to
+# the view or controller operation which sent them. Disabled until enable() is called.
+#
+#   recorder = stats.enable()
+#   SportView.get_sport(sport_id)
+#   print(recorder.export(stats.prometheus_sink))
+import asyncio
+import re
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from functools import wraps
+from threading import Lock
+import time
+
+from .utils import iterate_in_context, log
+
+# Upper bounds of the latency histogram buckets, in seconds.
+buckets = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+model_prefix = re.compile(r"([a-z_]\w*):")
+
+# The outermost view or controller method being called, e.g. "SportView.get_sport".
+operation = ContextVar("operation", default=None)
+
+
+def command_name(command: tuple) -> str:
+    # Commands are either ("SET key", value) or ("SADD", key, member, ...).
+    return command[0].split(" ", 1)[0].upper()
+
+
+def command_model(command: tuple, default: str) -> str:
+    # Keys are prefixed with the model's name, e.g. sport:1:name or event:ids.
+    words = command[0].split(" ")
+    key = words[1] if len(words) > 1 else (command[1] if len(command) > 1 else "")
+    key = key.decode("utf-8", "replace") if isinstance(key, bytes) else str(key)
+    match = model_prefix.match(key)
+    return match.group(1) if match else default
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def as_dict(self) -> dict:
+        cumulative = 0
+        counts = {}
+        for bound, count in zip(buckets + (float("inf"),), self.counts):
+            cumulative += count
+            counts[bound] = cumulative
+        return {"count": self.count, "sum": self.sum, "buckets": counts}
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = Lock()
+        # (operation, model, command): count
+        self._commands = Counter()
+        # (operation, round trip): Histogram, where a round trip is a command's name,
+        # PIPELINE or MULTI.
+        self._latencies = defaultdict(Histogram)
+
+    def record(self, commands: list, elapsed: float, kind: str = None, model: str = "-"):
+        current = operation.get() or "-"
+        if kind is None:
+            kind = command_name(commands[0]) if len(commands) == 1 else "PIPELINE"
+        with self._lock:
+            for command in commands:
+                self._commands[(current, command_model(command, model), command_name(command))] += 1
+            self._latencies[(current, kind)].observe(elapsed)
+
+    @contextmanager
+    def timed(self, commands: list, kind: str = None, model: str = "-"):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(commands, time.perf_counter() - start, kind, model)
+
+    def snapshot(self) -> dict:
+        # {"commands": {operation: {model: {command: count}}},
+        #  "round_trips": {operation: {round trip: {"count", "sum", "buckets"}}}}
+        commands = defaultdict(lambda: defaultdict(dict))
+        round_trips = defaultdict(dict)
+        with self._lock:
+            for (current, model, name), count in sorted(self._commands.items()):
+                commands[current][model][name] = count
+            for (current, kind), histogram in sorted(self._latencies.items()):
+                round_trips[current][kind] = histogram.as_dict()
+        return {
+            "commands": {current: dict(models) for current, models in commands.items()},
+            "round_trips": dict(round_trips)
+        }
+
+    def export(self, sink):
+        # A sink is any callable taking a snapshot.
+        return sink(self.snapshot())
+
+    def reset(self):
+        with self._lock:
+            self._commands.clear()
+            self._latencies.clear()
+
+
+recorder = None
+
+
+def enable() -> Recorder:
+    global recorder
+    if recorder is None:
+        recorder = Recorder()
+    return recorder
+
+
+def disable():
+    global recorder
+    recorder = None
+
+
+def timed(commands: list, kind: str = None, model: str = "-"):
+    # Wraps sending commands to the database; does nothing while disabled.
+    if recorder is None:
+        return nullcontext()
+    return recorder.timed(commands, kind, model)
+
+
+def _named(name: str, func):
+    if asyncio.iscoroutinefunction(func):
+        @wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            if operation.get() is not None:
+                return await func(*args, **kwargs)
+            token = operation.set(name)
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                operation.reset(token)
+        return async_wrapper
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if operation.get() is not None:
+            return func(*args, **kwargs)
+        token = operation.set(name)
+        try:
+            result = func(*args, **kwargs)
+        finally:
+            operation.reset(token)
+        if hasattr(result, "__next__"):
+            return iterate_in_context(operation, name, result)
+        return result
+    return wrapper
+
+
+def operations(cls):
+    # Class decorator: commands sent by the class's public methods, and anything they
+    # call, are attributed to "{class}.{method}".
+    for name, attribute in list(vars(cls).items()):
+        if name.startswith("_"):
+            continue
+        if isinstance(attribute, staticmethod):
+            setattr(cls, name, staticmethod(_named(f"{cls.__name__}.{name}", attribute.__func__)))
+        elif callable(attribute):
+            setattr(cls, name, _named(f"{cls.__name__}.{name}", attribute))
+    return cls
+
+
+def _percentile(histogram: dict, p: float) -> float:
+    # The upper bound of the bucket holding the p-th percentile.
+    target = histogram["count"] * p / 100
+    for bound, cumulative in histogram["buckets"].items():
+        if cumulative >= target:
+            return bound
+    return float("inf")
+
+
+def summary(snapshot: dict) -> str:
+    lines = []
+    for current, kinds in snapshot["round_trips"].items():
+        count = sum(histogram["count"] for histogram in kinds.values())
+        seconds = sum(histogram["sum"] for histogram in kinds.values())
+        lines.append(f"{current}: {count} round trips in {seconds * 1000:.3f} ms")
+        for kind, histogram in kinds.items():
+            lines.append(
+                f"  {kind}: {histogram['count']} round trips, "
+                f"p50 <= {_percentile(histogram, 50) * 1000:g} ms, p99 <= {_percentile(histogram, 99) * 1000:g} ms"
+            )
+        for model, commands in snapshot["commands"].get(current, {}).items():
+            counts = ", ".join(f"{name} {count}" for name, count in commands.items())
+            lines.append(f"  {model}: {counts}")
+    return "\n".join(lines)
+
+
+def dict_sink(snapshot: dict) -> dict:
+    return snapshot
+
+
+def log_sink(snapshot: dict):
+    for line in summary(snapshot).splitlines():
+        log.info(line)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels) -> str:
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+def prometheus_sink(snapshot: dict) -> str:
+    # The Prometheus text exposition format.
+    lines = [
+        "# HELP crud_commands_total Commands sent to the database.",
+        "# TYPE crud_commands_total counter"
+    ]
+    for current, models in snapshot["commands"].items():
+        for model, commands in models.items():
+            for name, count in commands.items():
+                lines.append(f"crud_commands_total{_labels(operation=current, model=model, command=name)} {count}")
+
+    lines += [
+        "# HELP crud_round_trip_seconds Latency of each round trip to the database.",
+        "# TYPE crud_round_trip_seconds histogram"
+    ]
+    for current, kinds in snapshot["round_trips"].items():
+        for kind, histogram in kinds.items():
+            for bound, cumulative in histogram["buckets"].items():
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                labels = _labels(operation=current, round_trip=kind, le=le)
+                lines.append(f"crud_round_trip_seconds_bucket{labels} {cumulative}")
+            labels = _labels(operation=current, round_trip=kind)
+            lines.append(f"crud_round_trip_seconds_sum{labels} {histogram['sum']}")
+            lines.append(f"crud_round_trip_seconds_count{labels} {histogram['count']}")
+    return "\n".join(lines) + "\n"
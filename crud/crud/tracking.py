@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+from collections import OrderedDict
+import socket
+from threading import Event, Lock, Thread
+import time
+from uuid import uuid4
+
+from redis.exceptions import ConnectionError, ResponseError, TimeoutError
+
+from .utils import log
+
+invalidation_channel = "__redis__:invalidate"
+# Published to by ClientCache.sync, after the invalidations it waits for.
+sync_channel = "__crud__:sync"
+
+
+def command_key(command: tuple) -> str:
+    # Commands are either ("SET key", value) or ("SADD", key, member, ...).
+    words = command[0].split(" ")
+    key = words[1] if len(words) > 1 else command[1]
+    return key.decode("utf-8") if isinstance(key, bytes) else str(key)
+
+
+class ClientCache:
+    # Values of string keys, read through a dedicated connection which the server tracks.
+    # After any client writes a key the server pushes an invalidation for it to a second,
+    # subscribed connection, and the key is read again on next use.
+    # Servers without CLIENT TRACKING are followed with keyspace notifications instead.
+    # While the listener is disconnected invalidations may be missed, so nothing is
+    # cached until it has reconnected.
+    def __init__(self, pool, size: int = 10000):
+        self.size = size
+        self.mode = None
+        self.hits = 0
+        self.misses = 0
+        self._pool = pool
+        self._values = OrderedDict()
+        # Keys being read; set to False if invalidated before the read returns.
+        self._pending = {}
+        # Whether the listener is subscribed, and so whether values read may be cached.
+        self._live = False
+        self._stopped = False
+        # Tokens published by sync, and the events set when they arrive.
+        self._syncs = {}
+        self._lock = Lock()
+        self._reader = pool.make_connection()
+        self._reader.register_connect_callback(self._on_reader_connect)
+        self._reader_lock = Lock()
+        self._listener = pool.make_connection()
+        # The listener waits for messages for as long as it takes.
+        self._listener.socket_timeout = None
+        self._listener_id = None
+        self._thread = None
+
+    def _command(self, connection, *args):
+        connection.send_command(*args)
+        return connection.read_response()
+
+    def _on_reader_connect(self, connection):
+        # A reconnected reader is no longer tracked, and is tracked again here.
+        if self.mode != "tracking" or self._listener_id is None:
+            return
+        try:
+            self._command(connection, "CLIENT", "TRACKING", "ON", "REDIRECT", self._listener_id)
+        except ResponseError:
+            # The listener has gone too, and tracks the reader again once it is back.
+            self._lost()
+
+    def _subscribe(self):
+        # Connects the listener, and the reader with its invalidations sent to the listener.
+        self._listener.disconnect()
+        self._listener_id = self._command(self._listener, "CLIENT", "ID")
+        with self._reader_lock:
+            self._reader.disconnect()
+            if self.mode is None:
+                try:
+                    self._command(self._reader, "CLIENT", "TRACKING", "ON", "REDIRECT", self._listener_id)
+                    self.mode = "tracking"
+                except (ResponseError, ConnectionError):
+                    # Some servers drop the connection after an unknown command.
+                    self._reader.disconnect()
+                    self.mode = "notifications"
+            else:
+                self._reader.connect()
+            if self.mode == "notifications":
+                self._command(self._reader, "CONFIG", "SET", "notify-keyspace-events", "KA")
+
+        if self.mode == "tracking":
+            self._listener.send_command("SUBSCRIBE", invalidation_channel, sync_channel)
+        else:
+            db = self._pool.connection_kwargs.get("db", 0)
+            self._listener.send_command("PSUBSCRIBE", f"__keyspace@{db}__:*")
+            self._listener.send_command("SUBSCRIBE", sync_channel)
+        for _ in range(2):
+            self._listener.read_response()
+
+        # Invalidations sent while the listener was away were missed.
+        with self._lock:
+            self._clear()
+            self._live = True
+
+    def start(self):
+        self._subscribe()
+        self._thread = Thread(target=self._listen, daemon=True)
+        self._thread.start()
+        log.debug(f"Client-side caching enabled. mode={self.mode}")
+
+    def stop(self):
+        self._stopped = True
+        if self._thread is not None and self._thread.is_alive():
+            self._interrupt()
+        else:
+            self._listener.disconnect()
+        with self._reader_lock:
+            self._reader.disconnect()
+        self.clear()
+
+    def _interrupt(self):
+        # Wakes the listener thread, which reconnects or stops. Connections are not thread
+        # safe, so only that thread disconnects the listener.
+        sock = self._listener._sock
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def _lost(self):
+        # Stops caching until the listener has subscribed again.
+        with self._lock:
+            self._live = False
+            self._clear()
+        self._interrupt()
+
+    def _listen(self):
+        connected = True
+        delay = 0.1
+        while not self._stopped:
+            if not connected:
+                try:
+                    self._subscribe()
+                except (ConnectionError, TimeoutError, OSError, ResponseError) as e:
+                    log.debug(f"Client-side cache listener disconnected, retrying. error={e}")
+                    time.sleep(delay)
+                    delay = min(delay * 2, 5)
+                    continue
+                connected = True
+                delay = 0.1
+                log.debug(f"Client-side cache listener reconnected. mode={self.mode}")
+                continue
+            try:
+                message = self._listener.read_response()
+            except (ConnectionError, TimeoutError, OSError, ValueError, AttributeError):
+                # AttributeError is raised reading a connection disconnected by another thread.
+                with self._lock:
+                    self._live = False
+                    self._clear()
+                connected = False
+                continue
+            self.handle(message)
+        # Stopped, possibly while reconnecting.
+        self._listener.disconnect()
+
+    def sync(self, timeout: float = 5) -> bool:
+        # Waits until the invalidations of every write made before the call have been
+        # applied. Returns False if they were not within timeout seconds.
+        token = uuid4().hex
+        arrived = Event()
+        with self._lock:
+            self._syncs[token] = arrived
+        try:
+            with self._reader_lock:
+                self._command(self._reader, "PUBLISH", sync_channel, token)
+            return arrived.wait(timeout)
+        finally:
+            with self._lock:
+                self._syncs.pop(token, None)
+
+    def handle(self, message: list):
+        # ["message", "__redis__:invalidate", [key, ...]], where no keys means every key,
+        # or ["pmessage", pattern, "__keyspace@{db}__:{key}", event].
+        if message[0] == b"message":
+            if message[1] == sync_channel.encode("utf-8"):
+                with self._lock:
+                    arrived = self._syncs.get(message[2].decode("utf-8"))
+                if arrived is not None:
+                    arrived.set()
+            elif message[2] is None:
+                self.clear()
+            else:
+                for key in message[2]:
+                    self.invalidate(key.decode("utf-8"))
+        elif message[0] == b"pmessage":
+            self.invalidate(message[2].split(b":", 1)[1].decode("utf-8"))
+
+    def invalidate(self, key: str):
+        with self._lock:
+            self._values.pop(key, None)
+            if key in self._pending:
+                self._pending[key] = False
+
+    def invalidate_commands(self, commands: list):
+        for command in commands:
+            self.invalidate(command_key(command))
+
+    def invalidate_matching(self, predicate):
+        with self._lock:
+            for key in [key for key in self._values if predicate(key)]:
+                del self._values[key]
+            for key in self._pending:
+                if predicate(key):
+                    self._pending[key] = False
+
+    def clear(self):
+        with self._lock:
+            self._clear()
+
+    def _clear(self):
+        self._values.clear()
+        for key in self._pending:
+            self._pending[key] = False
+
+    def get_many(self, keys: list) -> list:
+        values = {}
+        misses = []
+        with self._lock:
+            for key in keys:
+                if key in self._values:
+                    self._values.move_to_end(key)
+                    values[key] = self._values[key]
+                else:
+                    misses.append(key)
+                    if self._live:
+                        self._pending[key] = True
+        self.hits += len(keys) - len(misses)
+        self.misses += len(misses)
+
+        if len(misses) > 0:
+            try:
+                with self._reader_lock:
+                    results = self._command(self._reader, "MGET", *misses)
+            except Exception as e:
+                with self._lock:
+                    for key in misses:
+                        self._pending.pop(key, None)
+                if isinstance(e, (ConnectionError, TimeoutError)):
+                    # The reader reconnects untracked, so it is tracked again once the
+                    # listener has reconnected too.
+                    self._lost()
+                raise
+
+            with self._lock:
+                for key, value in zip(misses, results):
+                    values[key] = value
+                    if self._pending.pop(key, False):
+                        self._values[key] = value
+                while len(self._values) > self.size:
+                    self._values.popitem(last=False)
+        return [values[key] for key in keys]
+
+    def get(self, key: str):
+        return self.get_many([key])[0]
@@ -25,6 +25,20 @@ def set_current_time():
     current_time = datetime.utcnow()
 
 
+def iterate_in_context(var, value, iterator):
+    # Yields from iterator with the context variable set while each item is produced,
+    # so that lazily evaluated results see the same context as the call which made them.
+    while True:
+        token = var.set(value)
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            var.reset(token)
+        yield item
+
+
 class IDs:
     @staticmethod
     def generate_id():
@@ -1,8 +1,8 @@
 # -*- coding: utf-8 -*-
 from dataclasses import dataclass, fields
 from enum import EnumMeta
+import threading
 
-from cerberus import schema_registry
 from cerberus import Validator as CValidator
 
 from .errors import CoercionException, ValidationException
@@ -15,6 +15,11 @@ type_table = {
 }
 reverse_type_table = {v: k for k, v in type_table.items()}
 
+compiled_schemas = {}
+# Cerberus keeps the document being validated and its errors on the validator, so
+# each thread has its own validator per model class.
+compiled_validators = threading.local()
+
 
 class Validator(CValidator):
     rounding_places = 2
@@ -30,7 +35,9 @@ class Validator(CValidator):
             return t.__name__
 
     @staticmethod
-    def _translate_field_rules(rules: dict):
+    def _translate_field_rules(rules: dict) -> dict:
+        # Works on a copy, leaving the model's _validation_schema untouched.
+        rules = dict(rules)
         coerce_to_int = False
         for k, rule_constraints in rules.items():
             if isinstance(rule_constraints, EnumMeta):
@@ -40,50 +47,57 @@ class Validator(CValidator):
                 ]
         if coerce_to_int:
             rules["coerce"] = int
+        return rules
 
     @staticmethod
-    def _add_coercion(rules: dict, field):
+    def _add_coercion(rules: dict, field) -> dict:
+        rules = dict(rules)
         try:
             rules["coerce"] = field.type
         except KeyError:
             raise CoercionException(f"Couldn't find type {field.type}")
+        return rules
 
-    def _translate_schema(self, model: type):
-        if len(model.__mro__) == 1:
-            return
-
+    @classmethod
+    def _translate_schema(cls, model: type) -> dict:
+        # Inherited fields are included by fields(), and _validation_schema
+        # resolves through the MRO like any other class attribute.
+        schema = {}
         for field in fields(model):
             rules = model._validation_schema.get(field.name, {})
             field_schema = {
-                "type": self._translate_type(field.type),
+                "type": cls._translate_type(field.type),
             }
 
             if len(rules) > 0 or field.type == list:
-                self._translate_field_rules(rules)
+                rules = cls._translate_field_rules(rules)
             else:
-                self._add_coercion(rules, field)
+                rules = cls._add_coercion(rules, field)
 
             field_schema.update(**rules)
+            schema[field.name] = field_schema
+        return schema
 
-            self._base_schema[field.name] = field_schema
-
-        self._translate_schema(model.__mro__[1])
-
-    def __init__(self, model: dataclass = None, *args, **kwargs):
-        if model is not None:
-            self._base_schema = {}
-            self._model = model
-            if schema_registry.get(type(model)) is None:
-                self._translate_schema(type(model))
-        super().__init__(*args, **kwargs)
-
-    def validate(self):
-        if not super().validate(
-            self._model.__dict__,
-            schema=self._base_schema
-        ):
+    @classmethod
+    def for_model(cls, model: type):
+        # One validator per model class and thread. Cerberus checks its schema once, on creation.
+        validators = compiled_validators.__dict__.setdefault("validators", {})
+        try:
+            return validators[model]
+        except KeyError:
+            if model not in compiled_schemas:
+                compiled_schemas[model] = cls._translate_schema(model)
+            validator = cls(compiled_schemas[model])
+            validators[model] = validator
+            return validator
+
+    def validate_model(self, model: dataclass):
+        document = {
+            f.name: model.__dict__[f.name] for f in fields(model) if f.name in model.__dict__
+        }
+        if not self.validate(document):
             raise ValidationException(
                 f"Failed to validate fields in model creation. "
                 f"{self.errors} "
                 f"{self._errors}"
-            )
\ No newline at end of file
+            )
@@ -1,135 +1,228 @@
-import operator
+from datetime import datetime
+from functools import lru_cache
+from itertools import islice
 import re
 
-from .errors import FilterException, MissingResultException
-from .models import Sport, Event, Selection, connection
+from . import indexes, query, stats
+from .database import reads_replica
+from .errors import FilterException
+from .models import Sport, Event, Selection, model_registry
 
 scan_count = 50
 
 
-def get_by_glob(model_type: str, pattern: str):
-    all_keys = connection.execute_command(
-        "KEYS", f"{model_type}:*:name"
-    )
-    if len(all_keys) == 0:
-        raise MissingResultException("Database appears to be empty.")
-    decoded = " ".join([k.decode("utf-8") for k in all_keys])
-    ids = [str(k).split(":")[1] for k in all_keys]
-    names = [
-        name.decode("utf-8") for name in
-        connection.execute_command(f"MGET {decoded}")
-    ]
-
-    for id, name in zip(ids, names):
-        r = re.compile(pattern)
-        regex_result = r.match(name)
-        if regex_result:
-            yield int(id)
-
-
+@stats.operations
 class Filter:
-    comparisons = {
-        "<<": operator.lt,
-        "<=": operator.le,
-        ">>": operator.gt,
-        ">=": operator.ge,
-        "==": operator.eq
-    }
+    comparisons = query.comparisons
+    operations = ("regex", "events", "selections",)
+
+    # regex:^Sport 1, events:<<3, price:>=1.5
+    operation_term = re.compile(r"^(\w+):(.*)$", re.DOTALL)
+    # price>=1.5, status==1, scheduled_start<<2030-01-01T00:00:00
+    comparison_term = re.compile(r"^(\w+)(<<|<=|>>|>=|==)(.+)$", re.DOTALL)
 
     def __init__(self, model_type, filter_string):
+        # filter_string may also be a predicate already returned by compile_filter.
         self._model_type = model_type
+        self._model = model_registry[model_type]
         self._filter_string = filter_string
-        self._filters = []
-        self._results = self._regex(".*")
-
-    def _regex(self, pattern):
-        for model_id in get_by_glob(self._model_type, pattern):
-            if self._model_type == "sport":
-                yield SportView.get_sport(model_id)
-            elif self._model_type == "event":
-                yield EventView.get_event(model_id)
-            elif self._model_type == "selection":
-                yield SelectionView.get_selection(model_id)
+        self._results = []
 
-    def regex(self, pattern):
-        r = re.compile(pattern)
-        self._results = [
-            model for model in self._results
-            if r.match(model.name) is not None
-        ]
+    def _load(self, model_ids):
+        if self._model_type == "sport":
+            return SportView.get_sports(model_ids)
+        elif self._model_type == "event":
+            return EventView.get_events(model_ids)
+        elif self._model_type == "selection":
+            return SelectionView.get_selections(model_ids)
 
-    def _model_attribute(self, param, attribute: str):
+    def _comparison(self, param):
         op = param[:2]
-        operand = float(param[2:])
+        if op not in self.comparisons:
+            raise FilterException(f"Unsupported comparison: {param}")
+        return op, param[2:]
+
+    def _operand(self, attribute: str, operand: str) -> float:
+        # Operands are compared with stored values, so datetimes become timestamps.
+        try:
+            return float(operand)
+        except ValueError:
+            pass
+        try:
+            return float(self._model._to_storage(attribute, datetime.fromisoformat(operand)))
+        except (TypeError, ValueError):
+            raise FilterException(f"Unsupported operand for {attribute}: {operand}")
 
-        operator_func = self.comparisons[op]
+    def regex(self, pattern):
+        return query.NameMatch(pattern)
 
-        self._results = [
-            model for model in self._results if
-            operator_func(len(getattr(model, attribute)), operand)
-        ]
+    def _model_attribute(self, param, attribute: str):
+        if attribute not in self._model._relations():
+            raise AttributeError(
+                f"'{self._model.__name__}' object has no attribute '{attribute}'"
+            )
+        op, operand = self._comparison(param)
+        return query.RelationLength(attribute, op, float(operand))
+
+    def _scalar_attribute(self, param, attribute: str):
+        op, operand = self._comparison(param)
+        operand = self._operand(attribute, operand)
+        if attribute in self._model._indexes:
+            return query.IndexedComparison(attribute, op, operand)
+        return query.AttributeComparison(attribute, op, operand)
 
     def events(self, param):
-        self._model_attribute(param, "events")
+        return self._model_attribute(param, "events")
 
     def selections(self, param):
-        self._model_attribute(param, "selections")
-
+        return self._model_attribute(param, "selections")
+
+    def _is_scalar(self, attribute: str) -> bool:
+        # Only numbers, booleans and datetimes are stored as numbers, and so can be compared.
+        return attribute in (
+            f.name for f in self._model._stored_fields()
+            if f.type in (int, float, bool, datetime)
+        )
+
+    def _predicate(self, filter_operation, filter_operand):
+        if filter_operation in self.operations:
+            filter_func = getattr(self, filter_operation)
+            return filter_func(filter_operand)
+        if self._is_scalar(filter_operation):
+            return self._scalar_attribute(filter_operand, filter_operation)
+        if filter_operation in self._model._stored_names():
+            raise FilterException(f"Unsupported comparison: {filter_operation} is not a number or datetime")
+        raise FilterException(
+            f"Specified filter not found: {filter_operation}"
+        )
+
+    def _term(self, term: str):
+        match = self.operation_term.match(term)
+        if match is not None:
+            return self._predicate(*match.groups())
+
+        match = self.comparison_term.match(term)
+        if match is not None:
+            attribute, op, operand = match.groups()
+            return self._predicate(attribute, op + operand)
+        raise FilterException(f"Could not parse filter: {term}")
+
+    def compile(self) -> query.Predicate:
+        return query.Parser(self._filter_string, self._term).parse()
+
+    def _expression(self) -> query.Predicate:
+        if isinstance(self._filter_string, query.Predicate):
+            return self._filter_string
+        return compile_filter(self._model_type, self._filter_string)
+
+    @reads_replica
     def filter(self):
-        filter_strings = self._filter_string.split(" AND ")
+        expression = self._expression()
+        self._results = self._load(query.execute(expression, self._model))
+        return self._results
 
-        for filter_string in filter_strings:
-            self._filters.append(filter_string.split(":"))
+    def _matching_ids(self, expression: query.Predicate):
+        for model_ids in indexes.scan_ids(self._model, scan_count):
+            yield from expression.select(self._model, model_ids, {})
 
-        self._results = list(self._regex(".*"))
+    @reads_replica
+    def stream(self, limit: int = None, offset: int = 0):
+        # Walks the id index in batches of scan_count and evaluates the filter
+        # against each batch, so memory use stays flat. Offset and limit are applied
+        # to the matching ids, so only the models returned are loaded.
+        ids = islice(
+            self._matching_ids(self._expression()), offset, None if limit is None else offset + limit
+        )
+        return (
+            model
+            for model_ids in iter(lambda: list(islice(ids, scan_count)), [])
+            for model in self._load(model_ids)
+        )
 
-        for filter_operation, filter_operand in self._filters:
-            try:
-                filter_func = getattr(self, filter_operation)
-            except AttributeError:
-                raise FilterException(
-                    f"Specified filter not found: {filter_operation}"
-                )
-            filter_func(filter_operand)
 
-        return self._results
+@lru_cache(maxsize=256)
+def compile_filter(model_type: str, filter_string: str) -> query.Predicate:
+    # Compiled filters hold no query state, so one can serve any number of queries.
+    return Filter(model_type, filter_string).compile()
 
 
+@stats.operations
 class SportView:
     @staticmethod
+    @reads_replica
     def get_sport(sport_id: int):
         return Sport.new(id=sport_id)
 
     @staticmethod
+    @reads_replica
+    def get_sports(sport_ids: list):
+        return Sport.load_many(sport_ids)
+
+    @staticmethod
+    @reads_replica
     def get_sport_filtered(filter_string: str):
         filter = Filter("sport", filter_string)
         results = filter.filter()
         return results
 
+    @staticmethod
+    @reads_replica
+    def stream_sport_filtered(filter_string: str, limit: int = None, offset: int = 0):
+        filter = Filter("sport", filter_string)
+        return filter.stream(limit, offset)
 
+
+@stats.operations
 class EventView:
     @staticmethod
+    @reads_replica
     def get_event(event_id: int):
         return Event.new(id=event_id)
 
     @staticmethod
+    @reads_replica
+    def get_events(event_ids: list):
+        return Event.load_many(event_ids)
+
+    @staticmethod
+    @reads_replica
     def get_events_filtered(filter_string: str):
         filter = Filter("event", filter_string)
         results = filter.filter()
         return results
 
+    @staticmethod
+    @reads_replica
+    def stream_events_filtered(filter_string: str, limit: int = None, offset: int = 0):
+        filter = Filter("event", filter_string)
+        return filter.stream(limit, offset)
 
+
+@stats.operations
 class SelectionView:
     @staticmethod
+    @reads_replica
     def get_selection(selection_id: int):
         return Selection.new(id=selection_id)
 
     @staticmethod
+    @reads_replica
+    def get_selections(selection_ids: list):
+        return Selection.load_many(selection_ids)
+
+    @staticmethod
+    @reads_replica
     def get_selections_filtered(filter_string: str):
         filter = Filter("selection", filter_string)
         results = filter.filter()
         return results
 
+    @staticmethod
+    @reads_replica
+    def stream_selections_filtered(filter_string: str, limit: int = None, offset: int = 0):
+        filter = Filter("selection", filter_string)
+        return filter.stream(limit, offset)
+
 
 view_mapping = {
     "sport": SportView,
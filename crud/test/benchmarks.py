@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+# Benchmarks of the models' hot paths, printed as JSON:
+#   python -m test.benchmarks --sports 50 --iterations 500 > results.json
+# The configured database is flushed first, so only point it at a server holding nothing
+# of value; CRUD_URL=memory:// measures the Python side alone.
+import argparse
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import json
+import platform
+import random
+import time
+
+from crud import bulk, database, indexes, scripts
+from crud.controllers import EventController, SelectionController
+from crud.models import Event, Selection, Sport, model_registry
+from crud.views import Filter
+from test.utils import create_events, create_selections, create_sports, flush_all_dbs, link_children
+
+filters = {
+    "regex": ("selection", "regex:^Selection 1"),
+    "<<": ("selection", "price<<5"),
+    "<=": ("selection", "price<=5"),
+    "==": ("selection", "price==5"),
+    ">=": ("selection", "price>=5"),
+    ">>": ("selection", "price>>5"),
+    "count": ("sport", "events<<2"),
+    "compound": ("event", "(status==1 OR status==2) AND NOT selections==0")
+}
+
+
+class RoundTrips:
+    # Requests sent to the server; a pipeline or transaction is a single round trip.
+    count = 0
+
+    @classmethod
+    @contextmanager
+    def counted(cls, pools: list):
+        classes = [pool.connection_class for pool in pools]
+        for pool, connection_class in zip(pools, classes):
+            class CountingConnection(connection_class):
+                def send_packed_command(self, command, check_health=True):
+                    cls.count += 1
+                    super().send_packed_command(command, check_health)
+
+            # Pooled connections are dropped, so that new ones of the new class are made.
+            pool.disconnect()
+            pool.reset()
+            pool.connection_class = CountingConnection
+        try:
+            yield
+        finally:
+            for pool, connection_class in zip(pools, classes):
+                pool.disconnect()
+                pool.reset()
+                pool.connection_class = connection_class
+
+
+def percentile(ordered: list, p: float) -> float:
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+def measure(operation, iterations: int, prepare=None, warmup: int = 5) -> dict:
+    # prepare(i) returns the arguments for the i-th call and is not timed.
+    latencies = []
+    round_trips = 0
+    for i in range(-warmup, iterations):
+        args = prepare(i) if prepare is not None else ()
+        before = RoundTrips.count
+        start = time.perf_counter()
+        operation(*args)
+        elapsed = time.perf_counter() - start
+        if i >= 0:
+            latencies.append(elapsed)
+            round_trips += RoundTrips.count - before
+
+    latencies.sort()
+    return {
+        "iterations": iterations,
+        "ops_per_sec": iterations / sum(latencies),
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "round_trips_per_op": round_trips / iterations
+    }
+
+
+def generate(n_sports: int, n_events: int, n_selections: int):
+    # The test generators give the first sports two events each and the first events a
+    # selection each, so the last have none when there are fewer than that. Every sport
+    # is active, as are three events in four and two selections in three, so some sports
+    # have a single active event, which takes its sport with it when deactivated.
+    flush_all_dbs()
+    sports = list(create_sports(n_sports))
+    events = list(create_events(sports, n_events))
+    selections = list(create_selections(events, n_selections))
+    for sport in sports:
+        sport.activate()
+    link_children(sports, events, "events", "sport", active=lambda i: i % 4 != 3)
+    link_children(events, selections, "selections", "event", active=lambda i: i % 3 != 2)
+    return sports, events, selections
+
+
+def count_matches() -> dict:
+    # Filters which match none or all of their models measure nothing of interest.
+    matches = {}
+    for name, (model_type, filter_string) in filters.items():
+        matched = len(Filter(model_type, filter_string).filter())
+        total = len(indexes.all_ids(model_registry[model_type]))
+        if matched == 0 or matched == total:
+            raise ValueError(f"The {name} filter matches {matched} of {total} {model_type}s; generate more models.")
+        matches[name] = matched
+    return matches
+
+
+def run(n_sports: int = 20, n_events: int = 30, n_selections: int = 14, iterations: int = 200) -> dict:
+    provider = database.provider()
+    pools = [provider.pool] + [replica.connection_pool for replica in provider.replicas]
+    with RoundTrips.counted(pools):
+        results = run_benchmarks(n_sports, n_events, n_selections, iterations)
+    return {
+        "settings": {
+            "url": provider.settings.url,
+            "sports": n_sports,
+            "events": n_events,
+            "selections": n_selections,
+            "iterations": iterations,
+            "python": platform.python_version()
+        },
+        "results": results
+    }
+
+
+def run_benchmarks(n_sports: int, n_events: int, n_selections: int, iterations: int) -> dict:
+    scripts.load(Sport._exec)
+    sports, events, selections = generate(n_sports, n_events, n_selections)
+    # The models as generated, to write back after each cascade.
+    records = {(record["model"], record["id"]): record for record in bulk.export_records()}
+    matches = count_matches()
+    start = datetime.utcnow() + timedelta(days=1)
+
+    def renamed(i):
+        event = Event.load(random.choice(events).id)
+        event.name = f"Event {i} renamed"
+        return (event,)
+
+    def restored(*keys):
+        # Writes the models back as they were generated, to undo the previous cascade.
+        bulk.import_records([records[key] for key in keys], trusted=True)
+
+    def event_to_deactivate(i):
+        event = events[i % len(events)]
+        restored(
+            ("sport", event.sport), ("event", event.id),
+            *(("selection", id) for id in event.selections)
+        )
+        return (event.id,)
+
+    def selection_to_deactivate(i):
+        selection = selections[i % len(selections)]
+        restored(("event", selection.event), ("selection", selection.id))
+        return (selection.id,)
+
+    # Filters are measured before the benchmarks which write new models.
+    results = {
+        "load": {
+            model.__name__.lower(): measure(lambda: model.load(random.choice(instances).id), iterations)
+            for model, instances in ((Sport, sports), (Event, events), (Selection, selections))
+        },
+        "filter": {
+            name: {**measure(lambda: Filter(model_type, filter_string).filter(), iterations),
+                   "matches": matches[name]}
+            for name, (model_type, filter_string) in filters.items()
+        },
+        "put_model": measure(lambda event: event.put_model(), iterations, prepare=renamed),
+        "new": {
+            "sport": measure(lambda: Sport.new(name="Benchmark sport"), iterations),
+            "event": measure(lambda: Event.new(
+                name="Benchmark event", scheduled_start=start, sport=random.choice(sports).id,
+                type=Event.Types.PREPLAY.value, status=Event.Statuses.PENDING.value
+            ), iterations),
+            "selection": measure(lambda: Selection.new(
+                name="Benchmark selection", event=random.choice(events).id, price=1.0,
+                outcome=Selection.Outcomes.UNSETTLED.value
+            ), iterations)
+        },
+        "cascade": {
+            "deactivate_event": measure(
+                EventController.deactivate_event, iterations, prepare=event_to_deactivate
+            ),
+            "deactivate_selection": measure(
+                SelectionController.deactivate_selection, iterations, prepare=selection_to_deactivate
+            )
+        }
+    }
+    flush_all_dbs()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks the models against the configured database.")
+    parser.add_argument("--sports", type=int, default=20)
+    parser.add_argument("--events", type=int, default=None, help="at most twice --sports; defaults to 1.5 times")
+    parser.add_argument("--selections", type=int, default=None, help="at most --events; defaults to half of them")
+    parser.add_argument("--iterations", type=int, default=200, help="timed calls per operation")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="write the results to this file instead of stdout")
+    args = parser.parse_args()
+
+    # The generators create models in pairs.
+    n_events = 3 * args.sports // 4 * 2 if args.events is None else args.events
+    n_selections = n_events // 4 * 2 if args.selections is None else args.selections
+    if n_events > 2 * args.sports or n_selections > n_events:
+        parser.error("the generators need a sport for every two events and an event for every selection")
+    if n_events % 2 != 0 or n_selections % 2 != 0:
+        parser.error("the generators create events and selections in pairs")
+
+    random.seed(args.seed)
+    report = json.dumps(run(args.sports, n_events, n_selections, args.iterations), indent=2)
+    if args.output is None:
+        print(report)
+    else:
+        with open(args.output, "w") as f:
+            f.write(report + "\n")
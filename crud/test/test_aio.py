@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+import asyncio
+from datetime import datetime, timedelta
+import unittest
+from unittest.mock import patch
+
+from crud import cache, database
+from crud.aio import (
+    AsyncEventController, AsyncEventView, AsyncSelectionView, AsyncSportController, AsyncSportView,
+    get, load
+)
+from crud.errors import ForeignKeyException, MissingResultException, ValidationException
+from crud.models import Event, Selection, Sport, connection
+from crud.utils import get_current_time
+from crud.views import EventView, SelectionView, SportView
+from test.utils import flush_all_dbs, generate_test_db
+
+
+class TestAsyncAPI(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        generate_test_db()
+
+    async def asyncTearDown(self):
+        # Pooled connections belong to this test's event loop.
+        await database.provider().aclose()
+
+    def tearDown(self):
+        flush_all_dbs()
+
+    async def _create_event(self, sport_id: int):
+        return await AsyncEventController.create_event(
+            name="async event",
+            type=Event.Types.PREPLAY.value,
+            sport=sport_id,
+            status=Event.Statuses.PENDING.value,
+            scheduled_start=datetime.timestamp(get_current_time() + timedelta(hours=5))
+        )
+
+    async def test_create_and_load(self):
+        sport = await AsyncSportController.create_sport("async sport", active=True)
+
+        # Written exactly as the synchronous API would have written it.
+        self.assertEqual(SportView.get_sport(sport.id).name, "async sport")
+        self.assertEqual(await get(Sport, sport.id, "active"), True)
+
+        loaded = await AsyncSportView.get_sport(sport.id)
+        self.assertEqual(loaded.slug, "async-sport")
+        self.assertEqual(loaded.active, True)
+
+        with self.assertRaises(MissingResultException):
+            await AsyncSportView.get_sport(123123)
+
+    async def test_concurrent_loads(self):
+        sports = [await AsyncSportController.create_sport(f"async sport {i}") for i in range(5)]
+        loaded = await asyncio.gather(*(AsyncSportView.get_sport(sport.id) for sport in sports))
+        self.assertEqual([sport.name for sport in loaded], [sport.name for sport in sports])
+
+        filtered = await AsyncSportView.get_sport_filtered("regex:^async sport")
+        self.assertEqual(len(filtered), 5)
+
+    async def test_validation_and_foreign_keys(self):
+        events = len(connection.execute_command("KEYS", "event:*:name"))
+        with self.assertRaises(ForeignKeyException):
+            await self._create_event(123123)
+        # Nothing is written when the foreign key check fails.
+        self.assertEqual(len(connection.execute_command("KEYS", "event:*:name")), events)
+
+        sport = await AsyncSportController.create_sport("async sport")
+        with self.assertRaises(ValidationException):
+            await AsyncEventController.create_event(
+                name="invalid event", type=123, sport=sport.id,
+                status=Event.Statuses.PENDING.value,
+                scheduled_start=datetime.timestamp(get_current_time() + timedelta(hours=5))
+            )
+
+    async def test_update_and_deactivate(self):
+        sport = await AsyncSportController.create_sport("async sport", active=True)
+        event = await self._create_event(sport.id)
+        await AsyncEventController.update_event(event.id, active=True)
+        await AsyncSportController.update_sport_events(sport.id, [event.id])
+
+        updated = await AsyncEventController.update_event(
+            event.id, status=Event.Statuses.STARTED.value
+        )
+        self.assertEqual(updated.status, Event.Statuses.STARTED.value)
+        self.assertEqual((await AsyncEventView.get_event(event.id)).status, Event.Statuses.STARTED.value)
+
+        deactivated = await AsyncEventController.deactivate_event(event.id)
+        self.assertEqual(deactivated.active, False)
+        self.assertEqual((await AsyncSportView.get_sport(sport.id)).active, False)
+
+    async def test_filters_read_asynchronously(self):
+        filters = [
+            (SportView.get_sport_filtered, AsyncSportView.get_sport_filtered,
+             "(regex:^Sport 1+ OR regex:^Sport 2$) AND NOT regex:^(Sport 10)$"),
+            (EventView.get_events_filtered, AsyncEventView.get_events_filtered, "status==1 OR status==2"),
+            (SelectionView.get_selections_filtered, AsyncSelectionView.get_selections_filtered,
+             "price>=2.0 AND price<<4 AND active==1")
+        ]
+        expected = [sorted(s.id for s in sync_filtered(f)) for sync_filtered, _, f in filters]
+
+        # Nothing is read through the synchronous clients.
+        sync_reads = [
+            patch.object(model, method, side_effect=AssertionError("read synchronously"))
+            for model in (Sport, Event, Selection) for method in ("_exec", "_exec_pipeline")
+        ]
+        for sync_read in sync_reads:
+            sync_read.start()
+        try:
+            for (_, async_filtered, f), ids in zip(filters, expected):
+                self.assertEqual(sorted(s.id for s in await async_filtered(f)), ids, f)
+        finally:
+            for sync_read in sync_reads:
+                sync_read.stop()
+
+    async def test_reads_are_cached(self):
+        sport = await AsyncSportController.create_sport("async sport")
+        cache.configure(size=100)
+        client_cache = database.enable_client_cache(size=100)
+        try:
+            await load(Sport, sport.id)
+            self.assertTrue(client_cache.sync())
+            self.assertEqual(await get(Sport, sport.id, "name"), "async sport")
+            self.assertEqual(await get(Sport, sport.id, "name"), "async sport")
+            self.assertEqual(client_cache.hits, 1)
+
+            # Another client's write is not seen by load until it is invalidated.
+            connection.set(f"sport:{sport.id}:slug", "written-elsewhere")
+            self.assertEqual((await load(Sport, sport.id)).slug, "async-sport")
+        finally:
+            database.disable_client_cache()
+            cache.configure(size=0)
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+import io
+import json
+import unittest
+
+from crud import stats
+from crud.batch import Batch, parse
+from crud.models import Sport
+from test.utils import flush_all_dbs, generate_test_db
+
+
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        generate_test_db()
+        self.sport = Sport.new(name="Batch sport")
+
+    def tearDown(self):
+        stats.disable()
+        flush_all_dbs()
+
+    def run_batch(self, text: str, **kwargs) -> list:
+        out = io.StringIO()
+        Batch(out, **kwargs).run(io.StringIO(text))
+        return [json.loads(line) for line in out.getvalue().splitlines()]
+
+    def test_parse(self):
+        self.assertEqual(
+            parse("update sport 1 \"{'name': 'Darts'}\""),
+            {"op": "update", "type": "sport", "id": "1", "fields": {"name": "Darts"}}
+        )
+        self.assertEqual(parse("filter event status==1 AND NOT selections==0")["filter"],
+                         "status==1 AND NOT selections==0")
+        self.assertEqual(parse('{"op": "get", "type": "event", "id": 2}')["id"], 2)
+        with self.assertRaises(ValueError):
+            parse('{"op": "get", "type": "event"}')
+        with self.assertRaises(ValueError):
+            parse("drop sport 1")
+
+    def test_operations(self):
+        id = self.sport.id
+        lines = self.run_batch(
+            f"get sport {id}\n"
+            "# comments and blank lines are skipped\n"
+            "\n"
+            f'{{"op": "update", "type": "sport", "id": {id}, "fields": {{"name": "Renamed sport"}}}}\n'
+            f"get sport {id}\n"
+            "get sport 404\n"
+            "create sport \"{'name': 'Created sport'}\"\n"
+            '{"op": "filter", "type": "sport", "filter": "regex:^(Renamed|Created)", "limit": 1}\n'
+            f"deactivate sport {id}\n"
+        )
+        self.assertEqual([line["line"] for line in lines], [1, 4, 5, 6, 7, 8, 9])
+        self.assertEqual(lines[0]["result"]["name"], "Batch sport")
+        # Reads see the writes before them.
+        self.assertEqual(lines[2]["result"]["name"], "Renamed sport")
+        self.assertTrue(lines[3]["error"].startswith("MissingResultException"))
+        self.assertEqual(lines[4]["result"]["model"], "sport")
+        self.assertEqual(len(lines[5]["result"]), 1)
+        self.assertFalse(lines[6]["result"]["active"])
+
+    def test_gets_are_pipelined(self):
+        sports = [Sport.new(name=f"Batch sport {i}") for i in range(3)]
+        recorder = stats.enable()
+        recorder.reset()
+        lines = self.run_batch("".join(f"get sport {sport.id}\n" for sport in sports))
+        self.assertEqual([line["result"]["id"] for line in lines], [sport.id for sport in sports])
+        self.assertEqual(recorder.snapshot()["round_trips"]["SportView.get_sports"]["PIPELINE"]["count"], 1)
+
+        lines = self.run_batch("".join(f"get sport {sport.id}\n" for sport in sports), get_batch_size=1)
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(recorder.snapshot()["round_trips"]["SportView.get_sports"]["PIPELINE"]["count"], 4)
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+import io
+import unittest
+
+from crud import bulk, indexes
+from crud.errors import ForeignKeyException, ValidationException
+from crud.models import Event, Selection, Sport
+from crud.views import Filter
+from test.utils import flush_all_dbs, generate_bulk_db
+
+
+class TestImport(unittest.TestCase):
+    def setUp(self):
+        flush_all_dbs()
+
+    def tearDown(self):
+        flush_all_dbs()
+
+    def test_generated(self):
+        # Batches split parents from their children, whose references are then checked.
+        result = generate_bulk_db(n_sports=3, events_per_sport=2, selections_per_event=3, batch_size=4)
+        self.assertEqual(result, {"sport": 3, "event": 6, "selection": 18})
+
+        events = Event.load_many(indexes.all_ids(Event))
+        self.assertEqual(len(events), 6)
+        self.assertEqual(len(Filter("selection", "regex:^Selection 1.1.").filter()), 3)
+        self.assertEqual(len(Filter("selection", "price==2").filter()), 6)
+        sport = Sport.load(events[0].sport)
+        self.assertEqual(sport.slug, sport.name.lower().replace(" ", "-"))
+
+    def test_jsonl_and_csv(self):
+        lines = io.StringIO(
+            '{"model": "sport", "id": 1, "name": "Darts"}\n'
+            '\n'
+            '{"model": "event", "id": 2, "name": "Final", "sport": 1, "type": 0, "status": 1,'
+            ' "scheduled_start": "2100-01-01T12:00:00", "active": true}\n'
+        )
+        self.assertEqual(bulk.import_records(bulk.read_jsonl(lines)), {"sport": 1, "event": 1})
+        self.assertEqual(Event.load(2).scheduled_start.year, 2100)
+        self.assertEqual(Sport.active_children(1, "events"), 1)
+
+        rows = io.StringIO("name,event,price,outcome,active\nDraw,2,3.333,0,1\n")
+        self.assertEqual(bulk.import_records(bulk.read_csv(rows, "selection")), {"selection": 1})
+        selection = Filter("selection", "regex:^Draw").filter()[0]
+        self.assertEqual((selection.event, selection.price, selection.active), (2, 3.333, True))
+
+        # Importing a model again renames it in the name index.
+        bulk.import_records([{"model": "sport", "id": 1, "name": "Snooker"}])
+        self.assertEqual(indexes.names(Sport), [(1, "Snooker")])
+
+    def test_invalid_records(self):
+        with self.assertRaises(ValidationException):
+            bulk.import_records([{"model": "sport", "name": "Darts", "colour": "red"}])
+        with self.assertRaises(ValidationException):
+            bulk.import_records([{"model": "selection", "name": "Draw", "event": 1, "price": 1, "outcome": 9}])
+
+        # A missing reference fails its batch only.
+        records = [
+            {"model": "sport", "name": "Darts"},
+            {"model": "event", "name": "Final", "sport": 404, "type": 0, "status": 0,
+             "scheduled_start": "2100-01-01T12:00:00"}
+        ]
+        with self.assertRaises(ForeignKeyException):
+            bulk.import_records(records, batch_size=1)
+        self.assertEqual(len(indexes.all_ids(Sport)), 1)
+        self.assertEqual(indexes.all_ids(Event), [])
+
+    def test_trusted(self):
+        # Neither validated nor checked, e.g. an event which has already started.
+        record = {"model": "event", "id": 2, "name": "Final", "sport": 1, "type": 0, "status": 1,
+                  "scheduled_start": "2000-01-01T12:00:00", "actual_start": "2000-01-01T12:01:00"}
+        with self.assertRaises(ValidationException):
+            bulk.import_records([record])
+        bulk.import_records([record], trusted=True)
+        self.assertEqual(Event.load(2).actual_start.minute, 1)
+
+    def test_moving_between_parents(self):
+        event = {"model": "event", "id": 3, "name": "Final", "sport": 1, "type": 0, "status": 1,
+                 "scheduled_start": "2100-01-01T12:00:00", "active": True}
+        for trusted in (False, True):
+            with self.subTest(trusted=trusted):
+                flush_all_dbs()
+                bulk.import_records([
+                    {"model": "sport", "id": 1, "name": "Darts", "events": [3]},
+                    {"model": "sport", "id": 2, "name": "Snooker"},
+                    event
+                ])
+                self.assertEqual(Sport.active_children(1, "events"), 1)
+
+                # The event leaves the relation and the active events of its old sport.
+                bulk.import_records([{**event, "sport": 2}], trusted=trusted)
+                self.assertEqual(Sport.active_children(1, "events"), 0)
+                self.assertEqual(Sport.active_children(2, "events"), 1)
+                self.assertEqual(Sport.load(1).events, [])
+
+
+class TestExport(unittest.TestCase):
+    def setUp(self):
+        generate_bulk_db(n_sports=3, events_per_sport=2, selections_per_event=2)
+
+    def tearDown(self):
+        flush_all_dbs()
+
+    def test_round_trip(self):
+        sport = Sport.load(indexes.all_ids(Sport)[0])
+        sport.events = indexes.all_ids(Event)[:2]
+        sport.active = True
+        sport.put_model()
+        models = {
+            model: sorted(model.load_many(indexes.all_ids(model)), key=lambda m: m.id)
+            for model in (Sport, Event, Selection)
+        }
+
+        f = io.StringIO()
+        self.assertEqual(bulk.write_jsonl(bulk.export_records(batch_size=5), f), 21)
+        flush_all_dbs()
+        f.seek(0)
+        # Relations refer to models exported later, in later batches, so the export is
+        # imported as trusted.
+        with self.assertRaises(ForeignKeyException):
+            bulk.import_records(bulk.read_jsonl(f), batch_size=1)
+        flush_all_dbs()
+        f.seek(0)
+        imported = bulk.import_records(bulk.read_jsonl(f), trusted=True)
+        self.assertEqual(imported, {"sport": 3, "event": 6, "selection": 12})
+
+        for model, expected in models.items():
+            self.assertEqual(sorted(model.load_many(indexes.all_ids(model)), key=lambda m: m.id), expected)
+
+    def test_selected_models(self):
+        records = list(bulk.export_records(("event",), batch_size=1))
+        self.assertEqual({record["model"] for record in records}, {"event"})
+        self.assertEqual(len({record["id"] for record in records}), 6)
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+import time
+import unittest
+from unittest.mock import patch
+
+from crud import cache, database, indexes
+from crud.cache import ObjectCache, object_cache
+from crud.controllers import SportController
+from crud.models import Event, Sport, connection
+from crud.views import SportView
+from test.test_database import replica_url
+from test.utils import flush_all_dbs, generate_test_db
+
+
+class TestObjectCache(unittest.TestCase):
+    def test_lru_eviction(self):
+        lru = ObjectCache(size=2)
+        lru.set("sport", 1, {"name": b"one"})
+        lru.set("sport", 2, {"name": b"two"})
+        lru.get("sport", 1)
+        lru.set("sport", 3, {"name": b"three"})
+
+        self.assertIsNone(lru.get("sport", 2))
+        self.assertEqual(lru.get("sport", 1), {"name": b"one"})
+        self.assertEqual(len(lru), 2)
+
+    def test_ttl(self):
+        expiring = ObjectCache(size=10, ttl=0.05)
+        expiring.set("sport", 1, {"name": b"one"})
+        self.assertIsNotNone(expiring.get("sport", 1))
+        time.sleep(0.1)
+        self.assertIsNone(expiring.get("sport", 1))
+
+    def test_invalidated_while_read(self):
+        objects = ObjectCache(size=2)
+        generation = objects.generation()
+        objects.invalidate("sport", 1)
+        objects.set("sport", 1, {"name": b"stale"}, generation)
+        self.assertIsNone(objects.get("sport", 1))
+
+        # Reads started after the invalidation are cached.
+        objects.set("sport", 1, {"name": b"one"}, objects.generation())
+        self.assertEqual(objects.get("sport", 1), {"name": b"one"})
+
+        # Invalidations of other keys leave a read alone, until too many are remembered.
+        generation = objects.generation()
+        objects.invalidate("sport", 2)
+        objects.set("sport", 1, {"name": b"one"}, generation)
+        self.assertIsNotNone(objects.get("sport", 1))
+        for id in range(3, 6):
+            objects.invalidate("sport", id)
+        objects.set("sport", 6, {"name": b"six"}, generation)
+        self.assertIsNone(objects.get("sport", 6))
+
+        generation = objects.generation()
+        objects.invalidate_model("event")
+        objects.set("sport", 7, {"name": b"seven"}, generation)
+        self.assertIsNone(objects.get("sport", 7))
+
+
+class TestModelCache(unittest.TestCase):
+    def setUp(self):
+        generate_test_db()
+        cache.configure(size=100)
+
+    def tearDown(self):
+        cache.configure(size=0)
+        flush_all_dbs()
+
+    def test_load_is_cached(self):
+        sport = SportController.create_sport("cached sport")
+        SportView.get_sport(sport.id)
+
+        with patch.object(Sport, "_read_values", wraps=Sport._read_values) as read_values:
+            cached = SportView.get_sport(sport.id)
+            read_values.assert_not_called()
+        self.assertEqual(cached.name, "cached sport")
+
+        # Cached values are rebuilt into a new instance on every load.
+        cached.name = "changed locally"
+        self.assertEqual(SportView.get_sport(sport.id).name, "cached sport")
+
+    def test_own_writes_invalidate(self):
+        sport = SportController.create_sport("cached sport")
+        SportView.get_sport(sport.id)
+
+        SportController.update_sport(sport.id, name="renamed sport")
+        self.assertEqual(SportView.get_sport(sport.id).name, "renamed sport")
+
+    def test_load_racing_a_write(self):
+        sport = SportController.create_sport("cached sport")
+        read_values = Sport._read_values
+        racing = [sport.id]
+
+        def _read_then_write(ids: list) -> dict:
+            # The read returns the old name, and the write lands before it is cached.
+            values = read_values(ids)
+            if len(racing) > 0:
+                # The write reads the sport itself.
+                racing.pop()
+                SportController.update_sport(sport.id, name="renamed sport")
+            return values
+
+        with patch.object(Sport, "_read_values", side_effect=_read_then_write):
+            self.assertEqual(SportView.get_sport(sport.id).name, "cached sport")
+        self.assertIsNone(object_cache.get("sport", sport.id))
+        self.assertEqual(SportView.get_sport(sport.id).name, "renamed sport")
+
+    def test_controllers_read_the_server(self):
+        sport = SportController.create_sport("cached sport")
+        SportView.get_sport(sport.id)
+        events = indexes.all_ids(Event)[:2]
+
+        # Another process adds an event without this one hearing of it.
+        connection.sadd(f"sport:{sport.id}:events", events[0])
+        self.assertEqual(SportView.get_sport(sport.id).events, [])
+
+        # The relation is diffed against what is stored, so the event is removed.
+        SportController.update_sport_events(sport.id, [events[1]])
+        self.assertEqual(Sport.load(sport.id).events, [events[1]])
+
+    def test_replica_reads_are_not_cached(self):
+        database.configure(replica_urls=(replica_url(1),))
+        try:
+            sport = SportController.create_sport("cached sport")
+            # A second database stands in for the replica, which has an older name.
+            replica = database.provider().replicas[0]
+            replica.mset({f"sport:{sport.id}:name": "replicated sport", f"sport:{sport.id}:active": 0})
+            self.assertEqual(SportView.get_sport(sport.id).name, "replicated sport")
+            self.assertIsNone(object_cache.get("sport", sport.id))
+        finally:
+            database.configure()
+
+    def test_keyspace_notifications(self):
+        cache.configure(size=100, notifications=True)
+        sport = SportController.create_sport("cached sport")
+        SportView.get_sport(sport.id)
+
+        connection.set(f"sport:{sport.id}:name", "written elsewhere")
+        for _ in range(50):
+            if object_cache.get("sport", sport.id) is None:
+                break
+            time.sleep(0.05)
+        self.assertEqual(SportView.get_sport(sport.id).name, "written elsewhere")
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+import unittest
+from urllib.parse import urlparse
+
+from crud import database
+from crud.controllers import SportController
+from crud.database import Settings
+from crud.errors import MissingResultException
+from crud.models import Sport, connection
+from crud.views import SportView
+from test.utils import flush_all_dbs
+
+
+def replica_url(db: int) -> str:
+    # Another database on the server the tests use stands in for a replica.
+    url = urlparse(database.provider().settings.url)
+    return f"{url.scheme}://{url.netloc}/{db}"
+
+
+class TestSettings(unittest.TestCase):
+    def test_from_env(self):
+        settings = Settings.from_env({
+            "CRUD_URL": "unix:///var/run/keydb.sock",
+            "CRUD_DB": "2",
+            "CRUD_MAX_CONNECTIONS": "20",
+            "CRUD_SOCKET_TIMEOUT": "1.5",
+            "CRUD_KEEPALIVE": "true",
+            "CRUD_REPLICA_URLS": "redis://replica-1:6379/0, redis://replica-2:6379/0"
+        })
+        self.assertEqual(settings.url, "unix:///var/run/keydb.sock")
+        self.assertEqual(settings.db, 2)
+        self.assertEqual(settings.max_connections, 20)
+        self.assertEqual(settings.socket_timeout, 1.5)
+        self.assertEqual(settings.replica_urls, ("redis://replica-1:6379/0", "redis://replica-2:6379/0"))
+
+        # Unix domain sockets take no TCP options.
+        kwargs = settings.pool_kwargs(settings.url)
+        self.assertNotIn("socket_keepalive", kwargs)
+        self.assertEqual(kwargs["db"], 2)
+
+    def test_defaults(self):
+        settings = Settings.from_env({})
+        self.assertEqual(settings, Settings())
+
+
+class TestProvider(unittest.TestCase):
+    def tearDown(self):
+        database.configure()
+        flush_all_dbs()
+
+    def test_configure(self):
+        provider = database.configure(max_connections=5, socket_timeout=5)
+        self.assertEqual(provider.pool.max_connections, 5)
+        # Modules which imported the connection before configure() use the new pool.
+        self.assertIs(connection.connection_pool, provider.pool)
+
+    def test_views_read_from_replica(self):
+        # A second database on the same server stands in for a replica which has not
+        # received the write yet.
+        database.configure(replica_urls=(replica_url(1),))
+        sport = SportController.create_sport("replicated sport")
+
+        self.assertEqual(Sport.load(sport.id).name, "replicated sport")
+        with self.assertRaises(MissingResultException):
+            SportView.get_sport(sport.id)
+
+        # Controllers read what they change from the primary.
+        self.assertEqual(SportController.update_sport(sport.id, name="renamed sport").name, "renamed sport")
+
+    def test_replicas_are_used_in_turn(self):
+        provider = database.configure(
+            replica_urls=(replica_url(1), replica_url(2))
+        )
+        self.assertIs(database.reader(), connection)
+
+        token = database.replica_reads.set(True)
+        try:
+            readers = [database.reader() for _ in range(3)]
+        finally:
+            database.replica_reads.reset(token)
+        for reader, replica in zip(readers, [0, 1, 0]):
+            self.assertIs(reader, provider.replicas[replica])
+
+    def test_read_your_writes(self):
+        database.configure(replica_urls=(replica_url(1),))
+        with database.session():
+            with self.assertRaises(MissingResultException):
+                SportView.get_sport(123123)
+            sport = SportController.create_sport("replicated sport")
+            # Reads after the write in this session go to the primary.
+            self.assertEqual(SportView.get_sport(sport.id).name, "replicated sport")
+
+        with database.session(window=0):
+            SportController.update_sport(sport.id, name="renamed sport")
+            # The window has passed, so the replica is read again.
+            with self.assertRaises(MissingResultException):
+                SportView.get_sport(sport.id)
+
+
+class TestAsyncProvider(unittest.IsolatedAsyncioTestCase):
+    async def asyncTearDown(self):
+        await database.async_configure()
+
+    async def test_async_configure_disconnects_async_pools(self):
+        provider = await database.async_configure(replica_urls=(replica_url(1),))
+        await provider.async_primary.ping()
+        await provider.async_replicas[0].ping()
+        connections = [
+            *provider.async_pool._available_connections,
+            *provider.async_replicas[0].connection_pool._available_connections
+        ]
+        self.assertEqual(len(connections), 2)
+        self.assertTrue(all(c.is_connected for c in connections))
+
+        await database.async_configure()
+        self.assertFalse(any(c.is_connected for c in connections))
@@ -1,11 +1,17 @@
 # -*- coding: utf-8 -*-
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 import unittest
+from unittest.mock import patch
 
-from crud.controllers import EventController, SportController
-from crud.errors import ForeignKeyException, InstantiationException
-from crud.models import Sport, Event, Selection
+from crud import scripts
+from crud.controllers import EventController, SelectionController, SportController
+from crud.errors import (
+    ForeignKeyException, InstantiationException, MissingResultException, ValidationException
+)
+from crud.models import Sport, Event, Selection, connection, validate_on_init, write_on_init
 from crud.utils import get_current_time
+from crud.validators import Validator
 from test.utils import flush_all_dbs, generate_test_db
 
 
@@ -22,6 +28,98 @@ class TestEventModel(unittest.TestCase):
                 id=123123, name="someevent12313"
             )
 
+    def test_load(self):
+        sport = Sport.new(name="some sport")
+        new_event = Event.new(
+            name="some event",
+            type=Event.Types.INPLAY.value,
+            sport=sport.id,
+            status=Event.Statuses.STARTED.value,
+            scheduled_start=get_current_time() + timedelta(hours=5)
+        )
+
+        event_from_db = Event.new(id=new_event.id)
+
+        self.assertEqual(event_from_db.name, new_event.name)
+        self.assertEqual(event_from_db.type, new_event.type)
+        self.assertEqual(event_from_db.sport, sport.id)
+        self.assertEqual(event_from_db.status, new_event.status)
+        self.assertIsNone(event_from_db.actual_start)
+        self.assertEqual(event_from_db.selections, [])
+        self.assertEqual(event_from_db.slug, "some-event")
+
+    def test_load_is_read_only(self):
+        sport = Sport.new(name="some sport")
+        new_event = Event.new(
+            name="some event",
+            type=Event.Types.PREPLAY.value,
+            sport=sport.id,
+            status=Event.Statuses.PENDING.value,
+            scheduled_start=get_current_time() + timedelta(hours=5)
+        )
+        # Stored values are trusted, even ones which would no longer validate.
+        connection.execute_command("SET", f"event:{new_event.id}:scheduled_start", 0)
+
+        with patch.object(Event, "_exec_transaction") as exec_transaction:
+            event_from_db = Event.new(id=new_event.id)
+        exec_transaction.assert_not_called()
+
+        self.assertEqual(event_from_db.scheduled_start.year, 1970)
+        self.assertEqual(event_from_db.slug, "some-event")
+
+    def test_validation(self):
+        sport = Sport.new(name="some sport")
+
+        def _new_event(status: int):
+            return Event.new(
+                name="some event",
+                type=Event.Types.PREPLAY.value,
+                sport=sport.id,
+                status=status,
+                scheduled_start=get_current_time() + timedelta(hours=5)
+            )
+
+        _new_event(Event.Statuses.PENDING.value)
+        with self.assertRaises(ValidationException):
+            _new_event(123)
+
+        # The compiled validator is shared and the model's schema is left untouched.
+        self.assertIs(Validator.for_model(Event), Validator.for_model(Event))
+        self.assertIs(Event._validation_schema["status"]["allowed"], Event.Statuses)
+        self.assertNotIn("coerce", Event._validation_schema["status"])
+
+    def test_concurrent_validation(self):
+        sport = Sport.new(name="some sport")
+        write_token = write_on_init.set(False)
+        validate_token = validate_on_init.set(False)
+        try:
+            events = [
+                Event(
+                    id=i,
+                    name=f"some event {i}",
+                    type=Event.Types.PREPLAY.value,
+                    sport=sport.id,
+                    # Every other event is invalid.
+                    status=Event.Statuses.PENDING.value if i % 2 == 0 else 123,
+                    scheduled_start=get_current_time() + timedelta(hours=5)
+                )
+                for i in range(1000)
+            ]
+        finally:
+            validate_on_init.reset(validate_token)
+            write_on_init.reset(write_token)
+
+        def _validate(event: Event) -> bool:
+            try:
+                Validator.for_model(Event).validate_model(event)
+            except ValidationException:
+                return False
+            return True
+
+        with ThreadPoolExecutor(8) as executor:
+            results = list(executor.map(_validate, events))
+        self.assertEqual(results, [i % 2 == 0 for i in range(1000)])
+
 
 class TestEventController(unittest.TestCase):
     def setUp(self):
@@ -45,6 +143,8 @@ class TestEventController(unittest.TestCase):
         # Referenced Sport does not yet exist.
         with self.assertRaises(ForeignKeyException):
             _create_event(123123)
+        # Nothing is written when the foreign key check fails.
+        self.assertEqual(connection.execute_command("KEYS", "event:*"), [])
 
         new_sport = SportController.create_sport("some sport", active=True)
         new_event = _create_event(new_sport.id)
@@ -77,3 +177,89 @@ class TestEventController(unittest.TestCase):
 
         self.assertEqual(updated_event.status, event_from_db.status)
         self.assertEqual(event_from_db.status, Event.Statuses.STARTED.value)
+
+    def test_deactivate_cascade(self):
+        # Loaded beforehand, so that the cascades are sent with EVALSHA alone.
+        scripts.load(Event._exec)
+
+        sport = SportController.create_sport("cascading sport", active=True)
+        events = [
+            EventController.create_event(
+                name=f"cascading event {i}",
+                type=Event.Types.PREPLAY.value,
+                sport=sport.id,
+                status=Event.Statuses.PENDING.value,
+                scheduled_start=datetime.timestamp(get_current_time() + timedelta(hours=5))
+            )
+            for i in range(2)
+        ]
+        for event in events:
+            event.activate()
+        SportController.update_sport_events(sport.id, [event.id for event in events])
+
+        selections = [
+            SelectionController.create_selection(
+                name=f"cascading selection {i}", event=events[0].id, price=1.5,
+                outcome=Selection.Outcomes.UNSETTLED.value
+            )
+            for i in range(2)
+        ]
+        for selection in selections:
+            selection.activate()
+        EventController.update_event_selections(events[0].id, [s.id for s in selections])
+        self.assertEqual(Sport.active_children(sport.id, "events"), 2)
+        self.assertEqual(Event.active_children(events[0].id, "selections"), 2)
+
+        deactivated = EventController.deactivate_event(events[0].id)
+        self.assertEqual(deactivated.active, False)
+        for selection in selections:
+            self.assertEqual(Selection.new(id=selection.id).active, False)
+        self.assertEqual(Sport.new(id=sport.id).active, True)
+        self.assertEqual(Sport.active_children(sport.id, "events"), 1)
+        self.assertEqual(Event.active_children(events[0].id, "selections"), 0)
+
+        EventController.deactivate_event(events[1].id)
+        self.assertEqual(Sport.new(id=sport.id).active, False)
+
+        with self.assertRaises(MissingResultException):
+            EventController.deactivate_event(123123)
+
+    def test_deactivate_cascade_dangling_child(self):
+        sport = SportController.create_sport("dangling sport", active=True)
+        event = EventController.create_event(
+            name="dangling event",
+            type=Event.Types.PREPLAY.value,
+            sport=sport.id,
+            status=Event.Statuses.PENDING.value,
+            scheduled_start=datetime.timestamp(get_current_time() + timedelta(hours=5))
+        )
+        event.activate()
+        # A selection id left in the relation after the selection was removed.
+        connection.sadd(f"event:{event.id}:selections", 404404)
+        connection.sadd(f"event:{event.id}:active_selections", 404404)
+
+        EventController.deactivate_event(event.id)
+        self.assertEqual(connection.exists("selection:404404", "selection:404404:active"), 0)
+        self.assertEqual(Event.active_children(event.id, "selections"), 0)
+        self.assertEqual(Sport.new(id=sport.id).active, False)
+
+    def test_active_children(self):
+        sports = [SportController.create_sport(f"parent sport {i}") for i in range(2)]
+        event = EventController.create_event(
+            name="moving event",
+            type=Event.Types.PREPLAY.value,
+            sport=sports[0].id,
+            status=Event.Statuses.PENDING.value,
+            scheduled_start=datetime.timestamp(get_current_time() + timedelta(hours=5))
+        )
+        self.assertEqual(Sport.active_children(sports[0].id, "events"), 0)
+
+        event.activate()
+        self.assertEqual(Sport.active_children(sports[0].id, "events"), 1)
+
+        event = EventController.update_event(event.id, sport=sports[1].id)
+        self.assertEqual(Sport.active_children(sports[0].id, "events"), 0)
+        self.assertEqual(Sport.active_children(sports[1].id, "events"), 1)
+
+        event.deactivate()
+        self.assertEqual(Sport.active_children(sports[1].id, "events"), 0)
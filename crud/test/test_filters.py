@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+import unittest
+from unittest.mock import patch
+
+from crud import indexes, query
+from crud.controllers import SportController
+from crud.models import Event, Sport, connection
+from crud.errors import FilterException
+from crud.views import EventView, SelectionView, SportView, compile_filter, scan_count
+from test.utils import flush_all_dbs, generate_test_db
+
+
+class TestIndexes(unittest.TestCase):
+    def setUp(self):
+        generate_test_db()
+
+    def tearDown(self):
+        flush_all_dbs()
+
+    def test_literal_prefix(self):
+        self.assertEqual(indexes.literal_prefix("^Sport 1+"), "Sport 1")
+        self.assertEqual(indexes.literal_prefix("Sport 1?"), "Sport ")
+        self.assertEqual(indexes.literal_prefix("^(.*)$"), "")
+        self.assertEqual(indexes.literal_prefix("^Sport 1|Event"), "")
+
+    def test_indexed_comparison(self):
+        selections = SelectionView.get_selections_filtered("price:>=5")
+        self.assertEqual(len(selections), 5)
+        self.assertTrue(all(s.price >= 5 for s in selections))
+
+        selections = SelectionView.get_selections_filtered("price:<<5 AND regex:^Selection 1")
+        self.assertEqual([s.name for s in selections], ["Selection 1"])
+
+    def test_rename(self):
+        sport = SportController.create_sport("Unique Sport")
+        SportController.update_sport(sport.id, name="Renamed Sport")
+
+        self.assertEqual(SportView.get_sport_filtered("regex:^Unique"), [])
+        renamed = SportView.get_sport_filtered("regex:^Renamed")
+        self.assertEqual([s.id for s in renamed], [sport.id])
+
+    def test_rebuild(self):
+        connection.execute_command("DEL", indexes.ids_key(Sport), indexes.index_key(Sport, "name"))
+        self.assertEqual(indexes.rebuild(Sport, scan_count), 11)
+        self.assertEqual(len(SportView.get_sport_filtered("regex:^Sport 1+")), 2)
+
+
+class TestStreamingFilter(unittest.TestCase):
+    def setUp(self):
+        generate_test_db()
+
+    def tearDown(self):
+        flush_all_dbs()
+
+    def test_stream(self):
+        streamed = list(SportView.stream_sport_filtered("regex:^Sport 1+"))
+        self.assertEqual(sorted(s.name for s in streamed), ["Sport 1", "Sport 10"])
+
+        selections = list(SelectionView.stream_selections_filtered("price:>=5"))
+        self.assertEqual(len(selections), 5)
+
+    def test_limit_offset(self):
+        all_sports = list(SportView.stream_sport_filtered("regex:.*"))
+        self.assertEqual(len(all_sports), 11)
+
+        # Skipped models are never loaded.
+        with patch.object(Sport, "load_many", wraps=Sport.load_many) as load_many:
+            page = list(SportView.stream_sport_filtered("regex:.*", limit=2, offset=8))
+        self.assertEqual([s.id for s in page], [s.id for s in all_sports[8:10]])
+        self.assertEqual([call[0][0] for call in load_many.call_args_list], [[s.id for s in page]])
+
+
+class TestQueryPlanner(unittest.TestCase):
+    def setUp(self):
+        generate_test_db()
+
+    def tearDown(self):
+        flush_all_dbs()
+
+    def test_select(self):
+        sport_ids = indexes.all_ids(Sport)
+        selected = query.And([query.NameMatch("^Sport 1+")]).select(Sport, sport_ids, {})
+        self.assertEqual(
+            selected, [id for id in sport_ids if Sport.get(id, "name") in ("Sport 1", "Sport 10")]
+        )
+
+    def test_relation_length(self):
+        sport = SportController.create_sport("Busy Sport")
+        event_ids = indexes.all_ids(Event)[:3]
+        Sport.put(sport.id, "events", event_ids)
+
+        selected = query.And([query.RelationLength("events", ">=", 3)]).select(
+            Sport, indexes.all_ids(Sport), {}
+        )
+        self.assertEqual(selected, [sport.id])
+
+        busy = SportView.get_sport_filtered("regex:^Busy AND events:>>2")
+        self.assertEqual([s.id for s in busy], [sport.id])
+        self.assertEqual(sorted(busy[0].events), sorted(event_ids))
+
+
+class TestCompiledFilters(unittest.TestCase):
+    def setUp(self):
+        generate_test_db()
+
+    def tearDown(self):
+        flush_all_dbs()
+
+    def test_boolean_operators(self):
+        sports = SportView.get_sport_filtered("regex:^Sport 1$ OR regex:^Sport 2$")
+        self.assertEqual(sorted(s.name for s in sports), ["Sport 1", "Sport 2"])
+
+        sports = SportView.get_sport_filtered("NOT regex:^Sport 1 AND events<<5")
+        self.assertEqual(len(sports), 9)
+
+        sports = SportView.get_sport_filtered("(regex:^Sport 1+ OR regex:^Sport 2$) AND NOT regex:^(Sport 10)$")
+        self.assertEqual(sorted(s.name for s in sports), ["Sport 1", "Sport 2"])
+
+    def test_scalar_comparisons(self):
+        selections = SelectionView.get_selections_filtered("price>=2.0 AND price<<4")
+        self.assertEqual(sorted(s.price for s in selections), [2.0, 3.0])
+
+        events = EventView.get_events_filtered("status==1 OR status==2")
+        self.assertTrue(all(e.status in (1, 2) for e in events))
+        self.assertEqual(
+            len(events),
+            len(EventView.get_events_filtered("status>=1 AND NOT status==3"))
+        )
+
+        self.assertEqual(len(EventView.get_events_filtered("scheduled_start>>2000-01-01T00:00:00")), 20)
+        self.assertEqual(len(SelectionView.get_selections_filtered("active==0")), 10)
+
+    def test_compiled_filter_reuse(self):
+        compiled = compile_filter("sport", "regex:^Sport 1+")
+        self.assertIs(compiled, compile_filter("sport", "regex:^Sport 1+"))
+        self.assertEqual(len(SportView.get_sport_filtered(compiled)), 2)
+
+        SportController.create_sport("Sport 11")
+        self.assertEqual(len(SportView.get_sport_filtered(compiled)), 3)
+
+    def test_invalid_filters(self):
+        with self.assertRaises(FilterException):
+            SportView.get_sport_filtered("unknown>=1")
+        with self.assertRaises(FilterException):
+            SportView.get_sport_filtered("(regex:^Sport")
+        with self.assertRaises(FilterException):
+            SportView.get_sport_filtered("regex:^Sport AND")
+
+        # Names are not stored as numbers, so cannot be compared.
+        with self.assertRaises(FilterException):
+            SelectionView.get_selections_filtered("name==5")
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from crud import indexes
+from crud.layouts import HashLayout, KeyLayout, convert_relations, migrate
+from crud.models import Event, Selection, Sport, connection
+from crud.views import SelectionView, SportView, scan_count
+from test.utils import flush_all_dbs, generate_test_db
+
+
+class TestHashLayout(unittest.TestCase):
+    def setUp(self):
+        generate_test_db()
+
+    def tearDown(self):
+        Selection._layout = KeyLayout
+        flush_all_dbs()
+
+    def test_hash_layout(self):
+        Selection._layout = HashLayout
+        selection = Selection.new(
+            name="hashed", event=self._any_event_id(), price=2.5, outcome=Selection.Outcomes.WIN.value
+        )
+
+        self.assertEqual(
+            connection.execute_command("TYPE", f"selection:{selection.id}"), b"hash"
+        )
+        selection_from_db = SelectionView.get_selection(selection.id)
+        self.assertEqual(selection_from_db.name, "hashed")
+        self.assertEqual(selection_from_db.price, 2.5)
+        self.assertEqual(selection_from_db.outcome, Selection.Outcomes.WIN.value)
+        self.assertEqual(selection_from_db.active, False)
+
+    def test_migrate(self):
+        selections = SelectionView.get_selections_filtered("regex:.*")
+        self.assertEqual(len(selections), 10)
+
+        migrated = migrate(Selection, KeyLayout, HashLayout, scan_count)
+        self.assertEqual(migrated, 10)
+        self.assertEqual(
+            connection.execute_command("EXISTS", f"selection:{selections[0].id}:name"), 0
+        )
+
+        Selection._layout = HashLayout
+        migrated_selections = SelectionView.get_selections([s.id for s in selections])
+        for before, after in zip(selections, migrated_selections):
+            self.assertEqual(before.name, after.name)
+            self.assertEqual(before.event, after.event)
+            self.assertEqual(before.price, after.price)
+            self.assertEqual(before.outcome, after.outcome)
+
+        migrate(Selection, HashLayout, KeyLayout, scan_count)
+        Selection._layout = KeyLayout
+        self.assertEqual(len(SelectionView.get_selections_filtered("regex:.*")), 10)
+
+    def test_convert_relations(self):
+        # Relations as they were stored before they were sets.
+        sport = Sport.new(name="listed sport")
+        event_ids = sorted(indexes.all_ids(Event))[:3]
+        key = f"sport:{sport.id}:events"
+        connection.execute_command("RPUSH", key, *event_ids, event_ids[0])
+
+        self.assertEqual(convert_relations(Sport, scan_count), 1)
+        self.assertEqual(connection.execute_command("TYPE", key), b"set")
+        self.assertEqual(SportView.get_sport(sport.id).events, event_ids)
+        self.assertEqual(convert_relations(Sport, scan_count), 0)
+
+    @staticmethod
+    def _any_event_id():
+        key = connection.execute_command("KEYS", "event:*:name")[0]
+        return int(key.split(b":")[1])
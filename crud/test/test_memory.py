@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from keydb import KeyDB
+from redis.exceptions import ConnectionError, NoScriptError, ResponseError
+
+from crud import memory, scripts
+from crud.database import Settings
+from crud.memory import glob_pattern
+
+
+def server_connection():
+    # The server the tests are configured to use, if it is a real one and is running.
+    url = Settings.from_env().url
+    if url.startswith("memory://"):
+        return None
+    connection = KeyDB.from_url(url)
+    try:
+        connection.ping()
+    except ConnectionError:
+        return None
+    return connection
+
+
+class TestMemoryServer(unittest.TestCase):
+    def setUp(self):
+        self.pool = memory.connection_pool("memory://test-memory/0")
+        self.connection = KeyDB(connection_pool=self.pool)
+        self.connection.flushall()
+
+    def tearDown(self):
+        self.pool.disconnect()
+
+    def test_commands(self):
+        c = self.connection
+        self.assertTrue(c.set("a", 1))
+        self.assertEqual(c.mget("a", "missing"), [b"1", None])
+        self.assertEqual(c.execute_command("SMEMBERS a:members"), [])
+        self.assertEqual(c.sadd("s", 1, 2, 2), 2)
+        self.assertEqual(c.smembers("s"), {b"1", b"2"})
+        self.assertEqual(c.hset("h", mapping={"name": "x", "active": 1}), 2)
+        self.assertEqual(c.hgetall("h"), {b"name": b"x", b"active": b"1"})
+        self.assertEqual(c.lpush("l", 1, 2), 2)
+        self.assertEqual(c.lrange("l", 0, -1), [b"2", b"1"])
+        self.assertEqual(c.type("h"), b"hash")
+
+        with self.assertRaises(ResponseError):
+            c.get("s")
+        # Empty collections are removed.
+        c.srem("s", 1, 2)
+        self.assertEqual(c.exists("s"), 0)
+
+    def test_sorted_sets(self):
+        c = self.connection
+        c.zadd("z", {"a:1": 1, "b:2": 2, "c:3": 3})
+        self.assertEqual(c.zrangebyscore("z", "(1", "+inf"), [b"b:2", b"c:3"])
+        self.assertEqual(c.zrangebyscore("z", 2, 2), [b"b:2"])
+        self.assertEqual(c.zrangebylex("z", "[b", b"[b\xff"), [b"b:2"])
+        self.assertEqual(c.zrangebylex("z", "-", "+"), [b"a:1", b"b:2", b"c:3"])
+
+    def test_scan_returns_every_key_present_throughout(self):
+        c = self.connection
+        c.mset({f"key:{i}": i for i in range(100)})
+        found = set()
+        cursor = 0
+        while True:
+            cursor, keys = c.scan(cursor, match="key:*", count=7)
+            found.update(keys)
+            # Keys written during the scan do not push existing keys past the cursor.
+            c.set(f"other:{cursor}", 0)
+            if cursor == 0:
+                break
+        self.assertEqual(found, {f"key:{i}".encode("utf-8") for i in range(100)})
+
+    def test_transactions(self):
+        with self.connection.pipeline(transaction=True) as pipeline:
+            pipeline.set("a", 1)
+            pipeline.incr("a")
+            pipeline.get("a")
+            self.assertEqual(pipeline.execute(), [True, 2, b"2"])
+
+    def test_scripts(self):
+        with self.assertRaises(NoScriptError):
+            self.connection.evalsha(scripts.deactivate_cascade.sha, 0)
+        scripts.load(self.connection.execute_command)
+        self.assertEqual(self.connection.evalsha(scripts.deactivate_cascade.sha, 0, *[""] * 13), None)
+
+    def test_pubsub(self):
+        self.connection.config_set("notify-keyspace-events", "KA")
+        pubsub = self.connection.pubsub(ignore_subscribe_messages=True)
+        pubsub.psubscribe("__keyspace@0__:*")
+        pubsub.get_message(timeout=1)
+        self.connection.set("a", 1)
+        message = pubsub.get_message(timeout=1)
+        self.assertEqual(message["channel"], b"__keyspace@0__:a")
+        self.assertEqual(message["data"], b"set")
+        pubsub.close()
+
+    def test_glob_pattern(self):
+        self.assertTrue(glob_pattern(b"event:*:name").match(b"event:1:name"))
+        self.assertFalse(glob_pattern(b"event:*:name").match(b"event:1:names"))
+        self.assertTrue(glob_pattern(b"h[ae]llo?").match(b"hallo!"))
+        self.assertFalse(glob_pattern(b"h[^e]llo").match(b"hello"))
+        self.assertTrue(glob_pattern(b"a\\*").match(b"a*"))
+
+
+# The keys every script case starts from: a sport stored as a hash, one of its events
+# with a key per attribute, and the event's selections stored as hashes, one of which
+# no longer exists.
+script_fixture = [
+    ("HSET", "sport:1", "name", "Darts", "active", 1),
+    ("SADD", "sport:1:events", 2, 3),
+    ("SADD", "sport:1:active_events", 2),
+    ("ZADD", "sport:index:name", 0, "Darts:1"),
+    ("MSET", "event:2:name", "Final", "event:2:active", 1, "event:2:sport", 1),
+    ("SADD", "event:2:selections", 4, 5, 404),
+    ("SADD", "event:2:active_selections", 4, 5),
+    ("ZADD", "event:index:name", 0, "Final:2"),
+    ("HSET", "selection:4", "name", "Home", "active", 1, "event", 2),
+    ("HSET", "selection:5", "name", "Away", "active", 1, "event", 2)
+]
+
+deactivate_event = (
+    "event", "keys", 2, "selections", "selection", "hash", "sport", "sport", "hash", "events", "", "", ""
+)
+deactivate_selection = (
+    "selection", "hash", 4, "", "", "", "event", "event", "keys", "selections", "sport", "sport", "events"
+)
+
+# (description, commands run after the fixture, script, numkeys, arguments, result,
+#  the keys changed from the fixture, None for those removed)
+script_cases = [
+    ("cascade deactivating the parent", [], scripts.deactivate_cascade, 0, deactivate_event, 1, {
+        "event:2:active": "0",
+        "selection:4": {"name": "Home", "active": "0", "event": "2"},
+        "selection:5": {"name": "Away", "active": "0", "event": "2"},
+        "event:2:active_selections": None,
+        "sport:1:active_events": None,
+        "sport:1": {"name": "Darts", "active": "0"}
+    }),
+    ("cascade leaving an active sibling", [], scripts.deactivate_cascade, 0, deactivate_selection, 0, {
+        "selection:4": {"name": "Home", "active": "0", "event": "2"},
+        "event:2:active_selections": {"5"}
+    }),
+    ("cascade up to the grandparent's set", [("SREM", "event:2:active_selections", 5)],
+     scripts.deactivate_cascade, 0, deactivate_selection, 1, {
+        "selection:4": {"name": "Home", "active": "0", "event": "2"},
+        "event:2:active_selections": None,
+        "event:2:active": "0",
+        "sport:1:active_events": None
+    }),
+    ("cascade of a missing model", [], scripts.deactivate_cascade, 0,
+     ("event", "keys", 404) + deactivate_event[3:], None, {}),
+    ("name unchanged", [], scripts.remove_name, 2,
+     ("event:index:name", "event:2:name", "keys", 2, "Final"), 0, {}),
+    ("name replaced", [], scripts.remove_name, 2,
+     ("event:index:name", "event:2:name", "keys", 2, "Semi-final"), 1, {"event:index:name": None}),
+    ("name replaced in a hash", [], scripts.remove_name, 2,
+     ("sport:index:name", "sport:1", "hash", 1, "Snooker"), 1, {"sport:index:name": None}),
+    ("name of a missing model", [], scripts.remove_name, 2,
+     ("event:index:name", "event:404:name", "keys", 404, "Final"), 0, {})
+]
+
+
+def contents(connection) -> dict:
+    values = {}
+    for key in connection.keys("*"):
+        key_type = connection.type(key)
+        if key_type == b"string":
+            value = connection.get(key).decode("utf-8")
+        elif key_type == b"hash":
+            value = {k.decode("utf-8"): v.decode("utf-8") for k, v in connection.hgetall(key).items()}
+        elif key_type == b"set":
+            value = {member.decode("utf-8") for member in connection.smembers(key)}
+        else:
+            value = [
+                (member.decode("utf-8"), score)
+                for member, score in connection.zrange(key, 0, -1, withscores=True)
+            ]
+        values[key.decode("utf-8")] = value
+    return values
+
+
+class ScriptCases:
+    # Runs script_cases against self.connection, so that the Lua scripts on a real
+    # server and their Python implementations in memory.py are held to the same results.
+    connection = None
+
+    def test_script_cases(self):
+        for description, commands, script, numkeys, args, result, changed in script_cases:
+            with self.subTest(description):
+                self.connection.flushdb()
+                for command in script_fixture + commands:
+                    self.connection.execute_command(*command)
+                expected = contents(self.connection)
+                expected.update(changed)
+
+                self.assertEqual(self.connection.eval(script.source, numkeys, *args), result)
+                self.assertEqual(
+                    contents(self.connection),
+                    {key: value for key, value in expected.items() if value is not None}
+                )
+
+
+class TestScriptsInMemory(ScriptCases, unittest.TestCase):
+    def setUp(self):
+        self.pool = memory.connection_pool("memory://test-scripts/0")
+        self.connection = KeyDB(connection_pool=self.pool)
+
+    def tearDown(self):
+        self.connection.flushall()
+        self.pool.disconnect()
+
+
+@unittest.skipIf(server_connection() is None, "Needs a running server.")
+class TestScriptsOnServer(ScriptCases, unittest.TestCase):
+    def setUp(self):
+        self.connection = server_connection()
+
+    def tearDown(self):
+        self.connection.flushdb()
+        self.connection.close()
@@ -1,9 +1,11 @@
 # -*- coding: utf-8 -*-
 import unittest
+from unittest.mock import patch
 
+from crud import indexes, scripts
 from crud.controllers import SportController
-from crud.errors import InstantiationException
-from crud.models import Sport
+from crud.errors import InstantiationException, MissingResultException
+from crud.models import Event, Sport, connection
 from crud.views import SportView
 from test.utils import check_ascii, flush_all_dbs, generate_test_db
 
@@ -45,6 +47,21 @@ class TestSportsView(unittest.TestCase):
                 "selections:>=6"
             )
 
+    def test_get_sports(self):
+        first = SportController.create_sport("first sport")
+        second = SportController.create_sport("second sport", active=True)
+
+        sports = SportView.get_sports([second.id, first.id, second.id])
+        self.assertEqual(
+            [sport.id for sport in sports], [second.id, first.id, second.id]
+        )
+        self.assertEqual(sports[0].name, "second sport")
+        self.assertEqual(sports[0].active, True)
+        self.assertEqual(sports[1].name, "first sport")
+
+        with self.assertRaises(MissingResultException):
+            SportView.get_sports([first.id, 123123])
+
 
 class TestSportsController(unittest.TestCase):
     def setUp(self):
@@ -73,3 +90,98 @@ class TestSportsController(unittest.TestCase):
 
         self.assertEqual(sport_from_db.name, new_name)
         self.assertEqual(sport_from_db.active, True)
+
+    def test_only_changed_fields_are_written(self):
+        sport = SportController.create_sport("partial sport", active=False)
+        loaded = Sport.new(id=sport.id)
+
+        with patch.object(Sport, "_exec_transaction", wraps=Sport._exec_transaction) as exec_transaction:
+            loaded.put_model()
+            exec_transaction.assert_not_called()
+
+            loaded.activate()
+            commands = exec_transaction.call_args[0][0]
+
+        self.assertEqual(
+            [command[0] for command in commands], [f"SET sport:{sport.id}:active", "SADD"]
+        )
+        self.assertEqual(connection.get(f"sport:{sport.id}:active"), b"1")
+        self.assertEqual(loaded._dirty, {})
+
+    def test_update_sport_events(self):
+        sport = SportController.create_sport("relations sport")
+        event_ids = sorted(indexes.all_ids(Event))[:4]
+        key = f"sport:{sport.id}:events"
+
+        SportController.update_sport_events(sport.id, event_ids[:3])
+        self.assertEqual(Sport.new(id=sport.id).events, event_ids[:3])
+
+        with patch.object(Sport, "_exec_transaction", wraps=Sport._exec_transaction) as exec_transaction:
+            SportController.update_sport_events(sport.id, event_ids[:3])
+            exec_transaction.assert_not_called()
+
+            SportController.update_sport_events(sport.id, event_ids[1:])
+            commands = exec_transaction.call_args[0][0]
+
+        self.assertIn((f"SADD {key}", event_ids[3]), commands)
+        self.assertIn((f"SREM {key}", event_ids[0]), commands)
+        self.assertEqual(Sport.new(id=sport.id).events, event_ids[1:])
+        self.assertEqual(connection.scard(key), 3)
+
+        filtered = SportView.get_sport_filtered("events:==3")
+        self.assertEqual([s.id for s in filtered], [sport.id])
+
+    def test_relations_changed_in_place(self):
+        sport = SportController.create_sport("mutated sport")
+        event_ids = sorted(indexes.all_ids(Event))[:3]
+
+        loaded = Sport.new(id=sport.id)
+        loaded.events.append(event_ids[0])
+        loaded.put_model()
+        self.assertEqual(Sport.new(id=sport.id).events, event_ids[:1])
+
+        # The same list, changed and assigned back.
+        events = loaded.events
+        events.extend(event_ids[1:])
+        events.remove(event_ids[0])
+        loaded.events = events
+        loaded.put_model()
+        self.assertEqual(Sport.new(id=sport.id).events, event_ids[1:])
+
+        with patch.object(Sport, "_exec_transaction") as exec_transaction:
+            loaded.put_model()
+        exec_transaction.assert_not_called()
+
+    def test_new_sport_is_one_round_trip(self):
+        with patch.object(Sport, "_exec_pipeline", wraps=Sport._exec_pipeline) as exec_pipeline:
+            with patch.object(Sport, "_exec_transaction", wraps=Sport._exec_transaction) as exec_transaction:
+                sport = SportController.create_sport("round trip sport")
+        exec_pipeline.assert_not_called()
+        # A new model has no stored name to remove from the name index.
+        self.assertNotIn("EVALSHA", [command[0] for command in exec_transaction.call_args[0][0]])
+        self.assertEqual(indexes.names(Sport, "round trip"), [(sport.id, "round trip sport")])
+
+    def test_rename_from_stale_model(self):
+        sport = SportController.create_sport("first name")
+        stale = Sport.new(id=sport.id)
+        SportController.update_sport(sport.id, name="second name")
+
+        # The name removed from the index is the one stored, not the one stale loaded.
+        stale.name = "third name"
+        stale.put_model()
+        self.assertEqual(
+            [(id, name) for id, name in indexes.names(Sport) if id == sport.id], [(sport.id, "third name")]
+        )
+
+    def test_rename_loads_missing_script(self):
+        sport = SportController.create_sport("first name")
+        connection.execute_command("SCRIPT", "FLUSH")
+        with patch.object(Sport, "_exec_transaction", wraps=Sport._exec_transaction) as exec_transaction:
+            SportController.update_sport(sport.id, name="second name")
+        # The index and name keys are declared.
+        self.assertIn(
+            ("EVALSHA", scripts.remove_name.sha, 2, "sport:index:name", f"sport:{sport.id}:name"),
+            [command[:5] for command in exec_transaction.call_args[0][0]]
+        )
+        self.assertEqual(indexes.names(Sport, "second"), [(sport.id, "second name")])
+        self.assertEqual(indexes.names(Sport, "first"), [])
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from crud import stats
+from crud.controllers import SportController
+from crud.models import Sport
+from crud.views import SportView
+from test.utils import flush_all_dbs, generate_test_db
+
+
+class TestStats(unittest.TestCase):
+    def setUp(self):
+        generate_test_db()
+        self.recorder = stats.enable()
+        self.recorder.reset()
+
+    def tearDown(self):
+        stats.disable()
+        flush_all_dbs()
+
+    def test_commands_are_attributed_to_operations(self):
+        sport = SportController.create_sport("counted sport")
+        SportView.get_sport(sport.id)
+        list(SportView.stream_sport_filtered("regex:^counted"))
+
+        snapshot = self.recorder.export(stats.dict_sink)
+        # The write is a single transaction, and the view reads the model in one pipeline.
+        self.assertEqual(snapshot["round_trips"]["SportController.create_sport"]["MULTI"]["count"], 1)
+        self.assertEqual(snapshot["round_trips"]["SportView.get_sport"]["PIPELINE"]["count"], 1)
+        self.assertIn("SET", snapshot["commands"]["SportController.create_sport"]["sport"])
+        # Streams are attributed to the view however lazily they are consumed.
+        self.assertIn("SSCAN", snapshot["commands"]["SportView.stream_sport_filtered"]["sport"])
+        # Only the outermost operation is counted.
+        self.assertNotIn("Filter.stream", snapshot["commands"])
+
+        Sport.load(sport.id)
+        self.assertIn("-", self.recorder.snapshot()["commands"])
+
+    def test_sinks(self):
+        SportView.get_sport_filtered("regex:^Sport 1")
+        text = self.recorder.export(stats.prometheus_sink)
+        self.assertIn("# TYPE crud_round_trip_seconds histogram", text)
+        self.assertIn(
+            'crud_commands_total{operation="SportView.get_sport_filtered",model="sport",command="ZRANGEBYLEX"} 1',
+            text
+        )
+        self.assertIn(
+            'crud_round_trip_seconds_count{operation="SportView.get_sport_filtered",round_trip="ZRANGEBYLEX"} 1',
+            text
+        )
+        self.assertIn("SportView.get_sport_filtered: ", self.recorder.export(stats.summary))
+
+    def test_disabled(self):
+        stats.disable()
+        SportView.get_sport_filtered("regex:^Sport 1")
+        self.assertEqual(self.recorder.snapshot(), {"commands": {}, "round_trips": {}})
+
+    def test_command_model(self):
+        self.assertEqual(stats.command_model(("GET sport:1:name",), "-"), "sport")
+        self.assertEqual(stats.command_model(("SSCAN", "event:ids", 0), "-"), "event")
+        self.assertEqual(stats.command_model(("EVALSHA", "abc", 0), "selection"), "selection")
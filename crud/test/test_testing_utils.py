@@ -1,6 +1,10 @@
 # -*- coding: utf-8 -*-
+import random
 import unittest
 
+from crud import scripts
+from crud.models import Event, Selection, Sport
+from test import benchmarks
 from test.utils import (
     flush_all_dbs,
     generate_test_db,
@@ -34,3 +38,26 @@ class TestTestingUtils(unittest.TestCase):
         events = list(create_events(sports))
         result = list(create_selections(events, n))
         self.assertEqual(len(result), n)
+
+    def test_benchmarks(self):
+        random.seed(0)
+        report = benchmarks.run(n_sports=8, n_events=12, n_selections=8, iterations=2)
+        self.assertEqual(report["settings"]["iterations"], 2)
+        self.assertEqual(set(report["results"]["filter"]), set(benchmarks.filters))
+        self.assertEqual(report["results"]["load"]["sport"]["round_trips_per_op"], 1)
+        self.assertGreater(report["results"]["cascade"]["deactivate_event"]["ops_per_sec"], 0)
+        for name, result in report["results"]["filter"].items():
+            self.assertGreater(result["matches"], 0, name)
+
+    def test_benchmark_dataset(self):
+        sports, events, selections = benchmarks.generate(n_sports=2, n_events=4, n_selections=2)
+        scripts.load(Event._exec)
+        self.assertEqual(set(Sport.load(sports[0].id).events), {events[0].id, events[1].id})
+        self.assertEqual(Event.load(events[0].id).selections, [selections[0].id])
+        # Deactivating the second sport's only active event deactivates the sport.
+        self.assertTrue(Event.deactivate_cascade(events[2].id, parent="sport", children="selections"))
+        self.assertFalse(Sport.load(sports[1].id).active)
+        # The first event's selection is deactivated, but the first sport has another active event.
+        self.assertFalse(Event.deactivate_cascade(events[0].id, parent="sport", children="selections"))
+        self.assertFalse(Selection.load(selections[0].id).active)
+        self.assertTrue(Sport.load(sports[0].id).active)
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+import time
+import unittest
+from unittest.mock import patch
+
+from keydb import KeyDB
+from redis.exceptions import ConnectionError
+
+from crud import database, memory
+from crud.controllers import SportController
+from crud.models import Sport, connection
+from crud.tracking import ClientCache, command_key
+from crud.views import SportView
+from test.utils import flush_all_dbs, generate_test_db
+
+
+def wait_until_live(client_cache: ClientCache):
+    for _ in range(100):
+        if client_cache._live:
+            return
+        time.sleep(0.05)
+    raise AssertionError("The listener did not reconnect.")
+
+
+class TestClientCache(unittest.TestCase):
+    def setUp(self):
+        generate_test_db()
+        self.client_cache = database.enable_client_cache(size=100)
+
+    def tearDown(self):
+        database.disable_client_cache()
+        flush_all_dbs()
+
+    def test_reads_are_served_locally(self):
+        sport = SportController.create_sport("tracked sport")
+        # The invalidations of the writes arrive after them, and would drop the first read.
+        self.assertTrue(self.client_cache.sync())
+        self.assertEqual(Sport.get(sport.id, "name"), "tracked sport")
+        self.assertEqual(Sport.get(sport.id, "name"), "tracked sport")
+        self.assertEqual(self.client_cache.hits, 1)
+
+        filtered = SportView.get_sport_filtered("regex:^tracked")
+        self.assertEqual([s.id for s in filtered], [sport.id])
+
+    def test_other_clients_writes_invalidate(self):
+        sport = SportController.create_sport("tracked sport")
+        key = f"sport:{sport.id}:name"
+        Sport.get(sport.id, "name")
+
+        connection.set(key, "written elsewhere")
+        self.assertTrue(self.client_cache.sync())
+        self.assertEqual(Sport.get(sport.id, "name"), "written elsewhere")
+
+    def test_listener_reconnects(self):
+        sport = SportController.create_sport("tracked sport")
+        key = f"sport:{sport.id}:name"
+        self.assertIsNone(self.client_cache._listener.socket_timeout)
+
+        # Nothing is cached while the listener is away, as invalidations would be missed.
+        with patch.object(self.client_cache, "_subscribe", side_effect=ConnectionError("down")):
+            self.client_cache._lost()
+            Sport.get(sport.id, "name")
+            self.assertNotIn(key, self.client_cache._values)
+        wait_until_live(self.client_cache)
+
+        Sport.get(sport.id, "name")
+        connection.set(key, "written elsewhere")
+        self.assertTrue(self.client_cache.sync())
+        self.assertEqual(Sport.get(sport.id, "name"), "written elsewhere")
+
+    def test_reader_reconnects(self):
+        sport = SportController.create_sport("tracked sport")
+        key = f"sport:{sport.id}:name"
+        self.client_cache._reader.disconnect()
+
+        # The reconnected reader is tracked again.
+        Sport.get(sport.id, "name")
+        connection.set(key, "written elsewhere")
+        self.assertTrue(self.client_cache.sync())
+        self.assertEqual(Sport.get(sport.id, "name"), "written elsewhere")
+
+    def test_own_writes_invalidate(self):
+        sport = SportController.create_sport("tracked sport")
+        Sport.get(sport.id, "name")
+
+        SportController.update_sport(sport.id, name="renamed sport")
+        self.assertEqual(Sport.get(sport.id, "name"), "renamed sport")
+
+    def test_tracking_messages(self):
+        self.client_cache._values["sport:1:name"] = b"cached"
+        self.client_cache._values["sport:2:name"] = b"cached"
+
+        self.client_cache.handle([b"message", b"__redis__:invalidate", [b"sport:1:name"]])
+        self.assertNotIn("sport:1:name", self.client_cache._values)
+        self.assertIn("sport:2:name", self.client_cache._values)
+
+        self.client_cache.handle([b"message", b"__redis__:invalidate", None])
+        self.assertEqual(len(self.client_cache._values), 0)
+
+    def test_command_key(self):
+        self.assertEqual(command_key(("SET sport:1:name", "name")), "sport:1:name")
+        self.assertEqual(command_key(("SADD", "sport:ids", 1)), "sport:ids")
+
+
+class TestTracking(unittest.TestCase):
+    # CLIENT TRACKING end to end, which the memory server supports whatever CRUD_URL is.
+    def setUp(self):
+        self.pool = memory.connection_pool("memory://test-tracking/0")
+        self.connection = KeyDB(connection_pool=self.pool)
+        self.connection.flushall()
+        self.client_cache = ClientCache(self.pool, size=100)
+        self.client_cache.start()
+
+    def tearDown(self):
+        self.client_cache.stop()
+        self.pool.disconnect()
+
+    def test_invalidations(self):
+        self.assertEqual(self.client_cache.mode, "tracking")
+        self.connection.mset({"a": 1, "b": 2})
+        self.assertEqual(self.client_cache.get_many(["a", "b"]), [b"1", b"2"])
+
+        self.connection.set("a", 3)
+        self.assertTrue(self.client_cache.sync())
+        self.assertEqual(list(self.client_cache._values), ["b"])
+        self.assertEqual(self.client_cache.get("a"), b"3")
+
+        self.connection.flushall()
+        self.assertTrue(self.client_cache.sync())
+        self.assertEqual(len(self.client_cache._values), 0)
+
+    def test_listener_reconnects(self):
+        self.connection.set("a", 1)
+        self.client_cache.get("a")
+        self.client_cache._lost()
+        wait_until_live(self.client_cache)
+        self.assertEqual(self.client_cache.mode, "tracking")
+
+        # The reader is tracked with invalidations sent to the new listener.
+        self.assertEqual(self.client_cache.get("a"), b"1")
+        self.connection.set("a", 2)
+        self.assertTrue(self.client_cache.sync())
+        self.assertEqual(self.client_cache.get("a"), b"2")
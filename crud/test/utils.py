@@ -1,8 +1,11 @@
 # -*- coding: utf-8 -*-
+import argparse
 from datetime import datetime, timedelta
 import random
 
+from crud import bulk
 from crud.models import Sport, Event, Selection, connection
+from crud.utils import IDs
 
 
 def get_random_sport():
@@ -59,6 +62,19 @@ def create_selections(events, n=10):
         event_i += 1
 
 
+def link_children(parents, children, relation: str, key_name: str, active=None):
+    # Stores each child in its parent's relation, e.g. every event in its sport's events,
+    # and activates the children for whose index active(i) is true.
+    ids = {}
+    for i, child in enumerate(children):
+        if active is not None and active(i):
+            child.activate()
+        ids.setdefault(getattr(child, key_name), []).append(child.id)
+    for parent in parents:
+        setattr(parent, relation, ids.get(parent.id, []))
+        parent.put_model()
+
+
 def flush_all_dbs():
     connection.execute_command("FLUSHALL")
 
@@ -70,9 +86,62 @@ def generate_test_db():
     selections = [s for s in create_selections(events)]
 
 
+def generate_records(n_sports=11, events_per_sport=2, selections_per_event=2):
+    # Records for bulk.import_records, each sport followed by its events and each
+    # event by its selections, so that parents are always imported first.
+    types = [t.value for t in list(Event.Types)]
+    statuses = [s.value for s in list(Event.Statuses)]
+    outcomes = [o.value for o in list(Selection.Outcomes)]
+    scheduled_start = datetime.utcnow() + timedelta(days=500 * 500)
+
+    for i in range(0, n_sports):
+        sport = {"model": "sport", "id": IDs.generate_id(), "name": f"Sport {i}"}
+        yield sport
+        for j in range(0, events_per_sport):
+            event = {
+                "model": "event",
+                "id": IDs.generate_id(),
+                "name": f"Event {i}.{j}",
+                "scheduled_start": scheduled_start,
+                "sport": sport["id"],
+                "type": random.choice(types),
+                "status": random.choice(statuses)
+            }
+            yield event
+            for k in range(0, selections_per_event):
+                yield {
+                    "model": "selection",
+                    "name": f"Selection {i}.{j}.{k}",
+                    "event": event["id"],
+                    "price": float(k + 1),
+                    "outcome": random.choice(outcomes)
+                }
+
+
+def generate_bulk_db(n_sports=11, events_per_sport=2, selections_per_event=2,
+                     batch_size=bulk.batch_size, trusted=False) -> dict:
+    flush_all_dbs()
+    records = generate_records(n_sports, events_per_sport, selections_per_event)
+    return bulk.import_records(records, batch_size, trusted)
+
+
 def check_ascii(string):
     return all(ord(char) < 128 for char in string)
 
 
 if __name__ == "__main__":
-    generate_test_db()
+    # Flushes the configured database and fills it with test data.
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sports", type=int, default=None, help="import this many sports in bulk")
+    parser.add_argument("--events-per-sport", type=int, default=10)
+    parser.add_argument("--selections-per-event", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=bulk.batch_size)
+    parser.add_argument("--trusted", action="store_true", help="skip validation and foreign key checks")
+    args = parser.parse_args()
+
+    if args.sports is None:
+        generate_test_db()
+    else:
+        print(generate_bulk_db(
+            args.sports, args.events_per_sport, args.selections_per_event, args.batch_size, args.trusted
+        ))